@@ -4,147 +4,122 @@ Created on Wed Feb  5 08:28:22 2025
 GSS reCode Sheet with NORCSIZE, REALINC, & PRESTG10
 """
 
-import os 
-import pyreadstat
+import os
+import argparse
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
 
-os.chdir("C:/Data Projects/GSS/dashboard project")
-
-df, meta = pyreadstat.read_sas7bdat('C:/Dat_Sci/Datasets/GSS_sas/gss7222_r3.sas7bdat')
-
-trends = df[["YEAR", "SIZE", "XNORCSIZ", "AGE", "SEX", "EDUC", "PRESTG10", "REALINC",
-           "DEGREE", "RACE", "HAPPY", "TRUST", "HELPFUL", "FAIR", "HEALTH", "LIFE", 
-           "HAPMAR", "HAPCOHAB", "RELITEN", "GOD", "BIBLE", "REGION", "ATTEND", 
-           "PRAY", "HRS1", "SATJOB", "MOBILE16", "POLVIEWS", "PARTYID", "SOCREL", 
-           "SOCOMMUN", "SOCBAR", "SOCFREND", "CONEDUC", "CONFED", "CONMEDIC", "CONARMY",
-           "CONBUS", "CONCLERG", "CONFINAN", "CONJUDGE", "CONLABOR", 
-           "CONLEGIS", "CONPRESS", "CONSCI", "CONTV"]].copy()
-
-
-##############################################################################
-## Short save raw data table #################################################
-trends.to_csv("gss_rawdata.csv", index=False)
-trends = pd.read_csv("gss_rawdata.csv")
-##############################################################################
+from gss_dashboard_ingest import read_gss_columns, gss_file_columns
+from gss_dashboard_recodes import Recode, CodeLookup, compile_recodes
+from gss_dashboard_indexes import IndexSpec, build_indexes
+from gss_dashboard_impute import (get_imputer, ChainedEquationsImputer, year_codes, grouped_means,
+                                  fill_along_years)
+from gss_dashboard_cube import build_cube, distribution_table
+from gss_dashboard_survey import design_keys, weighted_estimates
+from gss_dashboard_bootstrap import bootstrap_bands
+from gss_dashboard_standardize import StandardizationRegistry
+from gss_dashboard_append import QuantileSketch, WaveState, grouped_sketches, rolling_quantiles
+from gss_dashboard_reliability import CovarianceCache
+from gss_dashboard_lineage import LineageGraph, release_diff
+from gss_dashboard_schema import memory_report
+from gss_dashboard_export import write_partitioned, append_partitions
+from gss_dashboard_tiles import write_bundle
+from gss_dashboard_geography import parse_region_states, state_dimension, region_dimension, region_facts
+from gss_dashboard_stages import Stage, Pipeline, file_fingerprint, hash_value
+from gss_dashboard_cache import load_stage, append_stage, load_with_appended
+
+PROJECT_DIR = "C:/Data Projects/GSS/dashboard project"
+GSS_SAS_FILE = 'C:/Dat_Sci/Datasets/GSS_sas/gss7222_r3.sas7bdat'
+Z_DATASET = "dashboard_z_measures" # YEAR-partitioned Parquet export (c.f., gss_dashboard_export)
+REGION_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "region_to_state.csv")
 
 """
-1. Raw variable recodes and index construction [line 60]
-    a. Recodes
+1. Raw variable recodes and index construction
+    a. Recodes                                  [stage: recodes]
         i. Numeric & index variables
         ii. Categorical variables
-    b. Construct Raw indexes [441]
-        i. Visualize distributions [line 596]
-    c. Save recoded raw data table 
-
-2. Standardize Measures and indices [637]
-    a. Standardize
-    b. Save as Z-score table [line 713]
-    
-3. Trend data construction
+    b. Construct Raw indexes                    [stages: item_indexes, wlb_index, qol_index]
+        i. Visualize distributions
+    c. Save recoded raw data table              [stage: dashboard_raw]
+
+2. Standardize Measures and indices             [stages: z_params, dashboard_z_measures]
+    a. Standardize with fitted means/sds (persisted in z_params)
+    b. Save as Z-score table (CSV, and a YEAR-partitioned Parquet dataset)
+    c. Yearly count/sum/sumsq by dashboard filter  [stage: dashboard_cube]
+    d. Yearly frequencies of every filter level    [stage: dashboard_distributions]
+    e. Region facts + state / region dimensions    [stages: dashboard_region_cube, dim_state, dim_region]
+
+3. Trend data construction                      [stages: trends_imputed, trend_indexes, trend_z_params,
+                                                          trend_scores, dashboard_yearly_trends]
     a. Use yearly means to impute missing values & Reconstruct Indices and trend measures using imputed data
-    B. Standardize Imputed Data
+       (or hot-deck / chained equations; multiple imputation: stage trends_mi)
+    B. Standardize Imputed Data                  (fitted means/sds persisted in trend_z_params)
     C. Aggregate for Yearly trend table
-    d. Save as yearly trend data [line 936]
+    d. Save as yearly trend data
+    e. Survey-weighted yearly trends with CIs  [stages: survey_design, dashboard_weighted_trends]
+    f. Bootstrap bands of the yearly trends     [stage: dashboard_trend_bands]
+
+4. Append a new wave (--append)                 [wave state: stage_cache/wave_state.npz]
+
+5. Column lineage / release diff (--diff-release) [stage: column_lineage]
+
+6. Static JSON tiles of every view (--tiles)    [<project dir>/tiles, c.f. gss_dashboard_tiles]
+
+Each part is a stage in a dependency graph (see build_pipeline() at the bottom).
+Stage outputs are cached in <project dir>/stage_cache and keyed by a hash of their
+code, their parameters below and the content of the columns they read, so a rerun
+only recomputes what changed: e.g., editing wlb_params recomputes wlb_raw, qol_raw
+and the tables built from them, but does not re-read the SAS file or redo the
+confidence indexes. With --compact the stage tables are stored in their smallest
+dtypes (float32 items, int16 YEAR, categorical labels; --memory-report lists the
+memory per stage).
 """
 
+# Only these ~50 of the ~6,600 cumulative-file columns are parsed; the file is
+# streamed in row chunks so memory scales with this list, not the full file.
+raw_columns = ["YEAR", "SIZE", "XNORCSIZ", "AGE", "SEX", "EDUC", "PRESTG10", "REALINC",
+           "DEGREE", "RACE", "HAPPY", "TRUST", "HELPFUL", "FAIR", "HEALTH", "LIFE",
+           "HAPMAR", "HAPCOHAB", "RELITEN", "GOD", "BIBLE", "REGION", "ATTEND",
+           "PRAY", "HRS1", "SATJOB", "MOBILE16", "POLVIEWS", "PARTYID", "SOCREL",
+           "SOCOMMUN", "SOCBAR", "SOCFREND", "CONEDUC", "CONFED", "CONMEDIC", "CONARMY",
+           "CONBUS", "CONCLERG", "CONFINAN", "CONJUDGE", "CONLABOR",
+           "CONLEGIS", "CONPRESS", "CONSCI", "CONTV",
+           "WTSSALL", "WTSSPS", "VSTRAT", "VPSU"]
+
+# survey weights (first available, per respondent) and variance design variables
+design_columns = ["YEAR", "WTSSPS", "WTSSALL", "VSTRAT", "VPSU"]
+
+
 ##############################################################################
-## Part Ia. 
-## i. Numeric Variable Recodes 
+## Recode parameters
 ##############################################################################
 
 ###### Confidence in institutions variables #################################
-conf_vars = ["CONEDUC", "CONFED", "CONMEDIC", "CONARMY", "CONBUS", 
+conf_vars = ["CONEDUC", "CONFED", "CONMEDIC", "CONARMY", "CONBUS",
              "CONCLERG", "CONFINAN", "CONJUDGE", "CONLABOR",
              "CONLEGIS", "CONPRESS", "CONSCI", "CONTV"]
 
-# recode in positive direction
-for var in conf_vars: 
-    trends[var.lower()] = 4 - trends[var] # 1 = "hardly any", 2 = "only some", 3 = "a great deal"
-    
-# drop original 
-trends.drop(conf_vars, axis = 1, inplace=True)
-
-###### Religiosity ##########################################################
-# First recode potential religiosity variables measured differently so that high numbers = high reliosity 
-
-# Frequency r prays
-trends["pray"] = 6 - trends["PRAY"] # reverse direction # 0 = "never", 5 = "several times/day"
-trends.drop(["PRAY"], axis = 1, inplace=True)
-
-# Frequency r attends religious service
-trends["attend"] = trends["ATTEND"] # already coded in the right direction # 0 = "never", 8 = "several times/week"
-trends.drop(["ATTEND"], axis = 1, inplace=True)
-
 # RELITEN = R's belief in religion
 reliten_recodes = {1: 3, # strong affiliation
-                   3: 2, # 'somewhat strong' 
+                   3: 2, # 'somewhat strong'
                    2: 1, # 'not very strong'
                    4: 0  # 'no religion'
 }
 
-trends["reliten"] = trends["RELITEN"].map(reliten_recodes) 
-trends.drop(["RELITEN"], axis = 1, inplace=True)
-
-# BIBLE = R's belief in the bible
-trends["bible"] = trends["BIBLE"].replace(4, np.nan) # omiting 4 (bible is "other") does not work inside map()
-
+# BIBLE = R's belief in the bible (4, bible is "other", is omitted)
 bible_recodes = {
     1: 3, # "word of god" -> high religiosity
     2: 2, # "inspired words"
     3: 1  # "ancient book" -> low religiosity
 }
 
-trends["bible"] = trends["bible"].map(bible_recodes)
-trends.drop(["BIBLE"], axis = 1, inplace=True)
-
-# R's confidence in the existence of God
-trends["god"] = trends["GOD"] - 1 # 5 = "no doubts"; 0 = "don't believe"
-trends.drop(["GOD"], axis = 1, inplace=True)
-
-
-#### HAPPINESS ##############################################################
-# General happiness
-trends["happy"] = 4 - trends["HAPPY"] # 3 = "very happy"; 1 = "not too happy"
-trends.drop(["HAPPY"], axis = 1, inplace=True)
-
-# Feelings about life
-trends["life"] = 4 - trends["LIFE"] # 3 = "Exciting"; 1 = "Dull"
-trends.drop(["LIFE"], axis = 1, inplace=True)
-
-# Happily married
-trends["hapmar"] = 4 - trends["HAPMAR"] # 3 = "very happy"; 1 = "not too happy"
-trends.drop(["HAPMAR"], axis = 1, inplace=True)
-
-# Happily cohabitating (for those partned but not married)
-trends["hapcohab"] = 4 - trends["HAPCOHAB"] # 3 = "Exciting"; 1 = "Dull"
-trends.drop(["HAPCOHAB"], axis = 1, inplace=True)
-
-# Make raw Haprelate variable
-# initialize a column for a conditional operation
-trends["haprelate"] = np.nan
-
-# Include hapmar for married respondents
-trends.loc[(trends["hapmar"].notna()), "haprelate"] = trends["hapmar"]
-
-# Include hapcohab for respondents with a valid 'hapcohab' value
-trends.loc[(trends["hapmar"].isna()) & trends["hapcohab"].notna(), "haprelate"] = trends["hapcohab"]
-trends["hapmar"].describe()
-trends["hapcohab"].describe()
-trends["haprelate"].describe()
-
-
-##### SOCIAL ATTITUDES #######################################################
 # Trust
 trust_recodes = {
     1: 3, # "most people can be trusted" -> high trust
     2: 1, # "cant be too careful" -> low trust
     3: 2  # "depends" -> ambivalent
 }
-trends["trust"] = trends["TRUST"].map(trust_recodes)
-trends.drop(["TRUST"], axis = 1, inplace=True)
 
 # Helpful
 helpful_recodes = {
@@ -152,8 +127,6 @@ helpful_recodes = {
     2: 1, # "people look after themselves" -> low trust
     3: 2  # "depends" -> ambivalent
 }
-trends["helpful"] = trends["HELPFUL"].map(trust_recodes)
-trends.drop(["HELPFUL"], axis = 1, inplace=True)
 
 # Fair recodes are ordered different
 fair_recodes = {
@@ -162,186 +135,183 @@ fair_recodes = {
     3: 2  # "depends" -> ambivalent
 }
 
-trends["fair"] = trends["FAIR"].map(fair_recodes)
-trends.drop(["FAIR"], axis = 1, inplace=True)
-
-##### Social Relationships Index #############################################
 soc_vars = ["SOCREL", "SOCOMMUN", "SOCBAR", "SOCFREND"]
 
-for var in soc_vars: 
-    trends[var.lower()] = 7 - trends[var] # recode each variable to be 0 = "never," 6 = "almost daily" with lower case name
-    trends.drop(var, axis = 1, inplace=True)
-    
-# change variable list to lower case for later
-soc_vars = [var.lower() for var in soc_vars]
-
-##### Work/Life Balance #####################################################
-trends["hrs1"] = trends["HRS1"]
-
-# recode job satisfaction
-trends["satjob"] = 5 - trends["SATJOB"] # reverse order so "very satisfied" is highest. 4 = "very satisfited", 1 = "very dissatisfied"
-
-trends.drop(["HRS1", "SATJOB"], axis=1, inplace=True)
-
-##### HEALTH ################################################################
-trends["health"] = 5 - trends["HEALTH"] # reverse code # 1 = "poor", 4 = "excellent" 
-
-trends.drop(["HEALTH"], axis=1, inplace=True)
-
-##### EDUC ##################################################################
-trends["educ"] = trends["EDUC"] # numeric years of school
-trends.drop(["EDUC"], axis = 1, inplace = True)
-
-
-##### Socioeconomic Status (numeric) #########################################
-
-ses_vars = ["educ", "PRESTG10", "REALINC"] 
 # prestig10 is occupational prestige updated to a 2010 standard; Realinc is total family income in 1986 dollars.
+ses_vars = ["educ", "PRESTG10", "REALINC"]
 
-scaler = StandardScaler() # using Scikitlearn standardization function
-
-trends[[var + "_z" for var in ses_vars]] = scaler.fit_transform(trends[ses_vars])
-#    def standardize(x):
-#       return (x - x.mean()) / x.std()
-#    trends[ses_vars] = standardize(trends[ses_vars]) does the same thing
-    
-trends[[var + "_z" for var in ses_vars]] = scaler.fit_transform(trends[ses_vars])
-
-trends["ses_index"] = trends[[var + "_z" for var in ses_vars]].mean(axis=1, skipna = True)
-
-trends["num_ses_vars"] = trends[ses_vars].notna().sum(axis=1)
-trends.loc[trends["num_ses_vars"] < 3, "ses_index"] = np.nan # if one of three is nan, then ses is nan. 
-print(trends["ses_index"].describe())
+gender_map = {1: "Male", 2: "Female"}
 
-trends.drop(["PRESTG10", "REALINC", "educ_z", "PRESTG10_z", "REALINC_z"], axis = 1, inplace = True)
+"""GSS codes: 0: "Strong Democrat", 1: "Loose Democrat", 2: "Left Independent", 3: "Center Independent",
+4: "Right Independent", 5: "Loose Republican", 6: "Strong Republican", 7: "Other Party"
+"""
+party_map = {0: "Strong Democrat",
+             1: "Loose Democrat",
+             2: "Left Independent",
+             3: "Center Independent",
+             4: "Right Independent",
+             5: "Loose Republican",
+             6: "Strong Republican",
+             7: "Other Party"}
 
-# Plot 
-plt.figure(figsize = (8,5))
-plt.hist(trends["ses_index"].dropna(), bins=16, color='salmon', edgecolor='black')
-plt.title('Distribution of SES')
-plt.grid(axis='y')
-plt.show()
+""" Original: 1 = "Extremely liberal", 2 = "Liberal",
+3 = "slightly liberal", 4 = "moderate", 5 = "slightly conservative",
+6 - 7 = "conservative" and "extremely conservative"
+"""
+pol_view_map = {1: "Extremely Liberal",
+             2: "Liberal",
+             3: "Slightly Liberal",
+             4: "Moderate",
+             5: "Slightly Conservative",
+             6: "Conservative",
+             7: "Extremely Conservative"}
 
+region_map = {1: "New_England",
+              2: "Mid_Atlantic",
+              3: "East_North_Central",
+              4: "West_North_Central",
+              5: "South_Atlantic",
+              6: "East_South_Atlantic",
+              7: "West_South_Central",
+              8: "Mountain",
+              9: "Pacific"}
 
-#############################################################################
-## Part 1a. 
-## ii. CATEGORICAL RECODES 
-#############################################################################
+place_categories = ["Metropolis", "Large City", "Medium City", "Suburb",
+                    "Urban Unincorporated", "Small City", "Rural"]
 
-### SES Cateogries ##########################################################
-# construct ses categories for dimension filter
-# Define conditions
-lower_30 = trends["ses_index"].quantile(0.30)
-upper_70 = trends["ses_index"].quantile(0.70)
-
-conditions = [
-    trends["ses_index"] < lower_30,
-    (trends["ses_index"] >= lower_30) & (trends["ses_index"] <= upper_70),
-    trends["ses_index"] > upper_70
-]
+mobility_map = {1: "Same_place",
+                2: "Same_state_new_city",
+                3: "Diff_state"}
 
-# Corresponding categories
-choices = ["Low SES", "Mid SES", "High SES"]
+race_map = {1: "White",
+            2: "Black",
+            3: "Other_race"}
 
-# Apply conditions
-trends["ses_category"] = np.select(conditions, choices, default=np.nan)
+degree_map = {0: "Less_than_HS",
+              1: "High_School",
+              2: "Associate_JC",
+              3: "Bachelors",
+              4: "Graduate"}
 
-# Check category distribution
-print(trends["ses_category"].value_counts(normalize=True))
+# Age categories for demographic parameter selection
+age_bins = [18, 29, 39, 49, 65, 130]
+age_labels = ["18-29", "30-39", "40-49", "50-64", "65+"]
 
+###### Index parameters (c.f., "index analyses" for alpha, factor analysis, and threshold tests)
+conf_items = [var.lower() for var in conf_vars]
 
-### Gender ##################################################################
-gender_map = {1: "Male", 2: "Female"}
-trends["gender"] = trends["SEX"].map(gender_map)
+# C.f., Factor Analysis "index analysis" sheet
+factor1 = ["conmedic", "conarmy", "conbus", "confinan", "conjudge"]
+factor2 = ["confed", "conlegis"]
+factor3 = ["conpress", "contv"]
 
-trends.drop("SEX", axis = 1, inplace = True)
+relig_vars = ["attend", "pray", "god", "bible", "reliten"]
+hap_vars = ["happy", "life", "haprelate"]
+soc_att_vars = ["trust", "helpful", "fair"]
+soc_items = ["socbar", "socommun", "socfrend", "socrel"]
+wlb_vars = ["hrs1", "satjob"]
 
-trends["gender"].value_counts()
-trends["gender"].isna().sum()
+# raw items imputed for the trend table (Part 3a)
+trend_impute_vars = conf_items + relig_vars + hap_vars + soc_att_vars + soc_items + wlb_vars + ["health", "educ"]
 
+# Part 3a imputation engine (gss_dashboard_impute.IMPUTERS): "year_mean" is the
+# original yearly-mean fill; "hot_deck" (args: cells, seed) and "chained" keep
+# the within-year variance that the year-mean fill flattens
+trend_imputer = "year_mean"
+trend_imputer_args = {}
 
-###### Political Party #####################################################
-"""GSS codes: 0: "Strong Democrat", 1: "Loose Democrat", 2: "Left Independent", 3: "Center Independent", 
-4: "Right Independent", 5: "Loose Republican", 6: "Strong Republican", 7: "Other Party"
-"""
-party_map = {0: "Strong Democrat", 
-             1: "Loose Democrat", 
-             2: "Left Independent", 
-             3: "Center Independent", 
-             4: "Right Independent", 
-             5: "Loose Republican", 
-             6: "Strong Republican", 
-             7: "Other Party"}
-    
-trends["party"] = trends["PARTYID"].map(party_map)
+# multiple imputation of the yearly item means (stage trends_mi, run on request)
+mi_params = {"m": 20, "iterations": 5, "seed": 2025}
 
-trends["party"].value_counts()
-trends["party"].isna().sum()
-trends["party"].groupby(trends["YEAR"]).value_counts()
+# bootstrap percentile bands of the yearly *_trend means (Part 3f)
+bootstrap_params = {"n_reps": 1000, "level": 0.95, "seed": 2025}
 
+# Work-life balance: minimum weekly hours to count as part of the work force;
+# hours above mean + outlier_sd * std are trimmed as outliers
+wlb_params = {"min_hours": 10, "outlier_sd": 3}
 
-######## Political Party Centered (Numeric) ##################################
-# This variable does not end up getting used. 
-trends["party_centered"] = trends["PARTYID"].replace(7, np.nan) - 3
 
-trends["party_centered"].value_counts()
+##############################################################################
+## Ingest
+##############################################################################
 
-trends.drop(["PARTYID"], axis = 1, inplace=True)
+def load_gss_raw(path, columns, source, chunksize=10000, multiprocess=False, num_processes=4):
+    """ Stage gss_rawdata: dashboard columns of the cumulative SAS file.
+    source (the file fingerprint) only feeds the stage key. """
+    return read_gss_columns(path, columns, chunksize=chunksize,
+                            multiprocess=multiprocess, num_processes=num_processes)
 
 
-###### Political Views ######################################################
-""" Original: 1 = "Extremely liberal", 2 = "Liberal", 
-3 = "slightly liberal", 4 = "moderate", 5 = "slightly conservative", 
-6 - 7 = "conservative" and "extremely conservative"
+##############################################################################
+## Part Ia.
+## Recode table: i. Numeric & index variables, ii. Categorical variables
+##############################################################################
+""" Every recode is one row of recode_spec (c.f., gss_dashboard_recodes). The table
+is compiled into lookup arrays and applied in a single pass that builds the recoded
+frame once. Recodes that need more than one column (SES, place size) are derived
+from the columns recoded above them.
 """
-pol_view_map = {1: "Extremely Liberal",
-             2: "Liberal", 
-             3: "Slightly Liberal", 
-             4: "Moderate", 
-             5: "Slightly Conservative", 
-             6: "Conservative", 
-             7: "Extremely Conservative"}
-    
-trends["polview"] = trends["POLVIEWS"].map(pol_view_map)
-
-trends["polview"].value_counts()
-trends["polview"].isna().sum()
-trends["polview"].groupby(trends["YEAR"]).value_counts()
 
+##### Socioeconomic Status (numeric) #########################################
+def ses_components(columns, raw, ses_vars):
+    return pd.DataFrame({var: columns[var] if var in columns else raw[var].to_numpy(dtype=float)
+                         for var in ses_vars})
 
-###### Political Views Centered (Numeric) ####################################
-trends["pol_centered"] = trends["POLVIEWS"] - 4
-
-trends["pol_centered"].value_counts()
-trends["pol_centered"].isna().sum()
-
-trends.drop(["POLVIEWS"], axis = 1, inplace=True)
 
+def ses_index(columns, raw, ses_vars, moments = None):
+    """ Mean of the standardized SES components (population sd, as StandardScaler).
+    moments: reference component means/sds (appended waves); default: fitted here. """
+    values = ses_components(columns, raw, ses_vars)
+    moments = moments or StandardizationRegistry().fit(values)
+    z = pd.DataFrame({var: moments.zscore(values[var], ddof = 0) for var in ses_vars})
+    return z.to_numpy().mean(axis=1) # if one of three is nan, then ses is nan.
 
-##### Region #################################################################
-region_map = {1: "New_England",  
-              2: "Mid_Atlantic", 
-              3: "East_North_Central", 
-              4: "West_North_Central", 
-              5: "South_Atlantic", 
-              6: "East_South_Atlantic",
-              7: "West_South_Central", 
-              8: "Mountain", 
-              9: "Pacific"}
 
-trends["region"] = trends["REGION"].map(region_map)
+def count_valid(columns, raw, variables):
+    values = [columns[var] if var in columns else raw[var].to_numpy(dtype=float) for var in variables]
+    return sum((~np.isnan(np.asarray(v, dtype=float))).astype(np.int64) for v in values)
 
-trends.drop(["REGION"], axis = 1, inplace=True)
 
-trends["region"].value_counts()
-trends["region"].isna().sum()
-trends["region"].groupby(trends["YEAR"]).value_counts()
+### SES Cateogries ##########################################################
+""" Pooled cuts (the default) split every year at the 1972-2022 quantiles, so "Low
+SES" drifts in meaning across decades. With per_year, each wave is cut at its own
+quantiles (window > 1: pooled with the window - 1 waves before it), read off one
+QuantileSketch per year (c.f., gss_dashboard_append), built in one pass. Per-year
+cuts are within one sketch bin (0.001 sd) of the exact quantiles, and a new
+wave only adds its own sketch.
+"""
+ses_sketch_grid = (-6, 6, 12000) # ses_index in z units, 0.001 bins
+ses_cut_params = {"per_year": False, "window": 1}
+
+
+def ses_year_cuts(ses, year, quantiles, window = 1, history = None):
+    """ (rows x 2) lower / upper cut of each row's year; history: {year: QuantileSketch} of earlier waves. """
+    sketches = {**(history or {}), **grouped_sketches(ses, year, *ses_sketch_grid)}
+    year_codes, years = pd.factorize(np.asarray(year, dtype = float), sort = True)
+    cuts = rolling_quantiles(sketches, quantiles, window, groups = set(years))
+    table = np.vstack([cuts[y] for y in years] + [[np.nan] * len(quantiles)]) # last row: year missing
+    return table[year_codes]
+
+
+def ses_category(columns, raw, quantiles, labels, cuts = None, per_year = False, window = 1, history = None):
+    """ Low / Mid / High SES split at the ses_index quantiles (pooled, or per year).
+    cuts: reference pooled cut points (appended waves); default: the quantiles of these rows.
+    history: per-year sketches of earlier waves (appended waves with a rolling window). """
+    ses = columns["ses_index"]
+    if per_year:
+        row_cuts = ses_year_cuts(ses, columns["YEAR"], quantiles, window, history)
+        lower_30, upper_70 = row_cuts[:, 0], row_cuts[:, 1]
+    else:
+        lower_30, upper_70 = np.nanquantile(ses, quantiles) if cuts is None else cuts
+    codes = (ses >= lower_30).astype(np.int16) + (ses > upper_70)
+    codes[np.isnan(ses) | np.isnan(lower_30)] = -1
+    return pd.Categorical.from_codes(codes, categories = labels, ordered = True)
 
 
 ##### CITY SIZE ##############################################################
 # USE SIZE & XNORCSIZ # There are a few place/size measures. Unfortunately, when comparing data across variables, the place size and labels do not always add up
 
-""" SIZE = x * 1000; 
+""" SIZE = x * 1000;
     XNORSIZ Codes:
     1: "Large central city (>250k)",
     2: "Med central city (50-250k)",
@@ -353,243 +323,175 @@ trends["region"].groupby(trends["YEAR"]).value_counts()
     8: "small town or village",
     9: "1-2.5k",
     10: "Open Country"
-""" 
-conditions = [
-    (trends['XNORCSIZ'] == 1) & (trends['SIZE'] >= 1000),
-    (trends['XNORCSIZ'] == 1) & (trends['SIZE'] <1000),
-    (trends['XNORCSIZ'] == 2),
-    (trends['XNORCSIZ'].isin([3, 4])),
-    (trends['XNORCSIZ'].isin([5, 6])),
-    (trends['XNORCSIZ'] == 7),
-    (trends['XNORCSIZ'].isin([8, 9, 10]))
-]
-
-choices = [
-    "Metropolis",
-    "Large City",
-    "Medium City",
-    "Suburb",
-    "Urban Unincorporated",
-    "Small City",
-    "Rural"
+"""
+# XNORCSIZ code -> place category; large central cities (1) split on SIZE
+place_map = {1: "Metropolis", 2: "Medium City", 3: "Suburb", 4: "Suburb",
+             5: "Urban Unincorporated", 6: "Urban Unincorporated", 7: "Small City",
+             8: "Rural", 9: "Rural", 10: "Rural"}
+metropolis_size = 1000 # SIZE >= 1,000 (thousands): Metropolis, else Large City
+
+
+def place_category(columns, raw, categories, place_map, metropolis_size):
+    """ Place size from one XNORCSIZ lookup; SIZE splits large central cities by searchsorted. """
+    lookup = CodeLookup({code: categories.index(label) for code, label in place_map.items()},
+                        missing = -1, dtype = np.int64)
+    codes = lookup(raw["XNORCSIZ"])
+    size = raw["SIZE"].to_numpy(dtype = float)
+    # 0: SIZE >= metropolis_size, 1: below it (-> "Large City"), -1: SIZE missing
+    split = np.where(np.isnan(size), -1, 1 - np.searchsorted([metropolis_size], size, side = "right"))
+    big = codes == categories.index(place_map[1])
+    codes[big] = np.where(split[big] < 0, -1, codes[big] + split[big])
+    return pd.Categorical.from_codes(codes, categories = categories, ordered = True)
+
+
+recode_spec = [
+    Recode("YEAR", "YEAR"),
+
+    ###### Confidence in institutions: recode in positive direction
+    # 1 = "hardly any", 2 = "only some", 3 = "a great deal"
+    *[Recode(var.lower(), var, reverse = 4) for var in conf_vars],
+
+    ###### Religiosity: high numbers = high reliosity
+    Recode("pray", "PRAY", reverse = 6), # 0 = "never", 5 = "several times/day"
+    Recode("attend", "ATTEND"), # already coded in the right direction # 0 = "never", 8 = "several times/week"
+    Recode("reliten", "RELITEN", code_map = reliten_recodes),
+    Recode("bible", "BIBLE", code_map = bible_recodes, na_codes = [4]), # omit 4 (bible is "other")
+    Recode("god", "GOD", offset = -1), # 5 = "no doubts"; 0 = "don't believe"
+
+    #### HAPPINESS
+    Recode("happy", "HAPPY", reverse = 4), # 3 = "very happy"; 1 = "not too happy"
+    Recode("life", "LIFE", reverse = 4), # 3 = "Exciting"; 1 = "Dull"
+    Recode("hapmar", "HAPMAR", reverse = 4), # 3 = "very happy"; 1 = "not too happy"
+    Recode("hapcohab", "HAPCOHAB", reverse = 4), # for those partned but not married
+    # haprelate: hapmar for married respondents, else a valid hapcohab
+    Recode("haprelate", coalesce = ["hapmar", "hapcohab"]),
+
+    ##### SOCIAL ATTITUDES
+    Recode("trust", "TRUST", code_map = trust_recodes),
+    Recode("helpful", "HELPFUL", code_map = helpful_recodes),
+    Recode("fair", "FAIR", code_map = fair_recodes),
+
+    ##### Social Relationships: 0 = "never," 6 = "almost daily"
+    *[Recode(var.lower(), var, reverse = 7) for var in soc_vars],
+
+    ##### Work/Life Balance, Health, Educ
+    Recode("hrs1", "HRS1"),
+    Recode("satjob", "SATJOB", reverse = 5), # "very satisfied" is highest. 4 = "very satisfited", 1 = "very dissatisfied"
+    Recode("health", "HEALTH", reverse = 5), # 1 = "poor", 4 = "excellent"
+    Recode("educ", "EDUC"), # numeric years of school
+
+    ##### Socioeconomic Status (numeric)
+    Recode("ses_index", ["PRESTG10", "REALINC"], derive = ses_index, args = {"ses_vars": ses_vars}, reads = ["educ"]),
+    Recode("num_ses_vars", ["PRESTG10", "REALINC"], derive = count_valid, args = {"variables": ses_vars},
+           reads = ["educ"]),
+
+    ##### ii. Categorical recodes (ordered categoricals for the dashboard filters)
+    Recode("ses_category", derive = ses_category, reads = ["ses_index", "YEAR"],
+           args = {"quantiles": [0.30, 0.70], "labels": ["Low SES", "Mid SES", "High SES"], **ses_cut_params}),
+    Recode("gender", "SEX", labels = gender_map),
+    Recode("party", "PARTYID", labels = party_map),
+    Recode("party_centered", "PARTYID", offset = -3, na_codes = [7]), # This variable does not end up getting used.
+    Recode("polview", "POLVIEWS", labels = pol_view_map),
+    Recode("pol_centered", "POLVIEWS", offset = -4),
+    Recode("region", "REGION", labels = region_map),
+    Recode("place_category", ["XNORCSIZ", "SIZE"], derive = place_category,
+           args = {"categories": place_categories, "place_map": place_map, "metropolis_size": metropolis_size}),
+    Recode("mobile16", "MOBILE16", labels = mobility_map),
+    Recode("race", "RACE", labels = race_map),
+    Recode("degree", "DEGREE", labels = degree_map),
+    Recode("age_group", "AGE", bins = age_bins, labels = age_labels),
 ]
 
-trends['place_category'] = np.select(conditions, choices, default=None)
-
-# Check the distribution
-print(trends['place_category'].value_counts())
-
-trends.drop(["XNORCSIZ", "SIZE"], axis=1, inplace=True)
 
+def part1a_recodes(trends, spec):
+    """ Stage recodes: recoded items, SES and categorical dimensions. """
+    trends = compile_recodes(spec)(trends)
 
-###### Mobility since age 16 #################################################
+    print(trends["ses_index"].describe())
+    # Check category distributions (counts and shares, missing included)
+    print(distribution_table(trends, ["ses_category", "place_category"], year = None))
+    return trends
 
-mobility_map = {1: "Same_place",  
-                2: "Same_state_new_city",
-                3: "Diff_state"}
-    
-trends["mobile16"] = trends["MOBILE16"].map(mobility_map)
-
-trends.drop(["MOBILE16"], axis = 1, inplace=True)
-
-trends["mobile16"].value_counts()
-trends["mobile16"].isna().sum()
-trends["mobile16"].groupby(trends["YEAR"]).value_counts()
-
-
-###### Race #################################################################
-race_map = {1: "White", 
-            2: "Black", 
-            3: "Other_race"}
-
-trends["race"] = trends["RACE"].map(race_map)
-
-trends.drop(["RACE"], axis = 1, inplace=True)
-
-trends["race"].value_counts()
-trends["race"].isna().sum()
-trends["race"].groupby(trends["YEAR"]).value_counts()
-
-
-########## Degree ############################################################
-
-degree_map = {0: "Less_than_HS", 
-              1: "High_School",
-              2: "Associate_JC", 
-              3: "Bachelors", 
-              4: "Graduate"}
-
-trends["degree"] = trends["DEGREE"].map(degree_map)
-
-trends["degree"].value_counts()
-trends["degree"].isna().sum()
-trends["degree"].groupby(trends["YEAR"]).value_counts()
-
-trends.drop(["DEGREE"], axis = 1, inplace=True)
-
-
-#### AGE Group ###############################################################
-# Age categories for demographic parameter selection
-
-age_bins = [18, 29, 39, 49, 65, 130]
-age_labels = ["18-29", "30-39", "40-49", "50-64", "65+"]
-trends["age_group"] = pd.cut(trends["AGE"], bins = age_bins, labels = age_labels, right = True)
-
-trends.drop(["AGE"], axis = 1, inplace=True)
 
 ##############################################################################
-### Part 1B. 
-### Include Raw Indices 
+### Part 1B.
+### Include Raw Indices
 ##############################################################################
-""" 
-See "index analyses" for alpha, factor analysis, and threshold tests
 """
-############################
-# Confidence in institutions
-############################
-conf_vars = [var.lower() for var in conf_vars] # rename variables to lowercase
-trends["conf_raw"] = trends[conf_vars].mean(axis = 1, skipna = True)
-
-# c.f., threshold analysis: exclude rows with < 8
-trends["num_conf_vars"] = trends[conf_vars].notna().sum(axis=1)
-trends.loc[trends["num_conf_vars"] < 8, "conf_raw"] = np.nan
-
-# C.f., Factor Analysis "index analysis" sheet
-factor1 = ["conmedic", "conarmy", "conbus", "confinan", "conjudge"]
-factor2 = ["confed", "conlegis"]
-factor3 = ["conpress", "contv"]
-
-# General Confidence in Institutions 
-trends["conf_gen"] = trends[factor1].mean(axis = 1)
-trends["num_gen_vars"] = trends[conf_vars].notna().sum(axis=1)
-trends.loc[trends["num_gen_vars"] < 4, "conf_gen"] = np.nan
-
-# Confidence in Government
-trends["conf_gov"] = trends[factor2].mean(axis = 1)
-trends["num_gov_vars"] = trends[conf_vars].notna().sum(axis=1)
-trends.loc[trends["num_gov_vars"] < 2, "conf_gov"] = np.nan
-
-# Confidence in the Media
-trends["conf_media"] = trends[factor3].mean(axis = 1)
-trends["num_med_vars"] = trends[conf_vars].notna().sum(axis=1)
-trends.loc[trends["num_med_vars"] < 2, "conf_media"] = np.nan
-
-
-#############
-# Religiosity 
-#############
-# Standardize components, then average 
-relig_vars = ["attend", "pray", "god", "bible", "reliten"]
-
-# standardize 
-def standardize(x):
-    return (x - x.mean()) / x.std()
-
-for var in relig_vars: 
-    trends[var + "_z"] = standardize(trends[var])
-
-relig_vars_z = [var + "_z" for var in relig_vars]
-trends[relig_vars_z].describe()
-
-trends["religiosity_raw"] = trends[relig_vars_z].mean(axis=1, skipna=True)
-
-trends["religiosity_raw"].describe()
-
-# omit for R's with < 2 vars? C.f., Threshold test (appendix)
-trends["num_relig_vars"] = trends[relig_vars].notna().sum(axis=1)
-trends.loc[trends["num_relig_vars"] < 2, "religiosity_raw"] = np.nan
-trends["religiosity_raw"].describe() # omitting rows with excess nas truncates the range a bit 
-# Ss standardize again when constructing Z-scores data table...
-
-
-###########
-# Happiness
-###########
-hap_vars = ["happy", "life", "haprelate"]
-trends["happiness_raw"] = trends[hap_vars].mean(axis=1, skipna=True)
-
-# omit for R's with < 2 vars. 
-trends["num_hap_vars"] = trends[hap_vars].notna().sum(axis=1)
-trends.loc[trends["num_hap_vars"] < 2, "happiness_raw"] = np.nan
-
-
-##################
-# Social Attitudes 
-##################
-# because of the distribution, use only rows with all three measures. Add for the raw variable
-soc_att_vars = ["trust", "helpful", "fair"]
-trends["social_attitude_raw"] = trends[soc_att_vars].sum(axis=1, skipna=True)
-
-# omit for R's with < 2 vars. 
-trends["num_soc_att_vars"] = trends[soc_att_vars].notna().sum(axis=1)
-trends.loc[trends["num_soc_att_vars"] < 3, "social_attitude_raw"] = np.nan
-trends["num_soc_att_vars"].value_counts()
-
-
-###############
-# Socialization
-###############
-soc_vars = ["socbar", "socommun", "socfrend", "socrel"]
-trends["soc_raw"] = trends[soc_vars].mean(axis=1, skipna=True)
-
-# omit for R's with < 2 vars. 
-trends["num_soc_vars"] = trends[soc_vars].notna().sum(axis=1)
-trends.loc[trends["num_soc_vars"] < 2, "soc_raw"] = np.nan
-
-trends["num_soc_vars"].value_counts() # Cf. appendix for threshold test
+See "index analyses" for alpha, factor analysis, and threshold tests.
+Item indexes are one row each of index_specs (c.f., gss_dashboard_indexes) and are
+built together in one batched pass; wlb and qol depend on other indexes, so they
+are separate stages. Each stage returns only its index column(s), row-aligned with recodes.
+"""
 
+index_specs = [
+    # Confidence in institutions. c.f., threshold analysis: exclude rows with < 8
+    IndexSpec("conf_raw", conf_items, min_valid = 8),
+    # General confidence, government, media (factors); the minimum counts all 13 items
+    IndexSpec("conf_gen", factor1, min_valid = 4, count_items = conf_items),
+    IndexSpec("conf_gov", factor2, min_valid = 2, count_items = conf_items),
+    IndexSpec("conf_media", factor3, min_valid = 2, count_items = conf_items),
+    # Religiosity: standardize components, then average. omit for R's with < 2 vars
+    # (Ss standardize again when constructing Z-scores data table...)
+    IndexSpec("religiosity_raw", relig_vars, min_valid = 2, method = "zmean"),
+    # Happiness: omit for R's with < 2 vars.
+    IndexSpec("happiness_raw", hap_vars, min_valid = 2),
+    # Social attitudes: because of the distribution, use only rows with all three measures. Add for the raw variable
+    IndexSpec("social_attitude_raw", soc_att_vars, min_valid = 3, method = "sum"),
+    # Social relationships: omit for R's with < 2 vars. Cf. appendix for threshold test
+    IndexSpec("soc_raw", soc_items, min_valid = 2),
+]
 
-###################
-# Work-Life Balance 
-###################
-# Recode work hours
-trends["hrs1"].describe()
+index_items = list(dict.fromkeys(item for spec in index_specs for item in spec.items + (spec.count_items or [])))
 
-trends["hrs_trim"] = trends["hrs1"]
-# subset minimum hours to ensure people are actually part of the work force
-trends.loc[trends["hrs1"] < 10, "hrs_trim"] = np.nan
-# trim outliers at 3 std * mean
-outlier_threshold = trends["hrs1"].mean() + (3 * trends["hrs1"].std())
-trends.loc[trends["hrs1"] > outlier_threshold, "hrs_trim"] = np.nan # setting outliers and <10 hrs to np.nan to preserve rows
 
-# reverse direction of hours for index; so high hours = negative score
-max_hours = trends["hrs_trim"].max(skipna = True)
+def item_indexes(trends, specs, moments = None):
+    """ Stage item_indexes: confidence, religiosity, happiness, social attitudes and soc. """
+    return build_indexes(trends, specs, moments)
 
-trends["hrs_rev"] = (max_hours + 1) - trends["hrs_trim"] # +1 means that there is not a zero point. 
-print(trends["hrs_rev"].describe())
 
-trends["satjob"].describe()
+def hours_trim(hrs1, min_hours, outlier_sd):
+    """ Outlier threshold (mean + outlier_sd * std) and the largest hours kept under it. """
+    outlier_threshold = hrs1.mean() + (outlier_sd * hrs1.std())
+    max_hours = hrs1[(hrs1 >= min_hours) & (hrs1 <= outlier_threshold)].max(skipna = True)
+    return outlier_threshold, max_hours
 
-# construct index as satjob * hrs_rev
-trends["wlb_raw"] = trends["satjob"] * trends["hrs_rev"]
-trends["wlb_raw"].describe()
 
-trends.drop(["hrs_rev", "hrs_trim"], axis = 1, inplace = True)
+def work_life_balance(hrs1, satjob, min_hours, outlier_sd, trim = None):
+    """ Work-life balance: job satisfaction * reversed (trimmed) work hours.
+    trim: reference (threshold, max hours) (appended waves); default: from these rows. """
+    outlier_threshold, max_hours = hours_trim(hrs1, min_hours, outlier_sd) if trim is None else trim
 
+    hrs_trim = hrs1.copy()
+    # subset minimum hours to ensure people are actually part of the work force
+    hrs_trim[hrs1 < min_hours] = np.nan
+    # trim outliers at 3 std * mean
+    hrs_trim[hrs1 > outlier_threshold] = np.nan # setting outliers and <10 hrs to np.nan to preserve rows
 
-#################
-# Quality of Life
-#################
-# Standardize first
-qol_vars = ["educ", "health", "soc_raw", "wlb_raw"]
+    # reverse direction of hours for index; so high hours = negative score
+    hrs_rev = (max_hours + 1) - hrs_trim # +1 means that there is not a zero point.
+    print(hrs_rev.describe())
 
-def standardize(x):
-    return (x - x.mean()) / x.std()
+    # construct index as satjob * hrs_rev
+    return satjob * hrs_rev
 
-for var in qol_vars: 
-    trends[var + "_z"] = standardize(trends[var])
 
-# Rename columns to z-score equivalents
-qol_z_vars = [var + "_z" for var in qol_vars]
+def wlb_index(trends, min_hours, outlier_sd, trim = None):
+    """ Stage wlb_index: work-life balance. """
+    out = pd.DataFrame(index = trends.index)
+    out["wlb_raw"] = work_life_balance(trends["hrs1"], trends["satjob"], min_hours, outlier_sd, trim)
+    return out
 
-trends["qol_raw"] = trends[qol_z_vars].mean(axis = 1, skipna = True)
 
-trends["num_qol_vars"] = trends[qol_z_vars].notna().sum(axis=1)
-trends["num_qol_vars"].value_counts()
+def qol_components(trends, soc, wlb):
+    return pd.concat([trends[["educ", "health"]], soc, wlb], axis = 1)
 
-trends.loc[trends["num_qol_vars"] < 4, "qol_raw"] = np.nan
 
-trends["qol_raw"].describe() 
+def qol_index(trends, soc, wlb, min_valid, moments = None):
+    """ Stage qol_index: standardize educ, health, soc and wlb first, then average. """
+    qol = qol_components(trends, soc, wlb)
+    spec = IndexSpec("qol_raw", list(qol.columns), min_valid = min_valid, method = "zmean")
+    return build_indexes(qol, [spec], moments)
 
 
 #############################################################################
@@ -597,419 +499,828 @@ trends["qol_raw"].describe()
 ## ii. Visualize Index Distributions
 #############################################################################
 
-measures = ["educ", "health", "conf_raw", "conf_gen", "conf_gov", "conf_media", 
-            "religiosity_raw", "happiness_raw", "social_attitude_raw", 
+measures = ["educ", "health", "conf_raw", "conf_gen", "conf_gov", "conf_media",
+            "religiosity_raw", "happiness_raw", "social_attitude_raw",
             "soc_raw", "wlb_raw", "qol_raw"]
 
-for i in measures: 
-    plt.figure(figsize = (8,5))
-    plt.hist(trends[i].dropna(), bins=12, color='salmon', edgecolor='black')
-    plt.title(f'Distribution of {i}')
-    plt.grid(axis='y')
-    plt.show()
+def plot_distributions(trends, measures, bins = 12):
+    for i in measures:
+        plt.figure(figsize = (8,5))
+        plt.hist(trends[i].dropna(), bins=bins, color='salmon', edgecolor='black')
+        plt.title(f'Distribution of {i}')
+        plt.grid(axis='y')
+        plt.show()
 
 
 #############################################################################
-# Part 1C. 
-## Clean up to save the data table as raw, recoded measures
+# Part 1C.
+## Assemble the raw, recoded measures table
 #############################################################################
-# remove Z scores from raw data table
 
-trends.drop(qol_z_vars, axis = 1, inplace = True)
-trends.drop(relig_vars_z, axis = 1, inplace = True)
-
-
-# remove na counts
-na_counts = ["num_conf_vars", "num_relig_vars", "num_hap_vars", 
-                "num_soc_att_vars", "num_soc_vars", "num_qol_vars", 
-                "num_gen_vars", "num_gov_vars", "num_med_vars"]
-trends.drop(na_counts, axis = 1, inplace = True)
-
-
-##############################################################################
-## Short save ################################################################
-trends.to_csv("dashboard_raw.csv", index=False)
-trends = pd.read_csv("dashboard_raw.csv")
-##############################################################################
+def part1c_dashboard_raw(trends, *indexes):
+    """ Stage dashboard_raw: recodes plus every raw index column. """
+    return pd.concat([trends, *indexes], axis = 1)
 
 
 ##############################################################################
 ### Part II - Create Table of Z values for all measures ######################
 ##############################################################################
 
-### Part 2a.
-### STANDARDIZE All MEASURES #################################################
+""" Means and sds of every standardized column are fitted once (stage z_params, a
+table of Welford moments, c.f. gss_dashboard_standardize) and every z-score is
+the raw column minus that mean over that sd (sample sd).
+"""
 
-for var in conf_vars: 
-    trends[var + "_z"] = standardize(trends[var])
-    
-conf_indexes = ["conf_gen", "conf_gov", "conf_media"]
-for var in conf_indexes: 
-    trends[var + "_z"] = standardize(trends[var])
+# every column with a z-score in the Part 2 table (items, then indexes)
+z_columns = (conf_items + ["conf_gen", "conf_gov", "conf_media"] + relig_vars + hap_vars
+             + soc_att_vars + soc_items + wlb_vars + ["educ", "health"]
+             + ["conf_raw", "religiosity_raw", "happiness_raw", "social_attitude_raw",
+                "soc_raw", "wlb_raw", "qol_raw"])
 
-for var in relig_vars:
-    trends[var + "_z"] = standardize(trends[var])
 
-for var in hap_vars:
-    trends[var + "_z"] = standardize(trends[var])
+def part2_z_params(trends, columns):
+    """ Stage z_params: fitted mean / sd moments of every standardized column. """
+    return StandardizationRegistry().fit(trends, columns).to_frame()
 
-for var in soc_att_vars:
-    trends[var + "_z"] = standardize(trends[var])
 
-for var in soc_vars:
-    trends[var + "_z"] = standardize(trends[var])
+def part2_z_measures(trends, z_params, conf_vars, relig_vars, hap_vars, soc_att_vars, soc_vars, wlb_vars):
+    """ Stage dashboard_z_measures: z-scores of every item and index. """
+    trends = trends.copy()
+    z = StandardizationRegistry.from_frame(z_params).view(trends)
 
-wlb_vars = ["hrs1", "satjob"]
-for var in wlb_vars:
-    trends[var + "_z"] = standardize(trends[var])
-    
-qol_vars = ["educ", "health"]
-for var in qol_vars:
-    trends[var + "_z"] = standardize(trends[var])
-
-# Standardize indexes
-indexes = ["conf_raw", "religiosity_raw", "happiness_raw", 
-           "social_attitude_raw", "soc_raw","wlb_raw", "qol_raw"] 
-
-# religiosity and qol are re-standardized
-
-# rename indexes as z scores
-for var in indexes: 
-    new_var = var.replace("_raw", "_z")
-    trends[new_var] = standardize(trends[var])
-
-
-### Part 2b. #################################################################
-## Clean up table ############################################################
-
-# Drop original raw vars. 
-trends.drop(conf_vars, axis=1, inplace = True)
-trends.drop(conf_indexes, axis = 1, inplace = True)
-trends.drop(relig_vars, axis=1, inplace = True)
-trends.drop(hap_vars, axis=1, inplace = True)
-trends.drop(soc_att_vars, axis=1, inplace = True)
-trends.drop(soc_vars, axis=1, inplace = True)
-trends.drop(qol_vars, axis=1, inplace = True)
-trends.drop(wlb_vars, axis=1, inplace = True)
-
-mar_vars = ["hapmar", "hapcohab"]
-trends.drop(mar_vars, axis=1, inplace = True)
-trends.drop(indexes, axis=1, inplace=True)
-
-### KEEP CATEGORICAL DATA IN THE Z TABLE 
-
-### Visualize Again ###############################################################
-measures_z = ["educ_z", "health_z", "conf_z", "conf_gen_z", "conf_gov_z", "conf_media_z", 
-            "religiosity_z", "happiness_z", "social_attitude_z", 
-            "soc_z", "wlb_z", "qol_z"]
+    ### Part 2a.
+    ### STANDARDIZE All MEASURES #############################################
+    conf_indexes = ["conf_gen", "conf_gov", "conf_media"]
+    qol_vars = ["educ", "health"]
+    for var in conf_vars + conf_indexes + relig_vars + hap_vars + soc_att_vars + soc_vars + wlb_vars + qol_vars:
+        trends[var + "_z"] = z[var]
 
-for i in measures_z: 
-    plt.figure(figsize = (8,5))
-    plt.hist(trends[i].dropna(), bins=12, color='salmon', edgecolor='black')
-    plt.title(f'Distribution of {i}'
-    plt.grid(axis='y')
-    plt.show()
+    # Standardize indexes
+    indexes = ["conf_raw", "religiosity_raw", "happiness_raw",
+               "social_attitude_raw", "soc_raw","wlb_raw", "qol_raw"]
 
-#### Part 2C. ############################################################
-## Short save ###############################################################
-trends.to_csv("dashboard_z_measures.csv", index=False)
-#############################################################################
+    # religiosity and qol are re-standardized
 
-### Save a sample for GIThub Repo ####
+    # rename indexes as z scores
+    for var in indexes:
+        new_var = var.replace("_raw", "_z")
+        trends[new_var] = z[var]
 
-gss_zs = pd.read_csv("dashboard_z_measures.csv")
-gss_z_sample = gss_zs.sample(frac=0.1)
 
-gss_z_sample.to_csv("gss_z_sample.csv", index=False)
+    ### Part 2b. #############################################################
+    ## Clean up table ########################################################
 
-##############################################################################
-## Part 3
-## 3a. Impute ################################################################
-""" Impute method is to use the yearly means of raw variables to fill in missing 
-values. The purpose of imputing is create smoother trend lines, so this method seems
-simple and intuitive. It requires constructing yearly aggregates, imputing aggregate 
-values for missing years, then merging that aggregated data and using it to impute 
-for respondent level scores. I drop the aggregated data column, but use the r-level 
-scores to reconstruct the indexes with a complete (imputed) dataset. 
-"""
-##############################################################################
+    # Drop original raw vars.
+    trends.drop(conf_vars, axis=1, inplace = True)
+    trends.drop(conf_indexes, axis = 1, inplace = True)
+    trends.drop(relig_vars, axis=1, inplace = True)
+    trends.drop(hap_vars, axis=1, inplace = True)
+    trends.drop(soc_att_vars, axis=1, inplace = True)
+    trends.drop(soc_vars, axis=1, inplace = True)
+    trends.drop(qol_vars, axis=1, inplace = True)
+    trends.drop(wlb_vars, axis=1, inplace = True)
 
-# USE RAW DATA - i.e., Impute THEN standardize for Trend lines
-trends = pd.read_csv("dashboard_raw.csv")
+    mar_vars = ["hapmar", "hapcohab"]
+    trends.drop(mar_vars, axis=1, inplace = True)
+    trends.drop(indexes, axis=1, inplace=True)
 
+    ### KEEP CATEGORICAL DATA IN THE Z TABLE
+    return trends
 
-### 3a i. Conf Index #########################################################
-# calculate yearly confidence means in new data frame
-conf_means = trends.groupby("YEAR")[conf_vars].mean()
+measures_z = ["educ_z", "health_z", "conf_z", "conf_gen_z", "conf_gov_z", "conf_media_z",
+            "religiosity_z", "happiness_z", "social_attitude_z",
+            "soc_z", "wlb_z", "qol_z"]
 
-# fill missing year means with previous (if not) then subsequent year means
-conf_means[conf_vars] = conf_means[conf_vars].fillna(method="ffill").fillna(method="bfill")
 
-# merge yearly means as new columns
-trends = trends.merge(conf_means, on="YEAR", suffixes = ("", "_yearly_mean"))
+## 2c. Dimension cube ########################################################
+""" Every dashboard filter view is a yearly mean (or sd) of a z measure within one
+filter level. The cube holds count, sum and sum of squares for every z measure x
+year x filter level (and the 2-way combinations below), so the dashboard reads
+these few rows instead of scanning the respondent-level table.
+"""
 
-# fill r-level missing confidence scores with yearly means
-for var in conf_vars: 
-    trends[var] = trends[var].fillna(trends[var + "_yearly_mean"])
-    
-# drop the merged yearly mean values (they now exist at r - level)
-trends.drop(columns=[var + "_yearly_mean" for var in conf_vars], inplace=True)
+cube_measures = measures_z
 
-# check work 
-trends[conf_vars].isna().groupby(trends["YEAR"]).sum()
+cube_dimensions = ["gender", "party", "polview", "region", "race", "degree",
+                   "age_group", "ses_category", "place_category", "mobile16"]
+cube_pairs = [("gender", "age_group"), ("race", "degree"), ("party", "polview"),
+              ("ses_category", "place_category")]
 
-# NOW construct the Imputed Conf Indices
-trends["conf_trend"] = trends[conf_vars].mean(axis=1, skipna=True)
+def part2_cube(gss_zs, measures, dimensions, pairs):
+    """ Stage dashboard_cube: count/sum/sumsq of the z measures by year and filter. """
+    return build_cube(gss_zs, measures, dimensions, pairs)
 
-# C.f., Factor Analysis (appendix)
-factor1 = ["conmedic", "conarmy", "conbus", "confinan", "conjudge"]
-factor2 = ["confed", "conlegis"]
-factor3 = ["conpress", "contv"]
 
-trends["conf_gen_trend"] = trends[factor1].mean(axis = 1)
-trends["conf_gov_trend"] = trends[factor2].mean(axis = 1)
-trends["conf_media_trend"] = trends[factor3].mean(axis = 1)
+## 2d. Distribution tables ###################################################
+""" The distribution panels show who answered: the count and share of every level
+of every filter by year, NA included. All filters come out of one pass
+(c.f., distribution_table in gss_dashboard_cube) instead of a value_counts per
+variable.
+"""
 
-# Rename the columns in the DataFrame
-rename_dict = {var: var + "_trend" for var in conf_vars}
-trends = trends.rename(columns=rename_dict)
-trends.drop(["conf_raw", "conf_gen", "conf_gov", "conf_media"], axis = 1, inplace = True)
+def part2_distributions(trends, dimensions):
+    """ Stage dashboard_distributions: count and share of each filter level by year. """
+    return distribution_table(trends, dimensions)
 
 
-### 3a ii. Religiosity #######################################################
-# Check missing values
-trends[relig_vars].isna().sum()
-trends[relig_vars].isna().groupby(trends["YEAR"]).sum()
+## 2e. Geography (star schema) ###############################################
+""" GSS has census divisions (REGION), not states. For the state map, the region
+rows of the cube are kept keyed by region code (dashboard_region_cube) and the
+map relates them to the state dimension parsed from data/region_to_state.csv
+(c.f., gss_dashboard_geography), instead of copying each region's rows to its
+states.
+"""
 
-## IMPUTE Religiosity Variables
-relig_means = trends.groupby("YEAR")[relig_vars].mean()
-relig_means[relig_vars] = relig_means[relig_vars].fillna(method="ffill").fillna(method="bfill")
+def geography_states(path, source, region_map):
+    """ Stage dim_state: one row per state with its region code. """
+    with open(path) as f:
+        pairs = parse_region_states(f.read(), region_map.values())
+    return state_dimension(pairs, region_map)
 
-trends = trends.merge(relig_means, on="YEAR", suffixes = ("", "_yearly_mean"))
 
-for var in relig_vars: 
-    trends[var] = trends[var].fillna(trends[var + "_yearly_mean"])
+def geography_regions(states, region_map):
+    """ Stage dim_region: region code, name and number of states. """
+    return region_dimension(region_map, states)
 
-trends.drop(columns=[var + "_yearly_mean" for var in relig_vars], inplace=True)
 
-# Religiosity variables have to be standardized before constructing the index 
-def standardize(x):
-    return (x - x.mean()) / x.std()
+def part2_region_cube(cube, region_map):
+    """ Stage dashboard_region_cube: the cube's region rows keyed by region code. """
+    return region_facts(cube, region_map)
 
-for var in relig_vars: 
-    trends[var + "_z"] = standardize(trends[var])
 
-relig_vars_z = [var + "_z" for var in relig_vars]
+##############################################################################
+## Part 3
+## 3a. Impute ################################################################
+""" Impute method is to use the yearly means of raw variables to fill in missing
+values. The purpose of imputing is create smoother trend lines, so this method seems
+simple and intuitive. It requires constructing yearly aggregates, imputing aggregate
+values for missing years, then using them to impute respondent level scores. All
+domains are imputed in one pass (see gss_dashboard_impute), and the r-level scores
+are used to reconstruct the indexes with a complete (imputed) dataset.
+"""
+##############################################################################
 
-trends["religiosity_trend"] = trends[relig_vars_z].mean(axis=1, skipna=True)
-trends["religiosity_trend"].describe()
-# Will Standardize Again in part b. 
+def part3_impute(trends, variables, imputer, imputer_args):
+    """ Stage trends_imputed: fill r-level missing values (all domains at once). """
+    return get_imputer(imputer, **imputer_args).impute(trends, variables)
 
-# Rename the columns in the DataFrame
-rename_dict = {var: var + "_trend" for var in relig_vars}
-trends = trends.rename(columns=rename_dict)
 
-trends.drop(relig_vars_z, axis = 1, inplace = True)
-trends.drop(["religiosity_raw"], axis = 1, inplace = True)
+def part3_multiple_imputation(trends, variables, m, iterations, seed, processes = 1):
+    """ Stage trends_mi: yearly item means over m chained-equations imputations (Rubin's rules). """
+    imputer = ChainedEquationsImputer(m = m, iterations = iterations, seed = seed, processes = processes)
+    return imputer.multiple(trends, variables)
 
 
-#### 3a iii. HAPPINESS #######################################################
-#### Happy variables are all on the same scale
+def part3_trend_indexes(trends, conf_vars, factor1, factor2, factor3, relig_vars,
+                        hap_vars, soc_att_vars, soc_vars, wlb_vars, min_hours, outlier_sd,
+                        relig_moments = None, qol_moments = None, trim = None):
+    """ Stage trend_indexes: rebuild indexes from imputed data (r-level, unstandardized).
+    relig_moments, qol_moments, trim: reference values for an appended wave (c.f., Part 4). """
+    # USE RAW DATA - i.e., Impute (stage trends_imputed) THEN standardize for Trend lines
 
-happy_vars = ["happy", "life", "haprelate"]
-trends[happy_vars].isna().groupby(trends["YEAR"]).sum()
+    ### 3a i. Conf Index #####################################################
+    # NOW construct the Imputed Conf Indices
+    trends["conf_trend"] = trends[conf_vars].mean(axis=1, skipna=True)
 
-# Impute happy variables including haprelate
-happy_means = trends.groupby("YEAR")[happy_vars].mean()
-happy_means[happy_vars] = happy_means[happy_vars].fillna(method="ffill").fillna(method="bfill")
+    # C.f., Factor Analysis (appendix)
+    trends["conf_gen_trend"] = trends[factor1].mean(axis = 1)
+    trends["conf_gov_trend"] = trends[factor2].mean(axis = 1)
+    trends["conf_media_trend"] = trends[factor3].mean(axis = 1)
 
-trends = trends.merge(happy_means, on="YEAR", suffixes = ("", "_yearly_mean"))
+    # Rename the columns in the DataFrame
+    rename_dict = {var: var + "_trend" for var in conf_vars}
+    trends = trends.rename(columns=rename_dict)
+    trends.drop(["conf_raw", "conf_gen", "conf_gov", "conf_media"], axis = 1, inplace = True)
 
-for var in happy_vars: 
-    trends[var] = trends[var].fillna(trends[var + "_yearly_mean"])
 
-trends.drop(columns=[var + "_yearly_mean" for var in happy_vars], inplace=True)
+    ### 3a ii. Religiosity ###################################################
+    # Religiosity variables have to be standardized before constructing the index
+    relig_z = (relig_moments or StandardizationRegistry().fit(trends, relig_vars)).view(trends)
+    for var in relig_vars:
+        trends[var + "_z"] = relig_z[var]
 
-# NOW construct Index with haprelate
-trends["happiness_trend"] = trends[happy_vars].mean(axis=1, skipna=True)
+    relig_vars_z = [var + "_z" for var in relig_vars]
 
-# post_check
-trends[happy_vars].isna().groupby(trends["YEAR"]).sum()
-trends["happiness_trend"].isna().groupby(trends["YEAR"]).sum()
-trends["happiness_trend"].describe()
+    trends["religiosity_trend"] = trends[relig_vars_z].mean(axis=1, skipna=True)
+    # Will Standardize Again in part b.
 
-# Rename the columns in the DataFrame
-rename_dict = {var: var + "_trend" for var in happy_vars}
-trends = trends.rename(columns=rename_dict)
+    # Rename the columns in the DataFrame
+    rename_dict = {var: var + "_trend" for var in relig_vars}
+    trends = trends.rename(columns=rename_dict)
 
-# drop raw 
-trends.drop(["happiness_raw"], axis = 1, inplace = True)
+    trends.drop(relig_vars_z, axis = 1, inplace = True)
+    trends.drop(["religiosity_raw"], axis = 1, inplace = True)
 
 
-### 3a iv. SOCIAL ATTITUDES ##################################################
+    #### 3a iii. HAPPINESS ###################################################
+    #### Happy variables are all on the same scale
+    # NOW construct Index with haprelate
+    trends["happiness_trend"] = trends[hap_vars].mean(axis=1, skipna=True)
 
-trends[soc_att_vars].isna().groupby(trends["YEAR"]).sum()
+    # Rename the columns in the DataFrame
+    rename_dict = {var: var + "_trend" for var in hap_vars}
+    trends = trends.rename(columns=rename_dict)
 
-## IMPUTE Social Attitudes  
-soc_att_means = trends.groupby("YEAR")[soc_att_vars].mean()
-soc_att_means[soc_att_vars] = soc_att_means[soc_att_vars].fillna(method="ffill").fillna(method="bfill")
+    # drop raw
+    trends.drop(["happiness_raw"], axis = 1, inplace = True)
 
-trends = trends.merge(soc_att_means, on="YEAR", suffixes = ("", "_yearly_mean"))
 
-for var in soc_att_vars: 
-    trends[var] = trends[var].fillna(trends[var + "_yearly_mean"])
+    ### 3a iv. SOCIAL ATTITUDES ##############################################
+    ## NOW construct the index
+    trends["social_attitude_trend"] = trends[soc_att_vars].mean(axis=1, skipna=True)
 
-trends.drop(columns=[var + "_yearly_mean" for var in soc_att_vars], inplace=True)
+    # Rename the columns in the DataFrame
+    rename_dict = {var: var + "_trend" for var in soc_att_vars}
+    trends = trends.rename(columns=rename_dict)
 
-## NOW construct the index
-trends["social_attitude_trend"] = trends[soc_att_vars].mean(axis=1, skipna=True)
+    # drop raw
+    trends.drop(["social_attitude_raw"], axis = 1, inplace = True)
 
-trends["social_attitude_trend"].describe()
-trends["social_attitude_trend"].isna().value_counts()
 
-# Rename the columns in the DataFrame
-rename_dict = {var: var + "_trend" for var in soc_att_vars}
-trends = trends.rename(columns=rename_dict)
+    ### 3a v. Social Relationships ###########################################
+    ## NOW construct the index
+    trends["soc_trend"] = trends[soc_vars].mean(axis=1, skipna=True)
 
-# drop raw 
-trends.drop(["social_attitude_raw"], axis = 1, inplace = True)
+    # Rename the columns in the DataFrame
+    rename_dict = {var: var + "_trend" for var in soc_vars}
+    trends = trends.rename(columns=rename_dict)
 
+    # drop raw
+    trends.drop(["soc_raw"], axis = 1, inplace = True)
 
-### 3a v. Social Relationships ###############################################
 
-trends[soc_vars].isna().groupby(trends["YEAR"]).sum()
+    ### 3a vi. Work/Life Balance #############################################
+    ## NOW construct the index (same hours recode as Part 1b)
+    trends["wlb_trend"] = work_life_balance(trends["hrs1"], trends["satjob"], min_hours, outlier_sd, trim)
 
-# Impute
-soc_means = trends.groupby("YEAR")[soc_vars].mean()
-soc_means[soc_vars] = soc_means[soc_vars].fillna(method="ffill").fillna(method="bfill")
+    # Rename the columns in the DataFrame
+    rename_dict = {var: var + "_trend" for var in wlb_vars}
+    trends = trends.rename(columns=rename_dict)
 
-trends = trends.merge(soc_means, on="YEAR", suffixes = ("", "_yearly_mean"))
+    trends.drop(["wlb_raw"], axis=1, inplace=True)
 
-for var in soc_vars: 
-    trends[var] = trends[var].fillna(trends[var + "_yearly_mean"])
 
-trends.drop(columns=[var + "_yearly_mean" for var in soc_vars], inplace=True)
+    ### 3a vii. QOL ##########################################################
+    qol_vars = ["health", "educ"] # soc trend and wlb trend already made up
 
-## NOW construct the index
-trends["soc_trend"] = trends[soc_vars].mean(axis=1, skipna=True)
-trends["soc_trend"].describe()
+    # Rename the columns in the DataFrame
+    rename_dict = {var: var + "_trend" for var in qol_vars}
+    trends = trends.rename(columns=rename_dict)
 
-# Rename the columns in the DataFrame
-rename_dict = {var: var + "_trend" for var in soc_vars}
-trends = trends.rename(columns=rename_dict)
+    ## NOW construct the index, C.f., recodes
+    qol_vars = ["educ_trend", "health_trend", "soc_trend", "wlb_trend"]
 
-# drop raw 
-trends.drop(["soc_raw"], axis = 1, inplace = True)
+    qol_z = (qol_moments or StandardizationRegistry().fit(trends, qol_vars)).view(trends)
+    for var in qol_vars:
+        trends[var + "_z"] = qol_z[var]
 
+    qol_zs = [var + "_z" for var in qol_vars]
 
-### 3a vi. Work/Life Balance #####################################################
+    trends["qol_trend"] = trends[qol_zs].mean(axis = 1, skipna = True)
 
-wlb_vars = ["hrs1", "satjob"]
-trends[wlb_vars].isna().groupby(trends["YEAR"]).sum()
+    trends.drop(qol_zs, axis = 1, inplace = True)
+    trends.drop(["qol_raw"], axis = 1, inplace = True)
 
-wlb_means = trends.groupby("YEAR")[wlb_vars].mean()
-wlb_means[wlb_vars] = wlb_means[wlb_vars].fillna(method="ffill").fillna(method="bfill")
+    #########################################################################
+    ##### Clean Data Table - Drop temp vars
 
-trends = trends.merge(wlb_means, on="YEAR", suffixes = ("", "_yearly_mean"))
+    trends.drop(["hapmar", "hapcohab"], axis = 1, inplace = True)
 
-for var in wlb_vars: 
-    trends[var] = trends[var].fillna(trends[var + "_yearly_mean"])
+    categoricals = ["party_centered", "pol_centered", "gender", "party", "polview",
+            "region", "mobile16", "race", "degree", "age_group", "ses_category", "place_category"]
 
-trends.drop(columns=[var + "_yearly_mean" for var in wlb_vars], inplace=True)
+    trends.drop(categoricals, axis = 1, inplace = True)
 
-# copy/paste hrs recodes from above
-trends["hrs_trim"] = trends["hrs1"]
-# subset minimum hours to ensure people are actually part of the work force
-trends.loc[trends["hrs1"] < 10, "hrs_trim"] = np.nan
-# trim outliers at 3 std * mean
-outlier_threshold = trends["hrs1"].mean() + (3 * trends["hrs1"].std())
-trends.loc[trends["hrs1"] > outlier_threshold, "hrs_trim"] = np.nan # setting outliers and <10 hrs to np.nan to preserve rows
+    return trends
 
-# reverse direction of hours for index; so high hours = negative score
-max_hours = trends["hrs_trim"].max(skipna = True)
 
-trends["hrs_rev"] = (max_hours + 1) - trends["hrs_trim"] # +1 means that there is not a zero point. 
-print(trends["hrs_rev"].describe())
+#########################################################################
+## Part 3b. Standardize Imputed Trends ##################################
+#########################################################################
 
-## NOW construct the index
-trends["wlb_trend"] = trends["hrs_rev"] * trends["satjob"]
-trends["wlb_trend"].describe()
+def trend_numeric_columns(trends):
+    exclude_vars = ["YEAR"]
+    return trends.select_dtypes(include='number').columns.difference(exclude_vars)
 
-# Rename the columns in the DataFrame
-rename_dict = {var: var + "_trend" for var in wlb_vars}
-trends = trends.rename(columns=rename_dict)
 
-trends.drop(["hrs_rev", "hrs_trim", "wlb_raw"], axis=1, inplace=True)
+def part3_trend_z_params(trends):
+    """ Stage trend_z_params: fitted mean / sd moments of every numeric trend column. """
+    return StandardizationRegistry().fit(trends, trend_numeric_columns(trends)).to_frame()
 
 
-### 3a vii. QOL ################################################################
+def part3_trend_scores(trends, z_params):
+    """ Stage trend_scores: trend columns standardized with the population sd (as StandardScaler). """
+    trends = trends.copy()
+    z = StandardizationRegistry.from_frame(z_params).view(trends, ddof = 0)
+    for var in trend_numeric_columns(trends):
+        trends[var] = z[var]
+    return trends
 
-qol_vars = ["health", "educ"] # soc trend and wlb trend already made up 
 
-trends[qol_vars].isna().groupby(trends["YEAR"]).sum()
+def part3_yearly_trends(trends):
+    """ Stage dashboard_yearly_trends: yearly means of the standardized trend scores. """
+    ### 3C. Finally, Aggregate ###############################################
+    ######### Indices By year
+    yr_trends = trends.groupby("YEAR").mean().reset_index()
+    return yr_trends
 
-qol_means = trends.groupby("YEAR")[qol_vars].mean()
-qol_means[qol_vars] = qol_means[qol_vars].fillna(method="ffill").fillna(method="bfill")
 
-trends = trends.merge(qol_means, on="YEAR", suffixes = ("", "_yearly_mean"))
+## 3e. Survey-weighted trends ################################################
+""" The yearly means above are unweighted sample means. The weighted table uses the
+GSS weights (WTSSPS, else WTSSALL) and the variance strata/PSUs (VSTRAT/VPSU) for
+population estimates with Taylor-linearized standard errors and confidence
+bands, for every trend column by year and by each dashboard filter.
+"""
 
-for var in qol_vars: 
-    trends[var] = trends[var].fillna(trends[var + "_yearly_mean"])
+def survey_design(raw):
+    """ Stage survey_design: weight and integer stratum / PSU ids of each respondent. """
+    design = pd.DataFrame(index = raw.index)
+    design["weight"] = raw["WTSSPS"].fillna(raw["WTSSALL"])
+    design["stratum"], design["psu"] = design_keys(raw["YEAR"], raw["VSTRAT"], raw["VPSU"])
+    return design
 
-trends.drop(columns=[var + "_yearly_mean" for var in qol_vars], inplace=True)
 
+def part3_weighted_trends(trends, design, filters, dimensions, level):
+    """ Stage dashboard_weighted_trends: weighted yearly means, SEs and CIs of every trend column. """
+    columns = [col for col in trends.columns if col != "YEAR"]
+    frame = pd.concat([trends, design, filters], axis = 1)
+    return weighted_estimates(frame, columns, "weight", "stratum", "psu", dimensions, level = level)
 
-# Rename the columns in the DataFrame
-rename_dict = {var: var + "_trend" for var in qol_vars}
-trends = trends.rename(columns=rename_dict)
 
+## 3f. Bootstrap bands #######################################################
+""" Sampling uncertainty of the unweighted yearly trend means: respondents are
+resampled with replacement within each year, and every *_trend column gets the
+replicates' standard deviation and percentile band per year.
+"""
 
-## NOW construct the index, C.f., recodes 
-qol_vars = ["educ_trend", "health_trend", "soc_trend", "wlb_trend"]
+def part3_trend_bands(trends, n_reps, level, seed, processes = 1):
+    """ Stage dashboard_trend_bands: bootstrap SEs and percentile bands of the yearly trend means. """
+    columns = [col for col in trends.columns if col.endswith("_trend")]
+    return bootstrap_bands(trends, columns, n_reps = n_reps, level = level, seed = seed,
+                           processes = processes)
 
-def standardize(x):
-    return (x - x.mean()) / x.std()
 
-for var in qol_vars: 
-    trends[var + "_z"] = standardize(trends[var])
+##############################################################################
+### Part IV - Append a new wave ##############################################
+##############################################################################
+""" A new GSS release adds one wave to 34 unchanged ones. Instead of rebuilding from
+the cumulative file, --append reads only the rows past those already ingested (or
+a single-wave file) and runs them through the same recodes, indexes and trend
+steps with the global statistics of the last full build held fixed (SES
+moments and cuts, hours trim, z-score means/sds; c.f., gss_dashboard_append).
+The new years are appended to the yearly, cube, z-score, weighted and band
+tables, to their stage cache artifacts (stage_cache/appended, read by the query
+service and the tiles) and to the saved item covariances. The report lists how far each global
+statistic moves with the new rows; when they shift materially, a full rebuild
+re-bases the whole history.
+"""
 
-qol_zs = [var + "_z" for var in qol_vars]
+WAVE_STATE_FILE = "wave_state.npz"
+ITEM_COVARIANCE_FILE = "item_covariance.npz" # saved by the index analysis sheet
+
+hours_sketch_grid = (0, 200, 200) # whole hours
+
+zmean_items = [item for spec in index_specs if spec.method == "zmean" for item in spec.items]
+qol_trend_vars = ["educ_trend", "health_trend", "soc_trend", "wlb_trend"]
+
+
+def build_key(pipeline):
+    """ Identity of the built history the wave state was fitted from. """
+    return hash_value([pipeline.key(name) for name in ("dashboard_z_measures", "trend_scores")])
+
+
+def fit_wave_state(pipeline):
+    """ Reference statistics of the current build, read once from the stage cache. """
+    quantiles = next(r.args for r in recode_spec if r.target == "ses_category")["quantiles"]
+    recodes = pipeline.get("recodes", ["YEAR", "educ", "health", "hrs1", "ses_index"] + zmean_items)
+    raw = pipeline.get("gss_rawdata", [var for var in ses_vars if var not in recodes])
+    dash = pipeline.get("dashboard_raw", ["YEAR", "soc_raw", "wlb_raw"] + trend_impute_vars)
+    imputed = pipeline.get("trends_imputed", relig_vars + ["hrs1"])
+    trend_ix = pipeline.get("trend_indexes", qol_trend_vars)
+
+    reference = {
+        "ses": StandardizationRegistry().fit(ses_components(recodes, raw, ses_vars)),
+        "ses_index": StandardizationRegistry().fit(recodes, ["ses_index"]),
+        "hrs1": StandardizationRegistry().fit(recodes, ["hrs1"]),
+        "index_items": StandardizationRegistry().fit(recodes, zmean_items),
+        "qol": StandardizationRegistry().fit(qol_components(recodes, dash[["soc_raw"]], dash[["wlb_raw"]])),
+        "z": StandardizationRegistry.from_frame(pipeline.get("z_params")),
+        "trend_hrs1": StandardizationRegistry().fit(imputed, ["hrs1"]),
+        "trend_religiosity": StandardizationRegistry().fit(imputed, relig_vars),
+        "trend_qol": StandardizationRegistry().fit(trend_ix, qol_trend_vars),
+        "trend_z": StandardizationRegistry.from_frame(pipeline.get("trend_z_params")),
+    }
+    sketches = {"ses_index": QuantileSketch(*ses_sketch_grid).update(recodes["ses_index"]),
+                "hrs1": QuantileSketch(*hours_sketch_grid).update(recodes["hrs1"]),
+                "trend_hrs1": QuantileSketch(*hours_sketch_grid).update(imputed["hrs1"])}
+    # per-year ses_index sketches, for per-year / rolling SES cuts of later waves
+    sketches.update({f"ses_year/{year:.0f}": sketch for year, sketch in
+                     grouped_sketches(recodes["ses_index"], recodes["YEAR"], *ses_sketch_grid).items()})
+    values = {"ses_cuts": list(np.nanquantile(recodes["ses_index"], quantiles)),
+              "hours_trim": list(hours_trim(recodes["hrs1"], **wlb_params)),
+              "trend_hours_trim": list(hours_trim(imputed["hrs1"], **wlb_params))}
+
+    # last year's (filled) item means, for items a new wave does not ask
+    codes, years = year_codes(dash["YEAR"])
+    means = fill_along_years(grouped_means(dash[trend_impute_vars].to_numpy(dtype=float), codes, len(years)))
+    carry = dict(zip(trend_impute_vars, means[-1]))
+    return WaveState(reference, sketches, values, carry, years, len(raw), build_key(pipeline))
+
+
+def append_csv(frame, path):
+    frame.to_csv(path, mode = "a", header = not os.path.exists(path), index = False)
+
+
+def append_wave(pipeline, path, project_dir, tolerance = 0.01, processes = 1):
+    """ Add the waves in `path` that are newer than the build.
+
+    path: a new cumulative release (only the rows past the ingested ones are
+    read) or a file with just the new wave(s). Returns the new yearly trend rows
+    and the shift report of the global statistics.
+    """
+    state_path = os.path.join(pipeline.cache_dir, WAVE_STATE_FILE)
+    state = WaveState.load(state_path) if os.path.exists(state_path) else None
+    if state is None or state.key != build_key(pipeline):
+        pipeline.run(default_targets)
+        state = fit_wave_state(pipeline)
+
+    ### 4a. Read only the new rows ###########################################
+    _, n_file = gss_file_columns(path)
+    offset = state.n_rows if n_file > state.n_rows else 0 # a cumulative release: skip the built rows
+    raw = read_gss_columns(path, raw_columns, row_offset = offset,
+                           multiprocess = processes > 1, num_processes = processes)
+    n_read = len(raw)
+    raw = raw[~raw["YEAR"].isin(state.years)].reset_index(drop = True)
+    if raw.empty:
+        raise ValueError(f"{path} has no rows for years after {max(state.years):.0f}")
+
+    ### 4b. Same steps as the build, against the reference statistics ########
+    ref = state.reference
+    params = {name: stage.params for name, stage in pipeline.stages.items()}
+    history = {float(name.split("/")[1]): sketch for name, sketch in state.sketches.items()
+               if name.startswith("ses_year/")}
+    spec = [r._replace(args = {**r.args, "moments": ref["ses"]}) if r.target == "ses_index" else
+            r._replace(args = {**r.args, "cuts": state.values["ses_cuts"], "history": history})
+            if r.target == "ses_category" else r
+            for r in params["recodes"]["spec"]]
+
+    recodes = part1a_recodes(raw, spec)
+    items = item_indexes(recodes, **params["item_indexes"], moments = ref["index_items"])
+    wlb = wlb_index(recodes, **params["wlb_index"], trim = state.values["hours_trim"])
+    qol = qol_index(recodes, items[["soc_raw"]], wlb, **params["qol_index"], moments = ref["qol"])
+    dash = part1c_dashboard_raw(recodes, items, wlb, qol)
+    zs = part2_z_measures(dash, ref["z"].to_frame(), **params["dashboard_z_measures"])
+    cube = part2_cube(zs, **params["dashboard_cube"])
+    distributions = part2_distributions(recodes, **params["dashboard_distributions"])
+
+    imputed = part3_impute(dash, **params["trends_imputed"])
+    # items the new wave did not ask take the last year's mean, as the year-mean fill does
+    imputed = imputed.fillna({var: state.carry[var] for var in params["trends_imputed"]["variables"]})
+    trend_ix = part3_trend_indexes(imputed, **params["trend_indexes"],
+                                   relig_moments = ref["trend_religiosity"], qol_moments = ref["trend_qol"],
+                                   trim = state.values["trend_hours_trim"])
+    scores = part3_trend_scores(trend_ix, ref["trend_z"].to_frame())
+    yearly = part3_yearly_trends(scores)
+    weighted = part3_weighted_trends(scores, survey_design(raw[design_columns]), dash[cube_dimensions],
+                                     **params["dashboard_weighted_trends"])
+    bands = part3_trend_bands(scores, **params["dashboard_trend_bands"], processes = processes)
+
+    ### 4c. Fold the new rows into the running statistics ####################
+    state.update("ses", ses_components(recodes, raw, ses_vars))
+    state.update("ses_index", recodes, ["ses_index"])
+    state.update("hrs1", recodes, ["hrs1"])
+    state.update("index_items", recodes, ref["index_items"].variables)
+    state.update("qol", qol_components(recodes, items[["soc_raw"]], wlb))
+    state.update("z", dash, ref["z"].variables)
+    state.update("trend_hrs1", imputed, ["hrs1"])
+    state.update("trend_religiosity", imputed, ref["trend_religiosity"].variables)
+    state.update("trend_qol", trend_ix, ref["trend_qol"].variables)
+    state.update("trend_z", trend_ix, ref["trend_z"].variables)
+    state.sketches["ses_index"].update(recodes["ses_index"])
+    state.sketches.update({f"ses_year/{year:.0f}": sketch for year, sketch in
+                           grouped_sketches(recodes["ses_index"], recodes["YEAR"], *ses_sketch_grid).items()})
+    state.sketches["hrs1"].update(recodes["hrs1"])
+    state.sketches["trend_hrs1"].update(imputed["hrs1"])
+
+    codes, years = year_codes(dash["YEAR"])
+    means = grouped_means(dash[trend_impute_vars].to_numpy(dtype=float), codes, len(years))
+    last = [state.carry[var] for var in trend_impute_vars]
+    state.carry = dict(zip(trend_impute_vars, fill_along_years(np.vstack([last, means]))[-1]))
+    state.years += [float(year) for year in years]
+    state.n_rows += n_read
+
+    ### 4d. Shift report ######################################################
+    # SES cuts move by the sketch's shift; the hours trim follows the hrs1 moments
+    quantiles = next(r.args for r in recode_spec if r.target == "ses_category")["quantiles"]
+    moved = state.sketches["ses_index"].quantile(quantiles) - state.reference_sketches["ses_index"].quantile(quantiles)
+    ses_sd = ref["ses_index"].params("ses_index")[1]
+    derived = [("ses_index", "ses_index", f"cut q{q:.2f}", cut, cut + move, ses_sd)
+               for q, cut, move in zip(quantiles, state.values["ses_cuts"], moved)]
+    for group, trim in [("hrs1", "hours_trim"), ("trend_hrs1", "trend_hours_trim")]:
+        mean, sd = state.moments[group].params("hrs1")
+        threshold = mean + wlb_params["outlier_sd"] * sd
+        ref_threshold, ref_max = state.values[trim]
+        hrs_sd = ref[group].params("hrs1")[1]
+        derived += [(group, "hrs1", "outlier threshold", ref_threshold, threshold, hrs_sd),
+                    (group, "hrs1", "max hours", ref_max, state.sketches[group].max_at_most(threshold), hrs_sd)]
+    report = state.shift_report(derived, tolerance)
+
+    ### 4e. Save #############################################################
+    state.save(state_path)
+    cov_path = os.path.join(pipeline.cache_dir, ITEM_COVARIANCE_FILE)
+    if os.path.exists(cov_path):
+        CovarianceCache.load(cov_path).extend(dash).save(cov_path)
+
+    region_cube = part2_region_cube(cube, **params["dashboard_region_cube"])
+    if os.path.exists(os.path.join(project_dir, Z_DATASET)):
+        append_partitions(zs, os.path.join(project_dir, Z_DATASET))
+    for name, frame in [("dashboard_z_measures", zs), ("dashboard_cube", cube),
+                        ("dashboard_region_cube", region_cube), ("dashboard_distributions", distributions),
+                        ("dashboard_yearly_trends", yearly), ("dashboard_weighted_trends", weighted),
+                        ("dashboard_trend_bands", bands)]:
+        append_csv(frame, os.path.join(project_dir, name + ".csv"))
+        append_stage(frame, name, pipeline.cache_dir)
+    yearly.to_csv(os.path.join(project_dir, "dashboard_yearly_trends_new.csv"), index=False)
+    report.to_csv(os.path.join(project_dir, "dashboard_append_report.csv"), index=False)
+    return yearly, report
 
-trends["qol_trend"] = trends[qol_zs].mean(axis = 1, skipna = True)
 
-trends["qol_trend"].describe()
+##############################################################################
+### Part V - Column lineage and release diffs ################################
+##############################################################################
+""" GSS revises variables between releases (r1 -> r3) and the recode choices
+above change too. The lineage graph maps every raw GSS column through the recodes
+and indexes to the dashboard columns (c.f., gss_dashboard_lineage): the recode
+and index tables supply their own edges, the steps written as code declare theirs
+below. Stage column_lineage saves the lineage hash of every column with each
+build, so --diff-release NEW_SAS lists the columns a new release (or an edited
+recode) changes, and the raw variables behind each, without running anything.
+
+Rebuilding with --sas-file NEW_SAS then recomputes only what those columns feed:
+the stage cache keys each stage on the content of the columns it reads, so stages
+whose inputs come out unchanged (e.g. wlb_index and qol_index when only HAPCOHAB
+was revised) are cut off and loaded from the cache.
+"""
 
+RELEASE_DIFF_FILE = "release_diff.csv"
 
-trends.drop(qol_zs, axis = 1, inplace = True)
-trends.drop(["qol_raw"], axis = 1, inplace = True)
+trend_index_items = {"conf_trend": conf_items, "conf_gen_trend": factor1, "conf_gov_trend": factor2,
+                     "conf_media_trend": factor3, "religiosity_trend": relig_vars,
+                     "happiness_trend": hap_vars, "social_attitude_trend": soc_att_vars,
+                     "soc_trend": soc_items, "wlb_trend": wlb_vars, "qol_trend": ["educ", "health"]}
 
-#############################################################################
-##### Clean Data Table - Drop temp vars
 
-trends.drop(["hapmar", "hapcohab"], axis = 1, inplace = True)
+def lineage_edges(imputer = trend_imputer, imputer_args = trend_imputer_args):
+    """ (column, source columns, stage, definition) of the columns built in code. """
+    edges = [("wlb_raw", wlb_vars, "wlb_index", wlb_params),
+             ("qol_raw", ["educ", "health", "soc_raw", "wlb_raw"], "qol_index", "zmean")]
 
-categoricals = ["party_centered", "pol_centered", "gender", "party", "polview", 
-        "region", "mobile16", "race", "degree", "age_group", "ses_category", "place_category"]
+    # z-scores: each column standardized with its own (fitted) mean and sd
+    edges += [(col.replace("_raw", "_z") if col.endswith("_raw") else col + "_z", [col],
+               "dashboard_z_measures", "z") for col in z_columns]
 
-trends.drop(categoricals, axis = 1, inplace = True)
+    # trend items: year means fill only their own column; other imputers read every item
+    imputed_from = {var: [var] if imputer == "year_mean" else trend_impute_vars for var in trend_impute_vars}
+    edges += [(var + "_trend", imputed_from[var], "trend_indexes", {imputer: imputer_args})
+              for var in trend_impute_vars]
+    edges += [(name, [var + "_trend" for var in items] + (["soc_trend", "wlb_trend"] if name == "qol_trend" else []),
+               "trend_indexes", wlb_params if name == "wlb_trend" else name)
+              for name, items in trend_index_items.items()]
+    return edges
 
-#############################################################################
-## Part 3b. Standardize Imputed Trends ######################################
-##############################################################################
 
-scaler = StandardScaler()
+def dashboard_lineage(spec = recode_spec, specs = index_specs, edges = None):
+    """ LineageGraph of every dashboard column. """
+    graph = LineageGraph()
+    graph.add_recodes(spec)
+    graph.add_indexes(specs, "item_indexes")
+    for column, sources, stage, definition in (lineage_edges() if edges is None else edges):
+        graph.add(column, sources, stage, definition)
+    return graph
 
-exclude_vars = ["YEAR"]
-trends_numeric = trends.select_dtypes(include='number').columns.difference(exclude_vars)
 
-trends[trends_numeric] = scaler.fit_transform(trends[trends_numeric])
+def column_lineage(raw, spec, specs, edges):
+    """ Stage column_lineage: lineage hash of every column of this build. """
+    return dashboard_lineage(spec, specs, edges).to_frame(raw)
 
-### 3C. Finally, Aggregate #######################################################
-######### Indices By year
-yr_trends = trends.groupby("YEAR").mean().reset_index()
 
-## 3D. Save ############################################
-yr_trends.to_csv("dashboard_yearly_trends.csv", index=False)
+def diff_release(pipeline, path, project_dir):
+    """ Per-column diff of the last build against a new release file (nothing is rebuilt). """
+    old = pipeline.get("column_lineage")
+    lineage = pipeline.stages["column_lineage"]
+    graph = dashboard_lineage(lineage.params["spec"], lineage.params["specs"], lineage.params["edges"])
+    raw = read_gss_columns(path, [col for col in graph.raw if col in raw_columns])
+    diff = release_diff(old, graph.to_frame(raw))
+    diff.to_csv(os.path.join(project_dir, RELEASE_DIFF_FILE), index = False)
+    return diff
 
 
+##############################################################################
+## Stage graph
+##############################################################################
 
+def build_pipeline(project_dir = PROJECT_DIR, sas_file = GSS_SAS_FILE, multiprocess = False, num_processes = 4,
+                   compact = None):
+    return Pipeline([
+        Stage("gss_rawdata", load_gss_raw,
+              params = {"path": sas_file, "columns": raw_columns, "source": file_fingerprint(sas_file)},
+              options = {"multiprocess": multiprocess, "num_processes": num_processes},
+              code = ["gss_dashboard_ingest"]),
+
+        Stage("recodes", part1a_recodes, inputs = ["gss_rawdata"], params = {"spec": recode_spec},
+              code = ["gss_dashboard_recodes"]),
+
+        Stage("item_indexes", item_indexes, inputs = [("recodes", index_items)],
+              params = {"specs": index_specs}, code = ["gss_dashboard_indexes"]),
+        Stage("wlb_index", wlb_index, inputs = [("recodes", wlb_vars)], params = wlb_params,
+              code = [work_life_balance, hours_trim]),
+        Stage("qol_index", qol_index, inputs = [("recodes", ["educ", "health"]), ("item_indexes", ["soc_raw"]), "wlb_index"],
+              params = {"min_valid": 4}, code = [qol_components, "gss_dashboard_indexes"]),
+
+        Stage("dashboard_raw", part1c_dashboard_raw,
+              inputs = ["recodes", "item_indexes", "wlb_index", "qol_index"]),
+
+        Stage("z_params", part2_z_params, inputs = [("dashboard_raw", z_columns)],
+              params = {"columns": z_columns}, compact = False, code = ["gss_dashboard_standardize"]),
+        Stage("dashboard_z_measures", part2_z_measures, inputs = ["dashboard_raw", "z_params"],
+              params = {"conf_vars": conf_items, "relig_vars": relig_vars, "hap_vars": hap_vars,
+                        "soc_att_vars": soc_att_vars, "soc_vars": soc_items, "wlb_vars": wlb_vars},
+              code = ["gss_dashboard_standardize"]),
+
+        Stage("dashboard_cube", part2_cube,
+              inputs = [("dashboard_z_measures", ["YEAR"] + cube_measures + cube_dimensions)],
+              params = {"measures": cube_measures, "dimensions": cube_dimensions, "pairs": cube_pairs},
+              code = ["gss_dashboard_cube"]),
+
+        Stage("dim_state", geography_states,
+              params = {"path": REGION_STATE_FILE, "source": file_fingerprint(REGION_STATE_FILE),
+                        "region_map": region_map}, code = ["gss_dashboard_geography"]),
+        Stage("dim_region", geography_regions, inputs = ["dim_state"], params = {"region_map": region_map},
+              code = ["gss_dashboard_geography"]),
+        Stage("dashboard_region_cube", part2_region_cube, inputs = ["dashboard_cube"],
+              params = {"region_map": region_map}, code = ["gss_dashboard_geography"]),
+
+        Stage("dashboard_distributions", part2_distributions, inputs = [("recodes", ["YEAR"] + cube_dimensions)],
+              params = {"dimensions": cube_dimensions}, code = ["gss_dashboard_cube"]),
+
+        Stage("trends_imputed", part3_impute, inputs = ["dashboard_raw"],
+              params = {"variables": trend_impute_vars, "imputer": trend_imputer,
+                        "imputer_args": trend_imputer_args}, code = ["gss_dashboard_impute"]),
+
+        Stage("trend_indexes", part3_trend_indexes, inputs = ["trends_imputed"],
+              params = {"conf_vars": conf_items, "factor1": factor1, "factor2": factor2,
+                        "factor3": factor3, "relig_vars": relig_vars, "hap_vars": hap_vars,
+                        "soc_att_vars": soc_att_vars, "soc_vars": soc_items, "wlb_vars": wlb_vars,
+                        **wlb_params},
+              code = [work_life_balance, hours_trim, "gss_dashboard_standardize"]),
+        Stage("trend_z_params", part3_trend_z_params, inputs = ["trend_indexes"], compact = False,
+              code = [trend_numeric_columns, "gss_dashboard_standardize"]),
+        Stage("trend_scores", part3_trend_scores, inputs = ["trend_indexes", "trend_z_params"],
+              code = [trend_numeric_columns, "gss_dashboard_standardize"]),
+        Stage("dashboard_yearly_trends", part3_yearly_trends, inputs = ["trend_scores"]),
+
+        Stage("survey_design", survey_design, inputs = [("gss_rawdata", design_columns)],
+              code = ["gss_dashboard_survey"]),
+        Stage("dashboard_weighted_trends", part3_weighted_trends,
+              inputs = ["trend_scores", "survey_design", ("dashboard_raw", cube_dimensions)],
+              params = {"dimensions": cube_dimensions, "level": 0.95}, code = ["gss_dashboard_survey"]),
+        Stage("dashboard_trend_bands", part3_trend_bands, inputs = ["trend_scores"],
+              params = bootstrap_params, options = {"processes": num_processes},
+              code = ["gss_dashboard_bootstrap"]),
+
+        Stage("column_lineage", column_lineage, inputs = [("gss_rawdata", raw_columns)],
+              params = {"spec": recode_spec, "specs": index_specs, "edges": lineage_edges()}, compact = False,
+              code = [dashboard_lineage, "gss_dashboard_lineage"]),
+
+        Stage("trends_mi", part3_multiple_imputation, inputs = [("dashboard_raw", ["YEAR"] + trend_impute_vars)],
+              params = {"variables": trend_impute_vars, **mi_params},
+              options = {"processes": num_processes}, code = ["gss_dashboard_impute"]),
+    ], cache_dir = os.path.join(project_dir, "stage_cache"), compact = compact)
+
+
+# stages built by default; trends_mi (multiple imputation) runs only when targeted
+default_targets = ["dashboard_z_measures", "dashboard_cube", "dashboard_distributions", "dashboard_yearly_trends",
+                   "dashboard_weighted_trends", "dashboard_trend_bands", "dim_state", "dim_region",
+                   "dashboard_region_cube", "column_lineage"]
+
+
+def write_tiles(pipeline, args):
+    """ Static JSON tiles of the built (and appended) cube and yearly trends. """
+    pipeline.run(["dashboard_cube", "dashboard_yearly_trends"])
+    cube, yearly = (load_with_appended(name, cache_dir = pipeline.cache_dir)
+                    for name in ["dashboard_cube", "dashboard_yearly_trends"])
+    manifest = write_bundle(cube, yearly, os.path.join(args.project_dir, "tiles"), processes = args.processes)
+    print(f"tiles: {manifest['changed']} of {len(manifest['tiles'])} rewritten")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Build the GSS dashboard tables.")
+    parser.add_argument("--project-dir", default = PROJECT_DIR, help = "where the stage cache and dashboard CSVs live")
+    parser.add_argument("--sas-file", default = GSS_SAS_FILE)
+    parser.add_argument("--targets", nargs = "*", default = default_targets,
+                        help = f"stages to bring up to date (default: {' '.join(default_targets)})")
+    parser.add_argument("--force", nargs = "*", default = [], help = "stages to recompute regardless of their key")
+    parser.add_argument("--processes", type = int, default = 1,
+                        help = "worker processes for the SAS read, the imputation chains and the bootstrap")
+    parser.add_argument("--append", metavar = "SAS_FILE",
+                        help = "add the waves in this file (new cumulative release or single wave) without rebuilding")
+    parser.add_argument("--shift-tolerance", type = float, default = 0.01,
+                        help = "flag global statistics that move by more than this many reference sds")
+    parser.add_argument("--diff-release", metavar = "SAS_FILE",
+                        help = "list the columns a new release changes against the last build (no rebuild)")
+    parser.add_argument("--compact", choices = ["exact", "float32"],
+                        help = "store stage tables in compact dtypes (float32: z-scores and indexes rounded too)")
+    parser.add_argument("--memory-report", action = "store_true",
+                        help = "write the memory of every built stage, as stored and compacted, to stage_memory.csv")
+    parser.add_argument("--tiles", action = "store_true",
+                        help = "write the static JSON tile bundle of every view to <project dir>/tiles")
+    parser.add_argument("--plots", action = "store_true", help = "show the distribution plots")
+    parser.add_argument("--dry-run", action = "store_true", help = "only list the stages that would be recomputed")
+    args = parser.parse_args(argv)
+
+    pipeline = build_pipeline(args.project_dir, args.sas_file,
+                              multiprocess = args.processes > 1, num_processes = args.processes,
+                              compact = args.compact)
+    if args.dry_run:
+        print("Stale stages:", pipeline.stale(args.targets))
+        return pipeline
+
+    if args.diff_release:
+        diff = diff_release(pipeline, args.diff_release, args.project_dir)
+        changed = diff[diff["status"] != "unchanged"]
+        print(f"{len(changed)} of {len(diff)} columns differ:")
+        print(changed.groupby("stage")["column"].agg(" ".join).to_string())
+        return pipeline
+
+    if args.append:
+        yearly, report = append_wave(pipeline, args.append, args.project_dir,
+                                     args.shift_tolerance, args.processes)
+        print("Appended years:", list(yearly["YEAR"]))
+        print("Shifted statistics:\n", report[report["shifted"]])
+        if args.tiles:
+            write_tiles(pipeline, args)
+        return pipeline
+
+    computed = pipeline.run(args.targets, force = args.force)
+    print("Recomputed stages:", computed)
+
+    # Part 2C / 3D. Tableau data sources, rewritten only when their stage was recomputed
+    if "dashboard_z_measures" in computed:
+        gss_zs = pipeline.get("dashboard_z_measures")
+        gss_zs.to_csv(os.path.join(args.project_dir, "dashboard_z_measures.csv"), index=False)
+        # the same table partitioned by YEAR, for readers that need a few years / columns
+        write_partitioned(gss_zs, os.path.join(args.project_dir, Z_DATASET))
+
+        ### Save a sample for GIThub Repo ####
+        gss_z_sample = gss_zs.sample(frac=0.1)
+        gss_z_sample.to_csv(os.path.join(args.project_dir, "gss_z_sample.csv"), index=False)
+
+    if "dashboard_cube" in computed:
+        cube = pipeline.get("dashboard_cube")
+        cube.to_csv(os.path.join(args.project_dir, "dashboard_cube.csv"), index=False)
+
+    # star schema for the state map: region facts + region / state dimensions
+    for name in ["dim_state", "dim_region", "dashboard_region_cube"]:
+        if name in computed:
+            pipeline.get(name).to_csv(os.path.join(args.project_dir, name + ".csv"), index=False)
+
+    if "dashboard_distributions" in computed:
+        distributions = pipeline.get("dashboard_distributions")
+        distributions.to_csv(os.path.join(args.project_dir, "dashboard_distributions.csv"), index=False)
+
+    if "dashboard_yearly_trends" in computed:
+        yr_trends = pipeline.get("dashboard_yearly_trends")
+        yr_trends.to_csv(os.path.join(args.project_dir, "dashboard_yearly_trends.csv"), index=False)
+
+    if "dashboard_weighted_trends" in computed:
+        weighted = pipeline.get("dashboard_weighted_trends")
+        weighted.to_csv(os.path.join(args.project_dir, "dashboard_weighted_trends.csv"), index=False)
+
+    if "dashboard_trend_bands" in computed:
+        bands = pipeline.get("dashboard_trend_bands")
+        bands.to_csv(os.path.join(args.project_dir, "dashboard_trend_bands.csv"), index=False)
+
+    if "trends_mi" in computed:
+        trends_mi = pipeline.get("trends_mi")
+        trends_mi.to_csv(os.path.join(args.project_dir, "dashboard_yearly_trends_mi.csv"), index=False)
+
+    if args.tiles:
+        write_tiles(pipeline, args)
+
+    if args.memory_report:
+        # tables as stored in the stage cache (pipeline.get hands compact items out as float32)
+        report = memory_report({name: load_stage(name, cache_dir = pipeline.cache_dir)
+                                for name in pipeline.order(args.targets)},
+                               lossy = args.compact == "float32")
+        report.to_csv(os.path.join(args.project_dir, "stage_memory.csv"), index = False)
+        print(report.to_string(index = False))
+
+    if args.plots:
+        plot_distributions(pipeline.get("recodes", ["ses_index"]), ["ses_index"], bins = 16)
+        plot_distributions(pipeline.get("dashboard_raw", measures), measures)
+        plot_distributions(pipeline.get("dashboard_z_measures", measures_z), measures_z)
+    return pipeline
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+GSS wave appends
+State for adding a new GSS wave without rebuilding the 1972-2022 history.
+
+Every yearly aggregate of the dashboard is additive over years, but a handful of
+global statistics feed every row: the SES component means/sds and the Low/Mid/High
+SES cut points, the work-hours outlier threshold and maximum, and the means/sds
+behind every z-score. A wave append therefore
+    1. scores the new rows against the *reference* values of the last full
+       build (frozen, so the history's rows stay valid), and
+    2. folds the new rows into running accumulators of the same statistics, so
+       the report shows how far each one would move in a full rebuild.
+Moments are kept as StandardizationRegistry (Welford) accumulators. Quantile-like
+statistics (SES cuts, the largest trimmed hours) use a QuantileSketch: a
+fixed-grid histogram, which merges exactly by adding counts and answers
+quantiles to within one bin width. grouped_sketches() builds one sketch per
+year in a single pass (e.g. per-year SES cuts), and a rolling window of years is
+the merge of their sketches.
+
+WaveState is saved next to the stage cache (.npz with a JSON meta entry) and
+holds the reference, the accumulators, the covered years and the history's row
+count, so the next append only has to read rows past that count.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from gss_dashboard_standardize import StandardizationRegistry
+
+
+class QuantileSketch:
+    """ Mergeable fixed-grid histogram: `bins` equal bins over [low, high).
+
+    Values outside the grid are counted in the first / last bin; the exact
+    minimum and maximum are tracked, so quantiles never leave the data's range.
+    """
+
+    def __init__(self, low, high, bins, counts=None, minimum=np.inf, maximum=-np.inf):
+        self.low, self.high, self.bins = float(low), float(high), int(bins)
+        self.width = (self.high - self.low) / self.bins
+        self.counts = np.zeros(self.bins) if counts is None else np.asarray(counts, dtype=float)
+        self.minimum, self.maximum = float(minimum), float(maximum)
+
+    @property
+    def count(self):
+        return self.counts.sum()
+
+    def update(self, values):
+        """ Add the non-missing values; returns self. """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.counts += np.bincount(self.bin(values), minlength=self.bins)
+            self.minimum = min(self.minimum, values.min())
+            self.maximum = max(self.maximum, values.max())
+        return self
+
+    def bin(self, values):
+        """ Bin index of each (non-missing) value. """
+        return np.clip(np.floor((values - self.low) / self.width), 0, self.bins - 1).astype(np.int64)
+
+    def merge(self, other):
+        """ Sketch of the pooled values of self and other (same grid). """
+        if (self.low, self.high, self.bins) != (other.low, other.high, other.bins):
+            raise ValueError("only sketches on the same grid can be merged")
+        return QuantileSketch(self.low, self.high, self.bins, self.counts + other.counts,
+                              min(self.minimum, other.minimum), max(self.maximum, other.maximum))
+
+    def copy(self):
+        return QuantileSketch(self.low, self.high, self.bins, self.counts.copy(), self.minimum, self.maximum)
+
+    def quantile(self, q):
+        """ Quantile(s) with linear interpolation of the ranks (as np.quantile),
+        values spread evenly within their bin. """
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        n = self.count
+        if n == 0:
+            return np.full(q.shape, np.nan)
+        cum = np.cumsum(self.counts)
+        rank = q * (n - 1) # 0-based rank of each quantile
+        lower = np.floor(rank)
+        below, above = self._value_at(cum, lower), self._value_at(cum, np.minimum(lower + 1, n - 1))
+        return below + (rank - lower) * (above - below)
+
+    def _value_at(self, cum, rank):
+        # the value of integer rank r, spread evenly within its bin
+        b = np.searchsorted(cum, rank, side="right").clip(0, self.bins - 1)
+        before = cum[b] - self.counts[b]
+        values = self.low + self.width * (b + (rank - before + 0.5) / np.maximum(self.counts[b], 1))
+        return np.clip(values, self.minimum, self.maximum)
+
+    def max_at_most(self, limit):
+        """ Largest value <= limit, to within one bin (exact for integers on a unit grid). """
+        occupied = np.flatnonzero(self.counts > 0)
+        edges = self.low + self.width * occupied
+        below = occupied[edges <= limit]
+        if not len(below):
+            return np.nan
+        return min(self.low + self.width * below[-1], self.maximum)
+
+
+def grouped_sketches(values, groups, low, high, bins):
+    """ {group: QuantileSketch} of `values` within each group, from one bincount. """
+    values = np.asarray(values, dtype=float)
+    codes, labels = pd.factorize(np.asarray(groups), sort=True)
+    keep = ~np.isnan(values) & (codes >= 0)
+    values, codes = values[keep], codes[keep]
+    grid = QuantileSketch(low, high, bins)
+    counts = np.bincount(codes * bins + grid.bin(values), minlength=len(labels) * bins).reshape(len(labels), bins)
+    minimum, maximum = np.full(len(labels), np.inf), np.full(len(labels), -np.inf)
+    np.minimum.at(minimum, codes, values)
+    np.maximum.at(maximum, codes, values)
+    return {label: QuantileSketch(low, high, bins, counts[i], minimum[i], maximum[i])
+            for i, label in enumerate(labels)}
+
+
+def rolling_quantiles(sketches, q, window=1, groups=None):
+    """ {group: quantiles} of each group's values pooled with the `window` - 1 groups
+    before it (in sorted order); groups: the groups to answer (default: all). """
+    ordered = sorted(sketches)
+    out = {}
+    for i, group in enumerate(ordered):
+        if groups is not None and group not in groups:
+            continue
+        pooled = sketches[group]
+        for earlier in ordered[max(0, i - window + 1):i]:
+            pooled = pooled.merge(sketches[earlier])
+        out[group] = pooled.quantile(q)
+    return out
+
+
+def _registry_meta(registry):
+    return {var: list(stats) for var, stats in registry.moments.items()}
+
+
+def _registry_from_meta(meta):
+    registry = StandardizationRegistry()
+    registry.moments = {var: tuple(stats) for var, stats in meta.items()}
+    return registry
+
+
+class WaveState:
+    """ Reference statistics of the last full build and their running totals.
+
+    reference / moments:           {group: StandardizationRegistry}
+    reference_sketches / sketches: {name: QuantileSketch}
+    values:  frozen scalars of the build (e.g. SES cut points, hours trim)
+    carry:   {item: mean} of the last year, for items a new wave did not ask
+    years:   years covered; n_rows: rows of the cumulative file covered
+    key:     identity of the build the reference was fitted from
+    """
+
+    def __init__(self, reference, reference_sketches, values, carry, years, n_rows, key,
+                 moments=None, sketches=None):
+        self.reference = reference
+        self.reference_sketches = reference_sketches
+        self.values = values
+        self.carry = carry
+        self.years = [float(year) for year in years]
+        self.n_rows = int(n_rows)
+        self.key = key
+        # the accumulators start from the reference
+        self.moments = moments if moments is not None else \
+            {group: StandardizationRegistry().merge(reg) for group, reg in reference.items()}
+        self.sketches = sketches if sketches is not None else \
+            {name: sketch.copy() for name, sketch in reference_sketches.items()}
+
+    def update(self, group, frame, columns=None):
+        """ Fold rows into the running moments of a group. """
+        self.moments[group].update(frame, columns)
+
+    def shift_report(self, derived=(), tolerance=0.01):
+        """ How far every tracked statistic moved from its reference value.
+
+        Every moment group reports the mean and sd of its variables; `derived`
+        adds rows (group, variable, statistic, reference, updated, scale) for
+        statistics computed from the moments or sketches. A statistic is flagged
+        `shifted` when |updated - reference| exceeds `tolerance` times its scale
+        (the variable's reference sd).
+        """
+        rows = []
+        for group, registry in self.reference.items():
+            for var in registry.variables:
+                ref_mean, ref_sd = registry.params(var)
+                new_mean, new_sd = self.moments[group].params(var)
+                rows.append((group, var, "mean", ref_mean, new_mean, ref_sd))
+                rows.append((group, var, "sd", ref_sd, new_sd, ref_sd))
+        report = pd.DataFrame(rows + list(derived),
+                              columns=["group", "variable", "statistic", "reference", "updated", "scale"])
+        report["shift"] = report["updated"] - report["reference"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            report["scaled_shift"] = report["shift"] / report["scale"]
+        report["shifted"] = report["scaled_shift"].abs() > tolerance
+        return report.drop(columns="scale")
+
+    ##########################################################################
+    ## Persistence
+
+    def save(self, path):
+        sketch_grids = {name: [s.low, s.high, s.bins, s.minimum, s.maximum]
+                        for name, s in self.sketches.items()}
+        reference_grids = {name: [s.low, s.high, s.bins, s.minimum, s.maximum]
+                           for name, s in self.reference_sketches.items()}
+        meta = {"reference": {g: _registry_meta(r) for g, r in self.reference.items()},
+                "moments": {g: _registry_meta(r) for g, r in self.moments.items()},
+                "sketches": sketch_grids, "reference_sketches": reference_grids,
+                "values": self.values, "carry": self.carry, "years": self.years,
+                "n_rows": self.n_rows, "key": self.key}
+        arrays = {"sketch/" + name: s.counts for name, s in self.sketches.items()}
+        arrays.update({"reference_sketch/" + name: s.counts for name, s in self.reference_sketches.items()})
+        np.savez_compressed(path, meta=json.dumps(meta, default=float), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        meta = json.loads(str(data["meta"]))
+
+        def sketches(kind, prefix):
+            return {name: QuantileSketch(low, high, bins, data[prefix + name], minimum, maximum)
+                    for name, (low, high, bins, minimum, maximum) in meta[kind].items()}
+
+        return cls({g: _registry_from_meta(m) for g, m in meta["reference"].items()},
+                   sketches("reference_sketches", "reference_sketch/"),
+                   meta["values"], meta["carry"], meta["years"], meta["n_rows"], meta["key"],
+                   moments={g: _registry_from_meta(m) for g, m in meta["moments"].items()},
+                   sketches=sketches("sketches", "sketch/"))
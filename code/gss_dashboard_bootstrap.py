@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+GSS bootstrap bands
+Percentile confidence bands for yearly means, resampling respondents within
+each year.
+
+A bootstrap replicate of year y draws n_y respondents of that year with
+replacement, i.e. gives each respondent a multinomial count c_i. All replicates
+of a year are one (replicates x respondents) count matrix C, so every replicate
+mean of every measure comes out of two matrix products,
+    sums = C @ X0      counts = C @ M
+(X0: the year's measures with missing set to 0, M: their presence mask).
+Replicates are generated and multiplied in chunks to bound memory, and the
+chunks can be spread over a process pool.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def replicate_counts(n, n_reps, rng):
+    """ (n_reps x n) multinomial(n, 1/n) counts: how often each row is drawn. """
+    draws = rng.integers(0, n, size=(n_reps, n))
+    flat = (draws + np.arange(n_reps)[:, None] * n).ravel()
+    return np.bincount(flat, minlength=n_reps * n).reshape(n_reps, n).astype(float)
+
+
+def _bootstrap_chunk(filled, present, starts, n_reps, seed):
+    """ (n_reps x years x measures) replicate means for rows sorted by year. """
+    rng = np.random.default_rng(seed)
+    bounds = list(starts) + [len(filled)]
+    out = np.empty((n_reps, len(starts), filled.shape[1]))
+    for y in range(len(starts)):
+        lo, hi = bounds[y], bounds[y + 1]
+        counts = replicate_counts(hi - lo, n_reps, rng)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[:, y] = (counts @ filled[lo:hi]) / (counts @ present[lo:hi])
+    return out
+
+
+def bootstrap_yearly_means(frame, measures, n_reps=1000, year="YEAR", chunk=100,
+                           processes=1, seed=0):
+    """ Replicate yearly means: (n_reps x years x measures) array and the years.
+
+    processes: worker processes for the chunks (1, the default: this process;
+    None: one per core). Use processes > 1 only behind an
+    `if __name__ == "__main__":` guard, as spawned workers re-import the
+    calling script.
+    """
+    measures = list(measures)
+    codes, years = pd.factorize(frame[year], sort=True)
+    order = np.argsort(codes, kind="stable")
+    values = frame[measures].to_numpy(dtype=float)[order]
+    present = (~np.isnan(values)).astype(float)
+    filled = np.where(present > 0, values, 0.0)
+    starts = np.searchsorted(codes[order], np.arange(len(years)))
+
+    sizes = [min(chunk, n_reps - lo) for lo in range(0, n_reps, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(filled, present, starts, size, s) for size, s in zip(sizes, seeds)]
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(args) == 1:
+        parts = [_bootstrap_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(_bootstrap_chunk, *zip(*args)))
+    return np.concatenate(parts), np.asarray(years)
+
+
+def bootstrap_bands(frame, measures, n_reps=1000, level=0.95, year="YEAR", chunk=100,
+                    processes=1, seed=0):
+    """ Long table of yearly means with bootstrap SEs and percentile bands.
+
+    One row per (year, measure): mean (full sample), se (sd of the replicates),
+    ci_low / ci_high (the replicates' (1 - level) / 2 and (1 + level) / 2 quantiles).
+    """
+    measures = list(measures)
+    replicates, years = bootstrap_yearly_means(frame, measures, n_reps, year, chunk, processes, seed)
+    point = frame.groupby(year)[measures].mean().reindex(years).to_numpy()
+    low, high = np.nanquantile(replicates, [(1 - level) / 2, (1 + level) / 2], axis=0)
+    se = np.nanstd(replicates, axis=0, ddof=1)
+
+    grid = pd.MultiIndex.from_product([years, measures], names=[year, "measure"])
+    return pd.DataFrame({"mean": point.ravel(), "se": se.ravel(), "ci_low": low.ravel(),
+                         "ci_high": high.ravel()}, index=grid).reset_index()
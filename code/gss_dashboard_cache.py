@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+GSS stage cache
+Typed, columnar replacement for the CSV "short saves" between pipeline parts.
+
+Each stage table is written as an uncompressed Arrow IPC (Feather v2) file, which:
+    - keeps dtypes (floats stay floats, categoricals stay categorical)
+    - lets a later stage load only the columns it needs
+    - can be memory-mapped, so loading does not reparse any text
+
+Waves added after the build (--append) are kept apart from the stage files, in
+appended/<stage>.arrow, together with the size and save time of the stage file
+they extend: load_with_appended() returns the stage plus those rows, and drops
+them once the stage itself is rebuilt.
+"""
+
+import os
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+CACHE_DIR = "stage_cache"
+APPENDED_DIR = "appended"
+
+
+def stage_path(name, cache_dir=CACHE_DIR):
+    """ File location of a stage artifact. """
+    return os.path.join(cache_dir, name + ".arrow")
+
+
+def stage_exists(name, cache_dir=CACHE_DIR):
+    return os.path.exists(stage_path(name, cache_dir))
+
+
+def save_stage(frame, name, cache_dir=CACHE_DIR):
+    """ Save a stage DataFrame as an Arrow IPC file.
+
+    The file is written uncompressed (so it can be memory-mapped) to a temporary
+    name first, then moved into place, so an interrupted run never leaves a
+    half-written artifact behind.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = stage_path(name, cache_dir)
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    feather.write_feather(table, path + ".tmp", compression="uncompressed")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_stage(name, columns=None, cache_dir=CACHE_DIR, memory_map=True):
+    """ Load a stage artifact, optionally only a subset of its columns. """
+    table = load_stage_table(name, columns, cache_dir, memory_map)
+    return table.to_pandas()
+
+
+def load_stage_table(name, columns=None, cache_dir=CACHE_DIR, memory_map=True):
+    """ Load a stage artifact as a pyarrow Table (no conversion to pandas). """
+    path = stage_path(name, cache_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Stage '{name}' has not been saved yet: {path}")
+    return feather.read_table(path, columns=columns, memory_map=memory_map)
+
+
+def stage_columns(name, cache_dir=CACHE_DIR):
+    """ Column names of a stage artifact, read from the file schema only. """
+    return load_stage_table(name, cache_dir=cache_dir).schema.names
+
+
+def _stage_stamp(name, cache_dir):
+    """ (size, save time) of a stage file: which build the appended rows extend. """
+    info = os.stat(stage_path(name, cache_dir))
+    return [info.st_size, info.st_mtime_ns]
+
+
+def appended_rows(name, cache_dir=CACHE_DIR):
+    """ Rows appended to a stage since it was built, or None. """
+    appended = os.path.join(cache_dir, APPENDED_DIR)
+    marker = os.path.join(appended, name + ".json")
+    if not (os.path.exists(marker) and stage_exists(name, cache_dir) and stage_exists(name, appended)):
+        return None
+    with open(marker) as f:
+        if json.load(f) != _stage_stamp(name, cache_dir): # the stage was rebuilt since
+            return None
+    return load_stage(name, cache_dir=appended, memory_map=False)
+
+
+def append_stage(frame, name, cache_dir=CACHE_DIR):
+    """ Add `frame` to the rows appended to a stage (its own file is left as built). """
+    appended = os.path.join(cache_dir, APPENDED_DIR)
+    previous = appended_rows(name, cache_dir)
+    if previous is not None:
+        frame = pd.concat([previous, frame], ignore_index=True)
+    save_stage(frame, name, appended)
+    with open(os.path.join(appended, name + ".json"), "w") as f:
+        json.dump(_stage_stamp(name, cache_dir), f)
+
+
+def load_with_appended(name, columns=None, cache_dir=CACHE_DIR, memory_map=True):
+    """ A stage with the rows appended since its build. """
+    frame = load_stage(name, columns, cache_dir, memory_map)
+    rows = appended_rows(name, cache_dir)
+    if rows is None:
+        return frame
+    return pd.concat([frame, rows if columns is None else rows[columns]], ignore_index=True)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+GSS dimension cube
+Count, sum and sum of squares of every measure by year and dashboard filter, so
+every dashboard view (a yearly mean or sd for one filter level) is a lookup.
+
+Each filter column is encoded once as integer codes (-1 missing). For a block
+of dimensions (a single filter, or a 2-way combination), each row's cell is
+    key = (year code * n_levels + level code) * n_measures + measure
+and one bincount per statistic over the (rows x measures) matrix gives every
+cell of the block at once. Missing measure values are left out of their cell;
+rows with a missing filter value are left out of that filter's block.
+
+The cube is long: one row per (year, dimension level(s), measure) with
+count > 0. mean = sum / count and
+sd = sqrt((sumsq - sum^2 / count) / (count - 1)).
+
+The distribution panels need frequencies rather than moments: how many
+respondents of each year fall in each level of each filter, missing included.
+distribution_table() stacks every filter's codes into one key array,
+    key = offset[dimension] + year code * (n_levels + 1) + level code
+(missing as level n_levels), so a single bincount gives every dimension x year
+frequency table.
+"""
+
+import numpy as np
+import pandas as pd
+
+ALL = "all"
+NA_LEVEL = "NA"
+
+
+def encode_dimension(column):
+    """ Integer codes (-1 missing) and level labels of one filter column. """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy().astype(np.int64), list(column.cat.categories)
+    codes, labels = pd.factorize(column, sort=True)
+    return codes.astype(np.int64), list(labels)
+
+
+def encode_dimensions(frame, dimensions):
+    """ {dimension: (codes, labels)} for the filter columns of `frame`. """
+    return {dim: encode_dimension(frame[dim]) for dim in dimensions}
+
+
+def grouped_moments(filled, present, keys, n_keys):
+    """ (keys x measures) count, sum and sum of squares; rows with key < 0 are skipped. """
+    n_rows, k = filled.shape
+    keep = keys >= 0
+    cell = (keys[keep, None] * k + np.arange(k)).ravel()
+    size = n_keys * k
+    x = filled[keep].ravel()
+    count = np.bincount(cell, weights=present[keep].ravel(), minlength=size)
+    total = np.bincount(cell, weights=x, minlength=size)
+    sumsq = np.bincount(cell, weights=x * x, minlength=size)
+    return count.reshape(n_keys, k), total.reshape(n_keys, k), sumsq.reshape(n_keys, k)
+
+
+def _block(year_codes, years, encoded, dims, filled, present, measures, year):
+    """ Long frame of one dimension block (no dims: the yearly totals). """
+    keys = year_codes.copy()
+    shape = [len(years)]
+    for dim in dims:
+        codes, labels = encoded[dim]
+        keys = np.where((keys >= 0) & (codes >= 0), keys * len(labels) + codes, -1)
+        shape.append(len(labels))
+    count, total, sumsq = grouped_moments(filled, present, keys, int(np.prod(shape)))
+
+    cell, measure = np.nonzero(count)
+    index = np.unravel_index(cell, shape)
+    block = {year: years[index[0]]}
+    for n, slot in enumerate(["", "_2"]):
+        dim = dims[n] if n < len(dims) else None
+        block["dimension" + slot] = dim if dim is not None else (ALL if n == 0 else None)
+        block["level" + slot] = np.asarray(encoded[dim][1], dtype=object)[index[n + 1]] \
+            if dim is not None else (ALL if n == 0 else None)
+    block["measure"] = np.asarray(measures, dtype=object)[measure]
+    block["count"] = count[cell, measure]
+    block["sum"] = total[cell, measure]
+    block["sumsq"] = sumsq[cell, measure]
+    return pd.DataFrame(block)
+
+
+def build_cube(frame, measures, dimensions, pairs=(), year="YEAR"):
+    """ Cube of `measures` by year for the totals, each dimension and each pair.
+
+    pairs: (dimension, dimension) combinations to cross, e.g. ("gender", "age_group").
+    """
+    measures = list(measures)
+    values = frame[measures].to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    year_codes, years = pd.factorize(frame[year], sort=True)
+    years = np.asarray(years)
+    encoded = encode_dimensions(frame, set(dimensions) | {d for pair in pairs for d in pair})
+
+    blocks = [()] + [(dim,) for dim in dimensions] + [tuple(pair) for pair in pairs]
+    return pd.concat([_block(year_codes, years, encoded, dims, filled, present, measures, year)
+                      for dims in blocks], ignore_index=True)
+
+
+def cube_view(cube, measure, dimension=ALL, dimension_2=None):
+    """ Yearly mean and sd of `measure` by the levels of a dimension (or pair) from the cube. """
+    rows = cube[(cube["measure"] == measure) & (cube["dimension"] == dimension)]
+    rows = rows[rows["dimension_2"].isna()] if dimension_2 is None else \
+        rows[rows["dimension_2"] == dimension_2]
+    view = rows.copy()
+    view["mean"] = view["sum"] / view["count"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        view["sd"] = np.sqrt((view["sumsq"] - view["sum"] ** 2 / view["count"]) / (view["count"] - 1))
+    return view
+
+
+def distribution_table(frame, dimensions, year="YEAR"):
+    """ Frequency and share of every level of each dimension by year, in one pass.
+
+    One row per (year, dimension, level), missing values as level "NA"; share is
+    the level's count over the year's rows. year=None gives the pooled table
+    (the value_counts(dropna=False) of every dimension).
+    """
+    if year is None:
+        year_codes, years = np.zeros(len(frame), dtype=np.int64), np.array([ALL], dtype=object)
+    else:
+        year_codes, years = pd.factorize(frame[year], sort=True)
+        years = np.asarray(years)
+    encoded = encode_dimensions(frame, dimensions)
+
+    sizes = [len(encoded[dim][1]) + 1 for dim in dimensions] # + NA bucket
+    offsets = np.concatenate([[0], np.cumsum([len(years) * size for size in sizes])])
+    keys = np.concatenate([offsets[j] + year_codes * size + np.where(encoded[dim][0] >= 0, encoded[dim][0], size - 1)
+                           for j, (dim, size) in enumerate(zip(dimensions, sizes))])
+    counts = np.bincount(keys[np.tile(year_codes >= 0, len(dimensions))], minlength=offsets[-1])
+
+    blocks = []
+    for j, dim in enumerate(dimensions):
+        table = counts[offsets[j]:offsets[j + 1]].reshape(len(years), sizes[j])
+        labels = np.asarray(list(encoded[dim][1]) + [NA_LEVEL], dtype=object)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            shares = table / table.sum(axis=1, keepdims=True)
+        block = {} if year is None else {year: np.repeat(years, sizes[j])}
+        block.update({"dimension": dim, "level": np.tile(labels, len(years)),
+                      "count": table.ravel(), "share": shares.ravel()})
+        blocks.append(pd.DataFrame(block))
+    return pd.concat(blocks, ignore_index=True)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+GSS partitioned export
+Respondent-level dashboard tables as a Parquet dataset partitioned by YEAR.
+
+    dashboard_z_measures/YEAR=1972/part-0.parquet
+    dashboard_z_measures/YEAR=1973/part-0.parquet
+    ...
+
+Each file stores its columns separately, compressed, with min/max statistics
+per row group, and the categorical dimensions (party, region, ...) as
+dictionary-encoded columns. A reader that asks for a few years and a few
+columns only opens those years' files and only reads those columns' pages;
+filters on other columns are checked against the statistics before any page
+is decoded. e.g. conf_z by party for 2010-2022:
+    read_partitioned(path, columns=["YEAR", "party", "conf_z"], years=(2010, 2022))
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PARTITION = "YEAR"
+
+
+def _partitioning(partition=PARTITION):
+    return ds.partitioning(pa.schema([(partition, pa.int32())]), flavor="hive")
+
+
+def _partition_table(frame, partition):
+    """ Arrow table of `frame` with an int32 partition column; missing partition values are refused. """
+    values = np.asarray(frame[partition], dtype=float)
+    if np.isnan(values).any():
+        raise ValueError(f"{np.isnan(values).sum()} rows have no {partition}; "
+                         "they would not belong to any partition")
+    frame = frame.copy()
+    frame[partition] = values.astype(np.int32)
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+def write_partitioned(frame, path, partition=PARTITION, compression="zstd", row_group_size=65536):
+    """ Write `frame` as a dataset with one directory per value of `partition`.
+
+    The dataset is written next to `path`. The old export is then renamed aside,
+    the new one renamed into place, and only then is the old one deleted. A
+    crash therefore leaves either export on disk (the old one as path + ".old"),
+    and years dropped from the table disappear. Readers opening the dataset
+    during the two renames may briefly find no directory at `path`.
+    """
+    table = _partition_table(frame, partition)
+
+    tmp, old = path + ".tmp", path + ".old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    ds.write_dataset(table, tmp, format="parquet", partitioning=_partitioning(partition),
+                     basename_template="part-{i}.parquet", max_rows_per_group=row_group_size,
+                     file_options=ds.ParquetFileFormat().make_write_options(compression=compression))
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return path
+
+
+def append_partitions(frame, path, partition=PARTITION, compression="zstd"):
+    """ Write the partitions of `frame` into an existing dataset, replacing those years. """
+    table = _partition_table(frame, partition)
+    ds.write_dataset(table, path, format="parquet", partitioning=_partitioning(partition),
+                     basename_template="part-{i}.parquet", existing_data_behavior="delete_matching",
+                     file_options=ds.ParquetFileFormat().make_write_options(compression=compression))
+    return path
+
+
+def partitioned_dataset(path, partition=PARTITION):
+    return ds.dataset(path, format="parquet", partitioning=_partitioning(partition))
+
+
+def _filter(partition, years, where):
+    expr = None
+    if years is not None:
+        first, last = years
+        expr = (ds.field(partition) >= first) & (ds.field(partition) <= last)
+    for col, values in (where or {}).items():
+        cond = ds.field(col).isin(list(values))
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def read_partitioned(path, columns=None, years=None, where=None, partition=PARTITION):
+    """ Load part of a partitioned export.
+
+    columns: columns to read (default: all)
+    years:   (first, last) inclusive; only those partitions are opened
+    where:   {column: allowed values}, e.g. {"party": ["Strong Democrat"]}
+    """
+    dataset = partitioned_dataset(path, partition)
+    table = dataset.to_table(columns=columns, filter=_filter(partition, years, where))
+    return table.to_pandas()
+
+
+def scan_bytes(path, columns=None, years=None, partition=PARTITION):
+    """ Compressed bytes of the column chunks a read of `columns` / `years` touches. """
+    dataset = partitioned_dataset(path, partition)
+    total = 0
+    for fragment in dataset.get_fragments(filter=_filter(partition, years, None)):
+        meta = pq.ParquetFile(fragment.path).metadata
+        for g in range(meta.num_row_groups):
+            group = meta.row_group(g)
+            for c in range(group.num_columns):
+                chunk = group.column(c)
+                if columns is None or chunk.path_in_schema in columns:
+                    total += chunk.total_compressed_size
+    return total
+
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+GSS factor-analysis grid
+Fits a grid of factor counts and rotations per battery and year from cached
+correlation matrices, and checks whether a loading structure holds across years.
+
+The correlation matrix of a battery is taken once per year (and pooled) from a
+CovarianceCache, so no fit touches respondent rows. Each (group, n_factors,
+rotation) cell is fitted with FactorAnalyzer(is_corr_matrix=True), optionally in
+a process pool; 1-factor fits are done once, as rotation leaves them unchanged.
+Per-year loadings are matched to the pooled solution's factors (best permutation
+and sign) and compared with Tucker's congruence coefficient:
+    phi(a, b) = sum(a * b) / sqrt(sum(a^2) * sum(b^2))
+phi >= .95 is usually read as the same factor, .85 - .94 as fair similarity.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from factor_analyzer import FactorAnalyzer
+
+ROTATIONS = ("varimax", "promax", "oblimin")
+UNROTATED = "none" # rotation label of the 1-factor fits, which no rotation changes
+POOLED = "pooled"
+
+
+def battery_correlations(cache, items):
+    """ {group: correlation matrix} of `items` for the pooled data and every cached group.
+
+    Groups where some item pair was never asked together are left out.
+    """
+    matrices = {POOLED: cache.corr(items).to_numpy()}
+    for group in cache.groups:
+        corr = cache.corr(items, group).to_numpy()
+        if not np.isnan(corr).any():
+            matrices[group] = corr
+    return matrices
+
+
+def fit_factors(corr, n_factors, rotation):
+    """ Loadings (items x factors) and original eigenvalues of one fit on a correlation matrix. """
+    fa = FactorAnalyzer(n_factors=n_factors, rotation=rotation if n_factors > 1 else None,
+                        is_corr_matrix=True)
+    fa.fit(corr)
+    eigenvalues, _ = fa.get_eigenvalues()
+    return fa.loadings_, eigenvalues
+
+
+def _fit_cell(group, corr, n_factors, rotation):
+    try:
+        loadings, eigenvalues = fit_factors(corr, n_factors, rotation)
+    except (np.linalg.LinAlgError, ValueError):
+        loadings, eigenvalues = None, None
+    return group, n_factors, rotation, loadings, eigenvalues
+
+
+def tucker_congruence(a, b):
+    """ Factor-by-factor congruence matrix between two loading matrices. """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    return (a.T @ b) / np.sqrt(np.outer((a ** 2).sum(axis=0), (b ** 2).sum(axis=0)))
+
+
+def align_loadings(loadings, reference):
+    """ Reorder and sign-flip the factors of `loadings` to best match `reference`.
+
+    Returns the aligned loadings and the congruence of each aligned factor.
+    """
+    phi = tucker_congruence(reference, loadings)
+    ref_idx, idx = linear_sum_assignment(-np.abs(phi))
+    signs = np.sign(phi[ref_idx, idx])
+    signs[signs == 0] = 1
+    aligned = loadings[:, idx] * signs
+    return aligned, np.abs(phi[ref_idx, idx])
+
+
+def _rotation(n_factors, rotation):
+    return UNROTATED if n_factors == 1 else rotation
+
+
+class FactorGrid:
+    """ Fits of one battery for every (group, n_factors, rotation). """
+
+    def __init__(self, items, fits):
+        self.items = list(items)
+        self.fits = fits # {(group, n_factors, rotation): (loadings, eigenvalues)}
+
+    @classmethod
+    def fit(cls, cache, items, n_factors=(1, 2, 3), rotations=ROTATIONS, processes=1):
+        """ Fit the grid from `cache`.
+
+        processes: worker processes (1, the default: fit in this process; None: one
+        per core). Use processes > 1 only behind an `if __name__ == "__main__":`
+        guard, as spawned workers re-import the calling script.
+        """
+        items = list(items)
+        matrices = battery_correlations(cache, items)
+        cells = [(group, corr, n, rotation)
+                 for group, corr in matrices.items()
+                 for n in n_factors if n <= len(items)
+                 for rotation in (rotations if n > 1 else [UNROTATED])]
+
+        processes = processes or os.cpu_count() or 1
+        if processes == 1:
+            results = [_fit_cell(*cell) for cell in cells]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_fit_cell, *zip(*cells), chunksize=8))
+
+        fits = {(group, n, rotation): (loadings, eigenvalues)
+                for group, n, rotation, loadings, eigenvalues in results if loadings is not None}
+        return cls(items, fits)
+
+    def loadings(self, n_factors, rotation, group=POOLED):
+        loadings = self.fits[(group, n_factors, _rotation(n_factors, rotation))][0]
+        return pd.DataFrame(loadings, index=self.items,
+                            columns=[f"factor{j + 1}" for j in range(loadings.shape[1])])
+
+    def eigenvalues(self, group=POOLED):
+        """ Original eigenvalues of the group's correlation matrix. """
+        for (g, _, _), (_, eigenvalues) in self.fits.items():
+            if g == group:
+                return pd.Series(eigenvalues, name="eigenvalue")
+        raise KeyError(group)
+
+    def congruence(self, n_factors, rotation):
+        """ Per-group congruence of each factor with the pooled solution.
+
+        Returns a DataFrame indexed by group with one column per pooled factor and
+        the minimum over factors.
+        """
+        rotation = _rotation(n_factors, rotation)
+        reference = self.fits[(POOLED, n_factors, rotation)][0]
+        rows = {}
+        for (group, n, rot), (loadings, _) in self.fits.items():
+            if group == POOLED or n != n_factors or rot != rotation:
+                continue
+            rows[group] = align_loadings(loadings, reference)[1]
+        table = pd.DataFrame.from_dict(rows, orient="index",
+                                       columns=[f"factor{j + 1}" for j in range(n_factors)])
+        table["min"] = table.min(axis=1)
+        return table.sort_index()
+
+    def summary(self):
+        """ Mean and minimum per-group congruence for every (n_factors, rotation). """
+        rows = []
+        for n, rotation in sorted({(n, rot) for _, n, rot in self.fits}):
+            if (POOLED, n, rotation) not in self.fits:
+                continue
+            table = self.congruence(n, rotation)
+            rows.append([n, rotation, len(table), table["min"].mean(), table["min"].min()])
+        return pd.DataFrame(rows, columns=["n_factors", "rotation", "n_groups",
+                                           "mean_congruence", "min_congruence"])
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+GSS geography dimension
+Region -> state mapping for state-level map views, as dimension tables.
+
+GSS only records the census division (REGION 1-9). A state map therefore colours
+each state with its division's value: rather than repeating every division row
+for each of its states, the facts stay keyed by the region code and the map
+joins them to a small state dimension,
+    region facts (YEAR, region_code, measure, ...)  ->  dim_state (state, region_code)
+so a map view stores no more than a region view.
+
+data/region_to_state.csv lost its line breaks: the header and every
+"region,state" row are run together into one line, so each field between commas
+is the previous row's state glued to the next row's region
+("MaineNew_England"). The known region names split them apart again.
+"""
+
+import pandas as pd
+
+
+def _split_glued(field, regions):
+    """ ("Maine", "New_England") from "MaineNew_England": the longest region name it ends with. """
+    for region in sorted(regions, key=len, reverse=True):
+        if field.endswith(region) and len(field) > len(region):
+            return field[:-len(region)], region
+    raise ValueError(f"'{field}' does not end with a known region name")
+
+
+def parse_region_states(text, regions):
+    """ (region, state) rows of region_to_state.csv, with or without its line breaks.
+
+    regions: the region names used in the file (e.g. the values of region_map).
+    """
+    lines = [line for line in text.strip().splitlines() if line.strip()]
+    if len(lines) > 1: # a well-formed file
+        rows = [tuple(field.strip() for field in line.split(",")) for line in lines[1:]]
+        return pd.DataFrame(rows, columns=["region", "state"])
+
+    fields = lines[0].split(",")
+    if fields[0] != "Region":
+        raise ValueError("region_to_state.csv should start with the header 'Region,State'")
+    glued = [_split_glued(field, regions) for field in fields[1:-1]] # (previous state, next region)
+    regions_in_order = [region for _, region in glued]
+    states = [state for state, _ in glued[1:]] + [fields[-1]] # glued[0] holds the header "State"
+    if glued[0][0] != "State":
+        raise ValueError("region_to_state.csv should start with the header 'Region,State'")
+    return pd.DataFrame({"region": regions_in_order, "state": states})
+
+
+def region_dimension(region_map, states=None):
+    """ dim_region: region_code, region (and the number of states, given the state table). """
+    dim = pd.DataFrame({"region_code": list(region_map), "region": list(region_map.values())})
+    if states is not None:
+        dim["n_states"] = dim["region_code"].map(states["region_code"].value_counts()).fillna(0).astype(int)
+    return dim
+
+
+def state_dimension(pairs, region_map):
+    """ dim_state: state (display name), state_key, region_code, one row per state. """
+    codes = {region: code for code, region in region_map.items()}
+    unknown = sorted(set(pairs["region"]) - set(codes))
+    if unknown:
+        raise ValueError(f"regions not in the region map: {unknown}")
+    return pd.DataFrame({"state": pairs["state"].str.replace("_", " "),
+                         "state_key": pairs["state"],
+                         "region_code": pairs["region"].map(codes).astype(int)})
+
+
+def region_facts(cube, region_map, dimension="region", year="YEAR"):
+    """ The cube's one-way region rows keyed by region code instead of the level label. """
+    codes = {region: code for code, region in region_map.items()}
+    rows = cube[(cube["dimension"] == dimension) & cube["dimension_2"].isna()]
+    facts = rows.drop(columns=["dimension", "level", "dimension_2", "level_2"])
+    facts.insert(1, "region_code", rows["level"].map(codes).astype(int))
+    return facts.reset_index(drop=True)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+GSS imputation
+Fills respondent-level missing values for the trend table.
+
+Year-mean fill: every column's yearly mean comes out of one bincount over
+(year code, column) pairs, years without any answers take the previous (then
+the next) year's mean along the year axis, and the means are broadcast back to
+the respondents by indexing the (years x columns) table with each row's year
+code. No per-domain groupby/merge/fillna round trips, so the respondent frame is
+copied once, not once per domain.
+
+Imputers (IMPUTERS, chosen by name with get_imputer()):
+    year_mean   the yearly mean of the item (the original Part 3a method)
+    hot_deck    a random donor answer from the same year x demographic cell
+                (falling back to the same year, then to the year mean)
+    chained     chained-equations regression imputation with year intercepts
+                and a posterior draw of the coefficients and noise ("norm" in
+                mice); multiple() runs M independent chains in a process pool
+                and pools the yearly means with Rubin's rules
+Year-mean fill flattens the within-year variance of the items; the other two
+keep it.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+
+
+def year_codes(years):
+    """ Codes 0 .. n_years-1 of each row's year (sorted) and the distinct years. """
+    codes, uniques = pd.factorize(np.asarray(years), sort=True)
+    return codes, np.asarray(uniques)
+
+
+def grouped_means(values, codes, n_groups):
+    """ (groups x columns) means of the non-missing values of each column. """
+    n_rows, k = values.shape
+    present = ~np.isnan(values)
+    cell = (codes[:, None] * k + np.arange(k)).ravel()
+    sums = np.bincount(cell, weights=np.where(present, values, 0.0).ravel(), minlength=n_groups * k)
+    counts = np.bincount(cell, weights=present.ravel(), minlength=n_groups * k)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape(n_groups, k)
+
+
+def fill_along_years(means):
+    """ Fill years with no mean from the previous year, then the next (as ffill().bfill()). """
+    return pd.DataFrame(means).ffill().bfill().to_numpy()
+
+
+def impute_year_means(frame, variables, year="YEAR"):
+    """ Copy of `frame` with missing `variables` filled by their (filled) yearly means. """
+    variables = list(variables)
+    codes, years = year_codes(frame[year])
+    values = frame[variables].to_numpy(dtype=float)
+    means = fill_along_years(grouped_means(values, codes, len(years)))
+
+    out = frame.copy()
+    out[variables] = np.where(np.isnan(values), means[codes], values)
+    return out
+
+
+##############################################################################
+## Imputers
+##############################################################################
+
+class YearMeanImputer:
+    """ Missing values take the item's yearly mean. """
+
+    def impute(self, frame, variables, year="YEAR"):
+        return impute_year_means(frame, variables, year)
+
+
+def _draw_donors(values, keys, rng):
+    """ Fill each column's missing values with a random donor of the same key.
+
+    Donors of a column are its observed rows sorted by key, so a key's donors are
+    one contiguous run found by searchsorted. Rows whose key has no donor stay
+    missing. Returns the filled values.
+    """
+    out = values.copy()
+    for j in range(values.shape[1]):
+        present = ~np.isnan(values[:, j])
+        missing = np.flatnonzero(~present)
+        if not len(missing):
+            continue
+        donors = np.flatnonzero(present)
+        donors = donors[np.argsort(keys[donors], kind="stable")]
+        donor_keys = keys[donors]
+        start = np.searchsorted(donor_keys, keys[missing], side="left")
+        count = np.searchsorted(donor_keys, keys[missing], side="right") - start
+        has_donor = count > 0
+        pick = start[has_donor] + (rng.random(has_donor.sum()) * count[has_donor]).astype(int)
+        out[missing[has_donor], j] = values[donors[pick], j]
+    return out
+
+
+class HotDeckImputer:
+    """ Missing values take a random donor's answer from the same year x cell.
+
+    cells: categorical columns defining the demographic cells (a missing cell
+    value is a cell of its own). Cells without a donor fall back to a donor from
+    the same year, then to the year mean.
+    """
+
+    def __init__(self, cells=("gender", "age_group", "degree"), seed=0):
+        self.cells = list(cells)
+        self.seed = seed
+
+    def impute(self, frame, variables, year="YEAR"):
+        variables = list(variables)
+        rng = np.random.default_rng(self.seed)
+        codes, years = year_codes(frame[year])
+        cell_keys = frame.groupby([year] + self.cells, observed=True, dropna=False,
+                                  sort=True).ngroup().to_numpy()
+        values = frame[variables].to_numpy(dtype=float)
+
+        filled = _draw_donors(values, cell_keys, rng)
+        filled = _draw_donors(filled, codes, rng)
+        means = fill_along_years(grouped_means(values, codes, len(years)))
+        filled = np.where(np.isnan(filled), means[codes], filled)
+
+        out = frame.copy()
+        out[variables] = filled
+        return out
+
+
+def _chain(values, codes, n_years, iterations, seed):
+    """ One chained-equations chain; returns the completed (rows x columns) values.
+
+    Each item is regressed on all the other items with year intercepts. The
+    intercepts come from within-year centering (equivalent to year dummies), so
+    the rows are sorted by year once and kept as a (columns x rows) array: every
+    yearly sum is then a reduceat over contiguous slices. Each item's normal
+    equations are sliced from the cross-product matrix of all centered columns.
+    """
+    rng = np.random.default_rng(seed)
+    order = np.argsort(codes, kind="stable")
+    values, codes = values[order], codes[order]
+    starts = np.searchsorted(codes, np.arange(n_years))
+    missing = np.isnan(values)
+    low, high = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+
+    means = fill_along_years(grouped_means(values, codes, n_years))
+    current = np.ascontiguousarray(np.where(missing, means[codes], values).T) # start from the year-mean fill
+    missing = np.ascontiguousarray(missing.T)
+
+    for _ in range(iterations):
+        for j in np.flatnonzero(missing.any(axis=1)):
+            observed = ~missing[j]
+            others = np.flatnonzero(np.arange(len(current)) != j)
+
+            # yearly means of every column over the rows where item j is observed
+            with np.errstate(invalid="ignore", divide="ignore"):
+                year_means = np.add.reduceat(current * observed, starts, axis=1) \
+                    / np.add.reduceat(observed, starts)
+            year_means = fill_along_years(year_means.T).T # (columns x years)
+            rows = np.flatnonzero(observed)
+            centered = current[:, rows] - year_means[:, codes[rows]]
+            cross = centered @ centered.T
+
+            # posterior draw of the residual variance and coefficients ("norm" method)
+            xtx_inv = np.linalg.inv(cross[np.ix_(others, others)] + 1e-5 * np.eye(len(others)))
+            xty = cross[others, j]
+            beta = xtx_inv @ xty
+            df = max(len(rows) - len(others), 1)
+            rss = max(cross[j, j] - xty @ beta, 0.0)
+            sigma = np.sqrt(rss / chi2.rvs(df, random_state=rng))
+            beta_draw = beta + sigma * np.linalg.cholesky(xtx_inv) @ rng.standard_normal(len(beta))
+
+            # intercept of each year (years where the item was never asked borrow
+            # the previous, then next, year's means, as the year-mean fill does)
+            intercept = year_means[j] - beta_draw @ year_means[others]
+            rows = np.flatnonzero(~observed)
+            draws = intercept[codes[rows]] + beta_draw @ current[np.ix_(others, rows)] \
+                + sigma * rng.standard_normal(len(rows))
+            current[j, rows] = np.clip(draws, low[j], high[j]) # stay on the item's scale
+
+    completed = np.empty_like(values)
+    completed[order] = current.T
+    return completed
+
+
+def _chain_estimates(values, codes, n_years, iterations, seed):
+    """ Yearly means of one chain's completed data and their within-year variances. """
+    completed = _chain(values, codes, n_years, iterations, seed)
+    counts = np.bincount(codes, minlength=n_years)[:, None]
+    means = grouped_means(completed, codes, n_years)
+    squares = grouped_means(completed ** 2, codes, n_years)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = (squares - means ** 2) * counts / (counts - 1)
+        return means, variance / counts
+
+
+def rubin_pool(estimates, variances):
+    """ Rubin's rules over the first axis (imputations).
+
+    Returns the pooled estimate, its total standard error, the degrees of
+    freedom and the fraction of missing information.
+    """
+    estimates, variances = np.asarray(estimates), np.asarray(variances)
+    m = len(estimates)
+    q_bar = estimates.mean(axis=0)
+    within = variances.mean(axis=0)
+    between = estimates.var(axis=0, ddof=1)
+    total = within + (1 + 1 / m) * between
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = (1 + 1 / m) * between / within
+        df = (m - 1) * (1 + 1 / r) ** 2
+        fmi = (r + 2 / (df + 3)) / (r + 1)
+    return q_bar, np.sqrt(total), df, fmi
+
+
+class ChainedEquationsImputer:
+    """ Chained-equations (MICE "norm") imputation with year intercepts.
+
+    m:          number of imputations (independent chains) for multiple()
+    iterations: passes over the items per chain
+    processes:  chains run in parallel (1, the default: in this process; None: one
+                per core; > 1 only behind an `if __name__ == "__main__":` guard,
+                as spawned workers re-import the calling script)
+    """
+
+    def __init__(self, m=20, iterations=5, seed=0, processes=1):
+        self.m = m
+        self.iterations = iterations
+        self.seed = seed
+        self.processes = processes
+
+    def _seeds(self):
+        return np.random.SeedSequence(self.seed).spawn(self.m)
+
+    def impute(self, frame, variables, year="YEAR"):
+        """ One completed dataset (the first chain). """
+        variables = list(variables)
+        codes, years = year_codes(frame[year])
+        values = frame[variables].to_numpy(dtype=float)
+        out = frame.copy()
+        out[variables] = _chain(values, codes, len(years), self.iterations, self._seeds()[0])
+        return out
+
+    def multiple(self, frame, variables, year="YEAR"):
+        """ Yearly means of every item pooled over m chains with Rubin's rules.
+
+        Returns a long DataFrame: year, variable, mean, se, df, fmi.
+        """
+        variables = list(variables)
+        codes, years = year_codes(frame[year])
+        values = frame[variables].to_numpy(dtype=float)
+        args = [(values, codes, len(years), self.iterations, seed) for seed in self._seeds()]
+
+        processes = self.processes or os.cpu_count() or 1
+        if processes == 1:
+            results = [_chain_estimates(*a) for a in args]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_chain_estimates, *zip(*args)))
+
+        mean, se, df, fmi = rubin_pool([r[0] for r in results], [r[1] for r in results])
+        grid = pd.MultiIndex.from_product([years, variables], names=[year, "variable"])
+        return pd.DataFrame({"mean": mean.ravel(), "se": se.ravel(), "df": df.ravel(),
+                             "fmi": fmi.ravel()}, index=grid).reset_index()
+
+
+IMPUTERS = {"year_mean": YearMeanImputer, "hot_deck": HotDeckImputer,
+            "chained": ChainedEquationsImputer}
+
+
+def get_imputer(name, **args):
+    if name not in IMPUTERS:
+        raise ValueError(f"unknown imputer '{name}' (use one of {sorted(IMPUTERS)})")
+    return IMPUTERS[name](**args)
@@ -3,14 +3,30 @@ import os
 import pyreadstat
 import pandas as pd
 import numpy as np
-import pingouin as pg
-from factor_analyzer import FactorAnalyzer
 import matplotlib.pyplot as plt
 
+from gss_dashboard_cache import CACHE_DIR, load_stage
+from gss_dashboard_indexes import threshold_sweep
+from gss_dashboard_reliability import CovarianceCache, subset_search
+from gss_dashboard_factors import FactorGrid
+from gss_dashboard_polychoric import PolychoricCache
+
 os.chdir("C:/Dat_Sci/Data Projects/GSS/dashboard project")
 
 ## Short save ############################################
-indexes = pd.read_csv("dashboard_raw.csv")
+# load only the item columns analysed here from the typed stage artifact
+item_columns = ["coneduc", "confed", "conmedic", "conarmy", "conbus",
+                "conclerg", "confinan", "conjudge", "conlabor", "conlegis",
+                "conpress", "consci", "contv", "attend", "pray", "reliten", 
+                "god", "bible", "happy", "life", "haprelate", "trust", 
+                "helpful", "fair", "socrel", "socfrend", "socommun", "socbar"]
+indexes = load_stage("dashboard_raw", columns = ["YEAR"] + item_columns)
+
+# pairwise covariance statistics of every item, per year, in one pass;
+# all alphas below (pooled, per year, subscales) are computed from these
+item_stats = CovarianceCache.from_frame(indexes, item_columns, by = "YEAR")
+# saved for the dashboard's --append mode, which adds each new wave's year to it
+item_stats.save(os.path.join(CACHE_DIR, "item_covariance.npz"))
 
 """ 
 For index measures, perform:
@@ -31,33 +47,44 @@ confidence_vars = ["coneduc", "confed", "conmedic", "conarmy", "conbus",
 # A. Reliability 
 ################
 # First, Alpha analysis shows inter-item reliability 
-confidence_columns = indexes[confidence_vars].copy()
-
-reliability = pg.cronbach_alpha(data = confidence_columns)
+reliability = item_stats.alpha(confidence_vars)
 print(reliability) # Alpha = .79
 
-years = indexes["YEAR"].unique()
-for year in sorted(years):
-    inst_conf_year = indexes[indexes["YEAR"] == year][confidence_vars]
-    alpha, ci = pg.cronbach_alpha(data = inst_conf_year)
-    print(year, alpha, ci)
+# alpha and CI by year, and alpha if each item is dropped
+print(item_stats.alpha_table(confidence_vars))
+print(item_stats.alpha_if_deleted(confidence_vars))
 
 
 # B. Factor Analysis 
 ####################
-fa = FactorAnalyzer(n_factors=3, rotation="varimax")  # Adjust n_factors as needed
-fa.fit(confidence_columns)
+# grid of factor counts x rotations, pooled and per year, from cached correlations
+fa = FactorGrid.fit(item_stats, confidence_vars, n_factors = (1, 2, 3, 4))
 
 # Get eigenvalues to determine the optimal number of factors
-ev, v = fa.get_eigenvalues()
+ev = fa.eigenvalues()
 print("Eigenvalues:", ev)
 # eigenvalues > 1 indicate a useful factor. In this case there are 3 strong factors
 
 # Print factor loadings
-loadings = fa.loadings_
+loadings = fa.loadings(3, "varimax")
 print("Factor Loadings:\n", loadings)
 # factor loadings > .4 indicate a useful inclusion
 
+# does the structure hold across years? congruence of each year's loadings with
+# the pooled solution, for every factor count and rotation
+print(fa.summary())
+print(fa.congruence(3, "varimax"))
+
+# the items are ordinal (1-3): repeat with polychoric correlations, per year and
+# pooled (years with unchanged tables are reused from the saved estimates)
+conf_poly = PolychoricCache.cached(indexes, confidence_vars,
+                                   os.path.join(CACHE_DIR, "polychoric_confidence.npz"))
+print(conf_poly.alpha(confidence_vars)) # ordinal alpha
+print(conf_poly.alpha_table(confidence_vars))
+fa_ordinal = FactorGrid.fit(conf_poly, confidence_vars, n_factors = (1, 2, 3, 4))
+print("Factor Loadings (polychoric):\n", fa_ordinal.loadings(3, "varimax"))
+print(fa_ordinal.summary())
+
 # next step: separate and name three domains 
 factor1 = ["conmedic", "conarmy", "conbus", "confinan", "conjudge"]
 factor2 = ["confed", "conlegis"]
@@ -68,17 +95,18 @@ indexes["government_conf"] = indexes[factor2].mean(axis = 1)
 indexes["media_conf"] = indexes[factor3].mean(axis = 1)
 
 # reliability analysis on three sub-scales
-gen_cols = indexes[factor1].copy()
-gov_cols = indexes[factor2].copy()
-media_cols = indexes[factor3].copy()
-
-reliability_1 = pg.cronbach_alpha(data = gen_cols)
+reliability_1 = item_stats.alpha(factor1)
 print(reliability_1) # 0.64 - Use Whole (13 measure scale)
-reliability_2 = pg.cronbach_alpha(data = gov_cols)
+reliability_2 = item_stats.alpha(factor2)
 print(reliability_2) # 0.62
-reliability_3 = pg.cronbach_alpha(data = media_cols)
+reliability_3 = item_stats.alpha(factor3)
 print(reliability_3) # 0.56
 
+# every subset of 2+ items scored on alpha, mean inter-item r and per-year
+# stability; the Pareto-best subsets are candidates for the sub-scales above
+conf_subsets = subset_search(item_stats, confidence_vars, min_size = 2)
+print(conf_subsets[conf_subsets["pareto"]])
+
 conf_vars.extend(["conf_index", "gen_inst_conf", "government_conf", "media_conf"])
 
 dash_institutions = dash.groupby("YEAR")[conf_vars].mean().reset_index()
@@ -88,26 +116,10 @@ dash_institutions = dash.groupby("YEAR")[conf_vars].mean().reset_index()
 # Count confidenc variables for each R to limit missing cases. 
 indexes["num_conf_vars"] = indexes[confidence_vars].notna().sum(axis=1)
 
-### num_conf_vars sensitivity test
-thresholds = [6, 8, 10, 11, 12]
-results = {}
-
-for threshold in thresholds:
-    # Create a copy of the dataset to avoid modifying the original
-    temp_df = indexes.copy()
-    
-    # Recalculate the confidence index based on the threshold
-    temp_df["conf_index"] = temp_df[confidence_vars].mean(axis=1, skipna=True)
-    temp_df.loc[temp_df["num_conf_vars"] < threshold, "conf_index"] = np.nan
-    
-    # Summarize the results
-    results[threshold] = temp_df["conf_index"].describe()
-
-# Display the summaries for each threshold
-for threshold, summary in results.items():
-    print(f"Threshold: {threshold}")
-    print(summary)
-    print("\n" + "="*50 + "\n")
+### Sensitivity test: confidence index summaries for every minimum number of items
+# (row mean and valid count computed once, summarised for k = 1 .. n_items)
+results = threshold_sweep(indexes, confidence_vars)
+print(results)
     
 # Use minimum 8 variables
 indexes["conf_index"] = indexes[confidence_vars].mean(axis=1, skipna=True)
@@ -119,48 +131,35 @@ indexes.loc[indexes["num_conf_vars"] < 8, "conf_index"] = np.nan
 relig_vars = ["attend", "pray", "reliten", "god", "bible"]
 
 # A. Reliability 
-relig_columns = indexes[relig_vars].copy()
-
-reliability = pg.cronbach_alpha(data = relig_columns)
+reliability = item_stats.alpha(relig_vars)
 print(reliability) # Alpha = .78
 
 # B. Factor Analysis
-fa = FactorAnalyzer(n_factors=3, rotation="varimax")  # Adjust n_factors as needed
-fa.fit(relig_columns)
+# grid of factor counts x rotations, pooled and per year, from cached correlations
+fa = FactorGrid.fit(item_stats, relig_vars, n_factors = (1, 2, 3))
 
 # Get eigenvalues to determine the optimal number of factors
-ev, v = fa.get_eigenvalues()
+ev = fa.eigenvalues()
 print("Eigenvalues:", ev)
 # eigenvalues > 1 indicate a useful factor. In this case there are 3 strong factors
 
 # Print factor loadings
-loadings = fa.loadings_
+loadings = fa.loadings(3, "varimax")
 print("Factor Loadings:\n", loadings)
 # factor loadings > .4 indicate a useful inclusion
 
+# does the structure hold across years? congruence of each year's loadings with
+# the pooled solution, for every factor count and rotation
+print(fa.summary())
+print(fa.congruence(3, "varimax"))
+
 # C. Sensitivity
 indexes["num_relig_vars"] = indexes[relig_vars].notna().sum(axis=1)
 
-### num_conf_vars sensitivity test
-thresholds = [2, 3, 4, 5]
-results = {}
-
-for threshold in thresholds:
-    # Create a copy of the dataset to avoid modifying the original
-    temp_df = indexes.copy()
-    
-    # Recalculate the confidence index based on the threshold
-    temp_df["religiosity"] = temp_df[relig_vars].mean(axis=1, skipna=True)
-    temp_df.loc[temp_df["num_relig_vars"] < threshold, "religiosity"] = np.nan
-    
-    # Summarize the results
-    results[threshold] = temp_df["religiosity"].describe()
-
-# Display the summaries for each threshold
-for threshold, summary in results.items():
-    print(f"Threshold: {threshold}")
-    print(summary)
-    print("\n" + "="*50 + "\n")
+### Sensitivity test: religiosity index summaries for every minimum number of items
+# (row mean and valid count computed once, summarised for k = 1 .. n_items)
+results = threshold_sweep(indexes, relig_vars)
+print(results)
     
 # Use minimum 2 variables
 # indexes["religiosity"] = indexes[relig_vars].mean(axis=1, skipna=True)
@@ -172,48 +171,35 @@ for threshold, summary in results.items():
 happy_vars = ["happy", "life", "haprelate"]
 
 # A. Reliability 
-happy_columns = indexes[happy_vars].copy()
-
-reliability = pg.cronbach_alpha(data = happy_columns)
+reliability = item_stats.alpha(happy_vars)
 print(reliability) # Alpha = .60
 
 # B. Factor Analysis
-fa = FactorAnalyzer(n_factors=2, rotation="varimax")  # Adjust n_factors as needed
-fa.fit(happy_columns)
+# grid of factor counts x rotations, pooled and per year, from cached correlations
+fa = FactorGrid.fit(item_stats, happy_vars, n_factors = (1, 2))
 
 # Get eigenvalues to determine the optimal number of factors
-ev, v = fa.get_eigenvalues()
+ev = fa.eigenvalues()
 print("Eigenvalues:", ev)
 # eigenvalues > 1 indicate a useful factor. In this case there are 3 strong factors
 
 # Print factor loadings
-loadings = fa.loadings_
+loadings = fa.loadings(2, "varimax")
 print("Factor Loadings:\n", loadings)
 # factor loadings > .4 indicate a useful inclusion
 
+# does the structure hold across years? congruence of each year's loadings with
+# the pooled solution, for every factor count and rotation
+print(fa.summary())
+print(fa.congruence(2, "varimax"))
+
 # C. Sensitivity
 indexes["num_happy_vars"] = indexes[happy_vars].notna().sum(axis=1)
 
-### num_conf_vars sensitivity test
-thresholds = [2, 3]
-results = {}
-
-for threshold in thresholds:
-    # Create a copy of the dataset to avoid modifying the original
-    temp_df = indexes.copy()
-    
-    # Recalculate the confidence index based on the threshold
-    temp_df["happiness"] = temp_df[happy_vars].mean(axis=1, skipna=True)
-    temp_df.loc[temp_df["num_happy_vars"] < threshold, "happiness"] = np.nan
-    
-    # Summarize the results
-    results[threshold] = temp_df["happiness"].describe()
-
-# Display the summaries for each threshold
-for threshold, summary in results.items():
-    print(f"Threshold: {threshold}")
-    print(summary)
-    print("\n" + "="*50 + "\n")
+### Sensitivity test: happiness index summaries for every minimum number of items
+# (row mean and valid count computed once, summarised for k = 1 .. n_items)
+results = threshold_sweep(indexes, happy_vars)
+print(results)
     
 # Use minimum 2 variables
 # indexes["happiness"] = indexes[happy_vars].mean(axis=1, skipna=True)
@@ -224,48 +210,35 @@ for threshold, summary in results.items():
 social_attitude_vars = ["trust", "helpful", "fair"]
 
 # A. Reliability 
-social_attitude_columns = indexes[social_attitude_vars].copy()
-
-reliability = pg.cronbach_alpha(data = social_attitude_columns)
+reliability = item_stats.alpha(social_attitude_vars)
 print(reliability) # Alpha = .67
 
 # B. Factor Analysis
-fa = FactorAnalyzer(n_factors=3, rotation="varimax")  # Adjust n_factors as needed
-fa.fit(social_attitude_columns)
+# grid of factor counts x rotations, pooled and per year, from cached correlations
+fa = FactorGrid.fit(item_stats, social_attitude_vars, n_factors = (1, 2, 3))
 
 # Get eigenvalues to determine the optimal number of factors
-ev, v = fa.get_eigenvalues()
+ev = fa.eigenvalues()
 print("Eigenvalues:", ev)
 # eigenvalues > 1 indicate a useful factor. In this case there are 3 strong factors
 
 # Print factor loadings
-loadings = fa.loadings_
+loadings = fa.loadings(3, "varimax")
 print("Factor Loadings:\n", loadings)
 # factor loadings > .4 indicate a useful inclusion
 
+# does the structure hold across years? congruence of each year's loadings with
+# the pooled solution, for every factor count and rotation
+print(fa.summary())
+print(fa.congruence(3, "varimax"))
+
 # C. Sensitivity
 indexes["num_soc_att_vars"] = indexes[social_attitude_vars].notna().sum(axis=1)
 
-### num_conf_vars sensitivity test
-thresholds = [2, 3]
-results = {}
-
-for threshold in thresholds:
-    # Create a copy of the dataset to avoid modifying the original
-    temp_df = indexes.copy()
-    
-    # Recalculate the confidence index based on the threshold
-    temp_df["social_attitudes"] = temp_df[social_attitude_vars].mean(axis=1, skipna=True)
-    temp_df.loc[temp_df["num_soc_att_vars"] < threshold, "social_attitudes"] = np.nan
-    
-    # Summarize the results
-    results[threshold] = temp_df["social_attitudes"].describe()
-
-# Display the summaries for each threshold
-for threshold, summary in results.items():
-    print(f"Threshold: {threshold}")
-    print(summary)
-    print("\n" + "="*50 + "\n")
+### Sensitivity test: social attitudes index summaries for every minimum number of items
+# (row mean and valid count computed once, summarised for k = 1 .. n_items)
+results = threshold_sweep(indexes, social_attitude_vars)
+print(results)
     
 # Use minimum 2 variables
 # indexes["social_attitudes"] = indexes[social_attitude_vars].mean(axis=1, skipna=True)
@@ -277,26 +250,29 @@ for threshold, summary in results.items():
 # First, Alpha analysis shows inter-item reliability 
 soc_vars = ["socrel", "socfrend", "socommun", "socbar"]
 
-social_columns = indexes[soc_vars].copy()
-
-reliability = pg.cronbach_alpha(data = social_columns)
+reliability = item_stats.alpha(soc_vars)
 print(reliability) # Alpha = .44
 
 
 ##### Factor Analysis #####
-fa = FactorAnalyzer(n_factors=2, rotation="varimax")  # Adjust n_factors as needed
-fa.fit(social_columns)
+# grid of factor counts x rotations, pooled and per year, from cached correlations
+fa = FactorGrid.fit(item_stats, soc_vars, n_factors = (1, 2, 3))
 
 # Get eigenvalues to determine the optimal number of factors
-ev, v = fa.get_eigenvalues()
+ev = fa.eigenvalues()
 print("Eigenvalues:", ev)
 # eigenvalues > 1 indicate a useful factor.
 
 # Print factor loadings
-loadings = fa.loadings_
+loadings = fa.loadings(2, "varimax")
 print("Factor Loadings:\n", loadings)
 # factor loadings > .4 indicate a useful inclusion
 
+# does the structure hold across years? congruence of each year's loadings with
+# the pooled solution, for every factor count and rotation
+print(fa.summary())
+print(fa.congruence(2, "varimax"))
+
 # next step: separate and name two domains 
 factor1 = ["socbar", "socfrend"] # nightlife (out?)
 factor2 = ["socrel", "socfrend"] # friends and family (in)?
@@ -305,37 +281,21 @@ indexes["soc_out"] = indexes[factor1].mean(axis = 1)
 indexes["soc_in"] = indexes[factor2].mean(axis = 1)
 
 # Alpha analysis on three sub-scales
-soc_out_cols = indexes[factor1].copy()
-soc_in_cols = indexes[factor2].copy()
-
-reliability_1 = pg.cronbach_alpha(data = soc_out_cols)
+reliability_1 = item_stats.alpha(factor1)
 print(reliability_1)
-reliability_2 = pg.cronbach_alpha(data = soc_in_cols)
+reliability_2 = item_stats.alpha(factor2)
 print(reliability_2)
 
+soc_subsets = subset_search(item_stats, soc_vars, min_size = 2)
+print(soc_subsets[soc_subsets["pareto"]])
+
 #### Sensitivity 
 indexes["num_soc_vars"] = indexes[soc_vars].notna().sum(axis=1)
 
-### num_conf_vars sensitivity test
-thresholds = [2, 3, 4]
-results = {}
-
-for threshold in thresholds:
-    # Create a copy of the dataset to avoid modifying the original
-    temp_df = indexes.copy()
-    
-    # Recalculate the confidence index based on the threshold
-    temp_df["social"] = temp_df[soc_vars].mean(axis=1, skipna=True)
-    temp_df.loc[temp_df["num_soc_vars"] < threshold, "social"] = np.nan
-    
-    # Summarize the results
-    results[threshold] = temp_df["social"].describe()
-
-# Display the summaries for each threshold
-for threshold, summary in results.items():
-    print(f"Threshold: {threshold}")
-    print(summary)
-    print("\n" + "="*50 + "\n") ### miniscule differences. 
+### Sensitivity test: social relationships index summaries for every minimum number of items
+# (row mean and valid count computed once, summarised for k = 1 .. n_items)
+results = threshold_sweep(indexes, soc_vars)
+print(results) ### miniscule differences. 
 
  
 
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+GSS index kernel
+Builds every composite index from one contiguous item matrix in a batched pass.
+
+Each index in the codesheet follows the same recipe: a row mean (or sum) of its
+items, a count of the items present, and NaN where fewer than k items are present.
+Here the item matrix X and its presence mask M are built once, the index
+definitions become an item-by-index indicator matrix W, and all row sums and
+counts come out of single matrix products (X0 @ W and M @ W), instead of each
+index materializing its own boolean frame.
+
+Methods:
+    mean    mean of the items present
+    sum     sum of the items present (social attitudes)
+    zmean   standardize each item (sample sd), then mean (religiosity, qol);
+            with a fitted StandardizationRegistry, its means/sds are used instead
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+METHODS = ("mean", "sum", "zmean")
+
+
+class IndexSpec(NamedTuple):
+    name: str
+    items: list
+    min_valid: int
+    method: str = "mean"
+    count_items: list = None # items counted for min_valid (default: items)
+
+
+class ItemMatrix:
+    """ Items as one float matrix with its presence mask, built once. """
+
+    def __init__(self, frame, items):
+        self.items = list(dict.fromkeys(items))
+        self.position = {item: i for i, item in enumerate(self.items)}
+        self.values = np.column_stack([np.asarray(frame[item], dtype=float) for item in self.items]) \
+            if self.items else np.empty((len(frame), 0))
+        self.present = ~np.isnan(self.values)
+        self.filled = np.where(self.present, self.values, 0.0)
+
+    def standardized(self, moments=None):
+        """ Item z-scores (sample sd), 0 where missing.
+
+        moments: StandardizationRegistry with reference means/sds; items it holds
+        use those, the others are fitted on these rows.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            n = self.present.sum(axis=0)
+            mean = self.filled.sum(axis=0) / n
+            deviations = np.where(self.present, self.values - mean, 0.0)
+            sd = np.sqrt((deviations ** 2).sum(axis=0) / (n - 1))
+        for i, item in enumerate(self.items):
+            if moments is not None and item in moments:
+                mean[i], sd[i] = moments.params(item)
+        return np.where(self.present, (self.values - mean) / sd, 0.0)
+
+    def indicator(self, item_lists):
+        """ Item-by-index 0/1 matrix: column j selects the items of item_lists[j]. """
+        w = np.zeros((len(self.items), len(item_lists)))
+        for j, items in enumerate(item_lists):
+            w[[self.position[item] for item in items], j] = 1.0
+        return w
+
+
+def index_values(matrix, specs, moments=None):
+    """ (rows x indexes) array of the indexes in `specs` over an ItemMatrix. """
+    for spec in specs:
+        if spec.method not in METHODS:
+            raise ValueError(f"{spec.name}: unknown index method '{spec.method}' (use one of {METHODS})")
+
+    w_items = matrix.indicator([spec.items for spec in specs])
+    w_count = matrix.indicator([spec.count_items or spec.items for spec in specs])
+
+    raw = np.array([spec.method != "zmean" for spec in specs])
+    sums = np.empty((len(matrix.values), len(specs)))
+    if raw.any():
+        sums[:, raw] = matrix.filled @ w_items[:, raw]
+    if (~raw).any():
+        sums[:, ~raw] = matrix.standardized(moments) @ w_items[:, ~raw]
+
+    present = matrix.present.astype(float)
+    n_items = present @ w_items
+    n_valid = present @ w_count
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        is_sum = np.array([spec.method == "sum" for spec in specs])
+        values = np.where(is_sum, sums, sums / n_items)
+
+    min_valid = np.array([spec.min_valid for spec in specs])
+    values[n_valid < min_valid] = np.nan
+    return values
+
+
+def build_indexes(frame, specs, moments=None):
+    """ DataFrame of every index in `specs`, computed in one batched pass.
+
+    moments: reference item means/sds for the zmean indexes (see ItemMatrix.standardized).
+    """
+    specs = list(specs)
+    items = [item for spec in specs for item in list(spec.items) + list(spec.count_items or [])]
+    matrix = ItemMatrix(frame, items)
+    values = index_values(matrix, specs, moments)
+    return pd.DataFrame(values, columns=[spec.name for spec in specs], index=frame.index)
+
+
+##############################################################################
+## Threshold sensitivity
+##############################################################################
+
+DESCRIBE_QUANTILES = (0.25, 0.50, 0.75)
+
+
+def threshold_sweep(frame, items, thresholds=None, method="mean", quantiles=DESCRIBE_QUANTILES):
+    """ describe()-style summary of an index for every minimum-valid threshold.
+
+    The row index (mean or sum of the items present) and the valid-item count are
+    computed once. Rows meeting threshold k are the rows with count >= k, so the
+    subsets are nested: count/mean/std/min/max come from cumulative statistics
+    over the rows sorted by count, and the quantiles from one sort by value plus
+    cumulative ranks per threshold. Default thresholds: every k from 1 to len(items).
+
+    Returns a DataFrame indexed by threshold with the describe() columns.
+    """
+    items = list(items)
+    thresholds = list(range(1, len(items) + 1)) if thresholds is None else sorted(thresholds)
+
+    matrix = ItemMatrix(frame, items)
+    counts = matrix.present.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = matrix.filled.sum(axis=1)
+        if method == "mean":
+            values = values / counts
+        elif method != "sum":
+            raise ValueError(f"threshold_sweep supports 'mean' and 'sum', not '{method}'")
+
+    keep = counts > 0
+    values, counts = values[keep], counts[keep]
+
+    # count / mean / std / min / max: rows sorted by count (descending), cumulative stats
+    by_count = np.argsort(-counts, kind="stable")
+    v, c = values[by_count], counts[by_count]
+    shift = v.mean() if len(v) else 0.0 # shifted sums keep the variance numerically stable
+    cum_sum = np.cumsum(v - shift)
+    cum_sq = np.cumsum((v - shift) ** 2)
+    cum_min = np.minimum.accumulate(v)
+    cum_max = np.maximum.accumulate(v)
+    # number of rows with count >= k (a prefix length of the sorted rows)
+    prefix = np.searchsorted(-c, -np.asarray(thresholds), side="right")
+
+    # quantiles: one sort by value; cumulative rank of the rows with count >= k
+    by_value = np.argsort(values, kind="stable")
+    sorted_values, sorted_counts = values[by_value], counts[by_value]
+
+    rows = []
+    for k, n in zip(thresholds, prefix):
+        if n == 0:
+            rows.append([0] + [np.nan] * (4 + len(quantiles)))
+            continue
+        i = n - 1
+        mean = cum_sum[i] / n + shift
+        var = (cum_sq[i] - cum_sum[i] ** 2 / n) / (n - 1) if n > 1 else np.nan
+        std = np.sqrt(max(var, 0.0)) if n > 1 else np.nan
+
+        rank = np.cumsum(sorted_counts >= k)
+        qs = []
+        for q in quantiles:
+            pos = q * (n - 1) # linear interpolation, as pandas
+            lower = int(np.floor(pos))
+            upper = min(lower + 1, n - 1)
+            lo_val, hi_val = sorted_values[np.searchsorted(rank, [lower + 1, upper + 1])]
+            qs.append(lo_val + (pos - lower) * (hi_val - lo_val))
+        rows.append([n, mean, std, cum_min[i], *qs, cum_max[i]])
+    return _sweep_frame(rows, thresholds, quantiles)
+
+
+def _sweep_frame(rows, thresholds, quantiles):
+    columns = ["count", "mean", "std", "min"] + [f"{q:.0%}" for q in quantiles] + ["max"]
+    return pd.DataFrame(rows, columns=columns, index=pd.Index(thresholds, name="threshold"))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+GSS ingestion helpers
+Reads only the dashboard variables from the cumulative GSS SAS file.
+
+The cumulative file (gss7222_r3.sas7bdat) has ~72k rows and ~6,600 columns, but
+the dashboard only needs ~50 of them. Reading the whole file and then slicing
+costs minutes and several GB of RAM, so instead we:
+    1. read the file metadata only, to check the requested columns exist
+    2. stream the file in row chunks, parsing only the requested columns
+    3. (optionally) split the chunks across worker processes
+Peak memory then scales with the selected columns, not the full file.
+"""
+
+import pyreadstat
+import pandas as pd
+
+
+def gss_file_columns(path):
+    """ Column names of a GSS SAS file, read from the metadata only (no rows). """
+    _, meta = pyreadstat.read_sas7bdat(path, metadataonly=True)
+    return list(meta.column_names), meta.number_rows
+
+
+def check_columns(path, columns):
+    """ Raise a KeyError naming any requested columns missing from the SAS file. """
+    available, _ = gss_file_columns(path)
+    missing = [col for col in columns if col not in set(available)]
+    if missing:
+        raise KeyError(f"Columns not found in {path}: {missing}")
+
+
+def read_gss_columns(path, columns, chunksize=10000, multiprocess=False, num_processes=4, row_offset=0):
+    """ Read only `columns` from a GSS SAS file, streaming it in row chunks.
+
+    path:          location of the .sas7bdat file
+    columns:       GSS variable names to keep (upper case, as in the SAS file)
+    chunksize:     rows parsed per chunk
+    multiprocess:  spread chunks across worker processes. On Windows the calling
+                   script must be run under an `if __name__ == "__main__":` guard.
+    num_processes: number of worker processes when multiprocess=True
+    row_offset:    rows to skip at the start of the file (e.g. the waves already
+                   ingested from an earlier cumulative release)
+
+    Returns a DataFrame with the columns in the requested order.
+    """
+    columns = list(dict.fromkeys(columns)) # drop duplicates, keep order
+    check_columns(path, columns)
+
+    chunks = []
+    reader = pyreadstat.read_file_in_chunks(pyreadstat.read_sas7bdat, path,
+                                            chunksize=chunksize,
+                                            offset=row_offset,
+                                            multiprocess=multiprocess,
+                                            num_processes=num_processes,
+                                            usecols=columns)
+    for chunk, _ in reader:
+        chunks.append(chunk)
+
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+
+    data = pd.concat(chunks, ignore_index=True)
+    return data[columns]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+GSS column lineage
+Which dashboard columns derive from which GSS variables, and which of them a new
+release (or a change to the recode choices) actually touches.
+
+Every column is a node whose parents are the columns it is computed from:
+    raw GSS variable -> recode target -> index -> z-score / trend column
+e.g. HAPCOHAB -> hapcohab -> haprelate -> happiness_raw -> happiness_z. The
+graph is read off the declarative tables (each Recode's source, coalesce and
+reads; each IndexSpec's items) plus the few edges the codesheet declares for
+steps written as code (wlb, qol, z-scores, trend columns).
+
+Raw columns are content-hashed, as the stage cache does. A derived column's
+lineage hash combines its definition (its Recode / IndexSpec row or edge
+description) with its parents' lineage hashes, Merkle style, so it changes
+exactly when the data or the definition of anything upstream of it changes.
+Diffing two releases is then a comparison of two small hash tables, and the
+columns to recompute are the nodes whose hash changed.
+"""
+
+import pandas as pd
+
+from gss_dashboard_stages import hash_value, column_hashes
+
+
+class LineageGraph:
+    """ Column-level dependency graph of the dashboard tables. """
+
+    def __init__(self):
+        self.parents = {}    # column -> columns it is computed from
+        self.stage = {}      # column -> stage that produces it
+        self.definition = {} # column -> hash of its definition
+
+    def add(self, target, sources, stage, definition=None):
+        sources = [sources] if isinstance(sources, str) else list(sources or [])
+        if target in sources: # a column kept as is (e.g. YEAR) stays a raw column
+            sources.remove(target)
+            if not sources:
+                self.parents.setdefault(target, [])
+                self.stage.setdefault(target, "raw")
+                return
+        for source in sources:
+            if source not in self.parents:
+                self.parents[source] = []
+                self.stage[source] = "raw"
+        self.parents[target] = list(dict.fromkeys(sources))
+        self.stage[target] = stage
+        self.definition[target] = hash_value(definition)
+
+    def add_recodes(self, spec, stage="recodes"):
+        for recode in spec:
+            source = [recode.source] if isinstance(recode.source, str) else list(recode.source or [])
+            self.add(recode.target, source + list(recode.coalesce or []) + list(recode.reads or []),
+                     stage, recode)
+
+    def add_indexes(self, specs, stage):
+        for spec in specs:
+            self.add(spec.name, list(spec.items) + list(spec.count_items or []), stage, spec)
+
+    @property
+    def raw(self):
+        return [col for col, parents in self.parents.items() if not parents]
+
+    def order(self):
+        """ Every column, parents first. """
+        ordered, seen = [], set()
+
+        def visit(col):
+            if col in seen:
+                return
+            seen.add(col)
+            for parent in self.parents[col]:
+                visit(parent)
+            ordered.append(col)
+
+        for col in self.parents:
+            visit(col)
+        return ordered
+
+    def descendants(self, columns):
+        """ Columns computed (directly or not) from `columns`, parents first. """
+        affected = set(columns)
+        for col in self.order():
+            if any(parent in affected for parent in self.parents[col]):
+                affected.add(col)
+        return [col for col in self.order() if col in affected and col not in set(columns)]
+
+    def hashes(self, raw_hashes):
+        """ Lineage hash of every column from the content hashes of the raw ones. """
+        out = {}
+        for col in self.order():
+            if not self.parents[col]:
+                out[col] = raw_hashes.get(col)
+            else:
+                out[col] = hash_value([self.definition[col], [out[p] for p in self.parents[col]]])
+        return out
+
+    def to_frame(self, raw):
+        """ Lineage table: column, stage, parents, hash (one row per column, parents first).
+
+        raw: the raw data frame, or {raw column: content hash}.
+        """
+        if isinstance(raw, pd.DataFrame):
+            raw = column_hashes(raw, [col for col in self.raw if col in raw.columns])
+        hashes = self.hashes(raw)
+        return pd.DataFrame({"column": col, "stage": self.stage[col],
+                             "parents": " ".join(self.parents[col]), "hash": hashes[col]}
+                            for col in self.order())
+
+
+def release_diff(old, new):
+    """ Per-column diff of two lineage tables (e.g. the last build and a new release).
+
+    status: unchanged, changed, added or removed. For changed derived columns,
+    `changed_sources` names the changed raw columns upstream of them (empty when
+    only a definition changed).
+    """
+    merged = old.merge(new, on="column", how="outer", suffixes=("_old", "_new"), sort=False)
+    merged["status"] = "unchanged"
+    merged.loc[merged["hash_old"] != merged["hash_new"], "status"] = "changed"
+    merged.loc[merged["hash_old"].isna(), "status"] = "added"
+    merged.loc[merged["hash_new"].isna(), "status"] = "removed"
+    merged["stage"] = merged["stage_new"].fillna(merged["stage_old"])
+    merged["parents"] = merged["parents_new"].fillna(merged["parents_old"]).fillna("")
+
+    status = dict(zip(merged["column"], merged["status"]))
+    parents = {col: p.split() for col, p in zip(merged["column"], merged["parents"])}
+    changed_raw = {col for col in status if not parents[col] and status[col] != "unchanged"}
+
+    def sources(col, seen):
+        found = []
+        for parent in parents.get(col, []):
+            if parent in seen:
+                continue
+            seen.add(parent)
+            found += [parent] if parent in changed_raw else sources(parent, seen)
+        return found
+
+    merged["changed_sources"] = [" ".join(sorted(set(sources(col, set())))) if s != "unchanged" else ""
+                                 for col, s in zip(merged["column"], merged["status"])]
+    return merged[["column", "stage", "status", "changed_sources", "hash_old", "hash_new"]]
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+GSS polychoric correlations
+Polychoric (ordinal x ordinal) correlations for the Likert batteries, estimated
+for every item pair and year at once.
+
+Two-step estimator: each item's thresholds come from its marginal proportions,
+    tau_c = Phi^-1(P(x <= c))
+and the correlation of a pair is the rho maximizing the multinomial likelihood
+of its contingency table under a bivariate normal cut at those thresholds,
+    logL(rho) = sum_ab n_ab * log P_ab(rho).
+The bivariate normal CDF uses the Sheppard integral
+    Phi2(h, k; rho) = Phi(h) Phi(k)
+        + 1/(2 pi) * int_0^asin(rho) exp(-(h^2 - 2hk sin t + k^2) / (2 cos^2 t)) dt
+with fixed Gauss-Legendre nodes, so it evaluates for every table cell of every
+(pair, year) problem in one array expression. All problems are then maximized
+together by a vectorized golden-section search over rho.
+
+PolychoricCache keeps the matrices per year (and pooled) and exposes the same
+cov()/corr()/alpha() interface as CovarianceCache, so it plugs into
+subset_search() and FactorGrid.fit() for ordinal alpha and ordinal factor
+analysis. Saved results are reused for every year whose tables are unchanged.
+"""
+
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from gss_dashboard_reliability import CovarianceCache
+
+THRESHOLD_CLIP = 8.0        # +-inf thresholds are clipped here (Phi(8) = 1 - 6e-16)
+QUADRATURE_NODES = 20
+GOLDEN_ITERATIONS = 45      # bracket (-.999, .999) shrinks below 1e-9
+RHO_BOUND = 0.999
+_NODES, _WEIGHTS = np.polynomial.legendre.leggauss(QUADRATURE_NODES)
+
+
+def bivariate_normal_cdf(h, k, rho):
+    """ Phi2(h, k; rho) for broadcastable arrays (rho broadcasts against h and k). """
+    h, k, rho = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (h, k, rho)))
+    upper = np.arcsin(rho)[..., None]
+    t = upper * (_NODES + 1) / 2                       # nodes mapped onto [0, asin(rho)]
+    sin_t, cos2_t = np.sin(t), np.cos(t) ** 2
+    hh, kk = h[..., None], k[..., None]
+    integrand = np.exp(-(hh ** 2 - 2 * hh * kk * sin_t + kk ** 2) / (2 * cos2_t))
+    integral = (integrand * _WEIGHTS).sum(axis=-1) * upper[..., 0] / 2
+    return norm.cdf(h) * norm.cdf(k) + integral / (2 * np.pi)
+
+
+def thresholds_from_counts(counts):
+    """ Threshold edges (..., categories + 1) from category counts (..., categories).
+
+    Edges run from -THRESHOLD_CLIP to +THRESHOLD_CLIP; empty categories give
+    repeated edges (zero-probability cells).
+    """
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cumulative = np.cumsum(counts, axis=-1) / total
+        inner = norm.ppf(cumulative[..., :-1])
+    inner = np.clip(np.nan_to_num(inner, nan=THRESHOLD_CLIP), -THRESHOLD_CLIP, THRESHOLD_CLIP)
+    low = np.full(counts.shape[:-1] + (1,), -THRESHOLD_CLIP)
+    high = np.full(counts.shape[:-1] + (1,), THRESHOLD_CLIP)
+    return np.concatenate([low, inner, high], axis=-1)
+
+
+def _cell_probabilities(rho, edges_a, edges_b):
+    """ (problems, A, B) table probabilities for each problem's rho and thresholds. """
+    grid = bivariate_normal_cdf(edges_a[:, :, None], edges_b[:, None, :], rho[:, None, None])
+    return np.diff(np.diff(grid, axis=1), axis=2)
+
+
+def _log_likelihood(rho, tables, edges_a, edges_b):
+    probs = np.clip(_cell_probabilities(rho, edges_a, edges_b), 1e-300, None)
+    return np.where(tables > 0, tables * np.log(probs), 0.0).sum(axis=(1, 2))
+
+
+def _golden_section(tables, edges_a, edges_b):
+    """ Maximum-likelihood rho of every problem, searched together. """
+    ratio = (np.sqrt(5) - 1) / 2
+    low = np.full(len(tables), -RHO_BOUND)
+    high = np.full(len(tables), RHO_BOUND)
+    x1 = high - ratio * (high - low)
+    x2 = low + ratio * (high - low)
+    f1 = _log_likelihood(x1, tables, edges_a, edges_b)
+    f2 = _log_likelihood(x2, tables, edges_a, edges_b)
+    for _ in range(GOLDEN_ITERATIONS):
+        left = f1 > f2 # maximum lies in [low, x2]
+        high = np.where(left, x2, high)
+        low = np.where(left, low, x1)
+        # the surviving interior point is reused; one new point is evaluated
+        new_x1 = np.where(left, high - ratio * (high - low), x2)
+        new_x2 = np.where(left, x1, low + ratio * (high - low))
+        f_new = _log_likelihood(np.where(left, new_x1, new_x2), tables, edges_a, edges_b)
+        f1, f2 = np.where(left, f_new, f2), np.where(left, f1, f_new)
+        x1, x2 = new_x1, new_x2
+    return (low + high) / 2
+
+
+def estimate_polychoric(tables, edges_a, edges_b, processes=1, chunk=512):
+    """ Polychoric rho for a stack of contingency tables and their thresholds.
+
+    tables: (problems, A, B) counts; edges_a/edges_b: (problems, A + 1) and
+    (problems, B + 1) threshold edges. Problems are split into chunks searched in
+    a process pool when processes > 1.
+    """
+    tables = np.asarray(tables, dtype=float)
+    bounds = list(range(0, len(tables), chunk)) + [len(tables)]
+    parts = [(tables[lo:hi], edges_a[lo:hi], edges_b[lo:hi])
+             for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    if processes == 1 or len(parts) < 2:
+        rho = [_golden_section(*part) for part in parts]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            rho = list(pool.map(_golden_section, *zip(*parts)))
+    rho = np.concatenate(rho) if rho else np.empty(0)
+    rho[tables.sum(axis=(1, 2)) == 0] = np.nan # pair never observed together
+    return rho
+
+
+def _item_codes(frame, items):
+    """ (rows x items) category codes (-1 missing) and the category count of each item. """
+    codes, n_categories = [], []
+    for item in items:
+        x = np.asarray(frame[item], dtype=float)
+        present = ~np.isnan(x)
+        categories = np.unique(x[present])
+        code = np.full(len(x), -1)
+        code[present] = np.searchsorted(categories, x[present])
+        codes.append(code)
+        n_categories.append(len(categories))
+    return np.column_stack(codes), n_categories
+
+
+class PolychoricCache(CovarianceCache):
+    """ Polychoric correlation matrices of `items`, per group and pooled. """
+
+    def __init__(self, items, groups, n_rows, rho, pooled, table_keys, by=None):
+        self.items = list(items)
+        self.groups = list(groups)
+        self.by = by
+        self.n_rows = np.asarray(n_rows, dtype=float)
+        self.rho = np.asarray(rho, dtype=float)       # (groups, k, k)
+        self.pooled = np.asarray(pooled, dtype=float) # (k, k)
+        self.table_keys = list(table_keys)            # content hash of each group's tables
+        self._position = {item: i for i, item in enumerate(self.items)}
+        self._group_position = {group: g for g, group in enumerate(self.groups)}
+
+    @classmethod
+    def from_frame(cls, frame, items, by="YEAR", processes=1, previous=None):
+        """ Estimate every pair in every group (and pooled).
+
+        processes: worker processes for the search (1, the default: this process;
+        None: one per core). Use processes > 1 only behind an
+        `if __name__ == "__main__":` guard, as spawned workers re-import the
+        calling script.
+
+        previous: an earlier PolychoricCache of the same items; groups whose
+        contingency tables hash the same reuse its correlations.
+        """
+        items = list(items)
+        k = len(items)
+        codes, n_categories = _item_codes(frame, items)
+        size = max(n_categories)
+
+        if by is None:
+            group_codes, groups = np.zeros(len(frame), dtype=int), [None]
+        else:
+            grouped = frame.groupby(by, sort=True, observed=True)
+            group_codes = grouped.ngroup().to_numpy()
+            groups = list(grouped.groups.keys())
+        n_groups = len(groups)
+        valid_group = group_codes >= 0
+        n_rows = np.bincount(group_codes[valid_group], minlength=n_groups)
+
+        # marginal counts (items, groups, categories) and pair tables (pairs, groups, C, C)
+        marginals = np.zeros((k, n_groups, size))
+        for i in range(k):
+            keep = valid_group & (codes[:, i] >= 0)
+            marginals[i] = np.bincount(group_codes[keep] * size + codes[keep, i],
+                                       minlength=n_groups * size).reshape(n_groups, size)
+        pairs = [(i, j) for i in range(k) for j in range(i + 1, k)]
+        tables = np.zeros((len(pairs), n_groups, size, size))
+        for p, (i, j) in enumerate(pairs):
+            keep = valid_group & (codes[:, i] >= 0) & (codes[:, j] >= 0)
+            cell = (group_codes[keep] * size + codes[keep, i]) * size + codes[keep, j]
+            tables[p] = np.bincount(cell, minlength=n_groups * size * size) \
+                .reshape(n_groups, size, size)
+
+        table_keys = [hashlib.blake2b(marginals[:, g].tobytes() + tables[:, g].tobytes(),
+                                      digest_size=16).hexdigest() for g in range(n_groups)]
+        reuse = {}
+        if previous is not None and previous.items == items:
+            saved = dict(zip(previous.groups, previous.table_keys))
+            reuse = {g: previous.rho[previous._group_position[group]]
+                     for g, group in enumerate(groups) if saved.get(group) == table_keys[g]}
+
+        # one problem per (pair, group) still to estimate, plus the pooled tables
+        todo = [g for g in range(n_groups) if g not in reuse]
+        edges = thresholds_from_counts(marginals)               # (items, groups, C + 1)
+        pooled_edges = thresholds_from_counts(marginals.sum(axis=1))
+        problem_tables = np.concatenate([tables[:, todo].reshape(-1, size, size),
+                                         tables.sum(axis=1)])
+        a_idx = np.array([i for i, _ in pairs])
+        b_idx = np.array([j for _, j in pairs])
+        edges_a = np.concatenate([edges[a_idx][:, todo].reshape(-1, size + 1), pooled_edges[a_idx]])
+        edges_b = np.concatenate([edges[b_idx][:, todo].reshape(-1, size + 1), pooled_edges[b_idx]])
+
+        processes = processes or os.cpu_count() or 1
+        estimates = estimate_polychoric(problem_tables, edges_a, edges_b, processes)
+        by_group = estimates[:len(pairs) * len(todo)].reshape(len(pairs), len(todo))
+
+        rho = np.empty((n_groups, k, k))
+        for g, matrix in reuse.items():
+            rho[g] = matrix
+        iu = (a_idx, b_idx)
+        for t, g in enumerate(todo):
+            rho[g] = np.eye(k)
+            rho[g][iu] = rho[g].T[iu] = by_group[:, t]
+        pooled = np.eye(k)
+        pooled[iu] = pooled.T[iu] = estimates[len(pairs) * len(todo):]
+        return cls(items, groups, n_rows, rho, pooled, table_keys, by)
+
+    def corr(self, items=None, groups=None):
+        """ Polychoric matrix of one group, or pooled (groups=None). """
+        idx, g = self._select(items, groups)
+        if groups is None:
+            matrix = self.pooled
+        elif len(g) == 1:
+            matrix = self.rho[g[0]]
+        else:
+            raise ValueError("polychoric matrices are per group or pooled; pass one group")
+        names = self.items if items is None else list(items)
+        return pd.DataFrame(matrix[np.ix_(idx, idx)], index=names, columns=names)
+
+    # latent items are standardized, so alpha() and subset_search() use the
+    # correlation matrix (ordinal alpha)
+    cov = corr
+
+    def save(self, path):
+        meta = {"items": self.items, "groups": self.groups, "by": self.by,
+                "table_keys": self.table_keys}
+        np.savez_compressed(path, n_rows=self.n_rows, rho=self.rho, pooled=self.pooled,
+                            meta=json.dumps(meta))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        meta = json.loads(str(data["meta"]))
+        groups = [tuple(g) if isinstance(g, list) else g for g in meta["groups"]]
+        return cls(meta["items"], groups, data["n_rows"], data["rho"], data["pooled"],
+                   meta["table_keys"], meta["by"])
+
+    @classmethod
+    def cached(cls, frame, items, path, by="YEAR", processes=1):
+        """ from_frame(), reusing the groups saved at `path` that are unchanged, then saved there. """
+        previous = cls.load(path) if os.path.exists(path) else None
+        result = cls.from_frame(frame, items, by, processes, previous)
+        result.save(path)
+        return result
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+GSS recode compiler
+Turns a declarative recode table into one vectorized pass over the raw columns.
+
+Each Recode row names a target column, the raw GSS column it comes from and how
+to transform it:
+    reverse   value = reverse - x            (e.g. 4 - CONFED)
+    offset    value = x + offset             (e.g. GOD - 1)
+    code_map  {raw code: value}              (e.g. reliten_recodes)
+    labels    {raw code: label}              -> ordered Categorical
+    bins      right-closed bin edges         -> ordered Categorical of `labels`
+    na_codes  raw codes treated as missing before any of the above
+    coalesce  first non-missing of earlier targets (e.g. haprelate)
+    derive    func(columns, raw, **args) for anything else (e.g. SES)
+    reads     earlier targets a derive reads from `columns` (column lineage only)
+
+compile_recodes() builds the code maps into lookup arrays once; applying the plan
+computes every target from its source array and constructs the output frame a
+single time, instead of adding and dropping columns one block at a time.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# code maps with integer keys in this range are applied by direct indexing;
+# anything else falls back to a sorted-key search
+MAX_LOOKUP_SPAN = 4096
+
+
+class Recode(NamedTuple):
+    target: str
+    source: object = None
+    reverse: float = None
+    offset: float = 0
+    code_map: dict = None
+    na_codes: tuple = ()
+    labels: object = None
+    bins: list = None
+    coalesce: list = None
+    derive: object = None
+    args: dict = None
+    reads: list = None
+
+
+class CodeLookup:
+    """ Vectorized {code: value} mapping; unmapped codes and NaN give `missing`. """
+
+    def __init__(self, code_map, missing=np.nan, dtype=float):
+        keys = np.array(list(code_map.keys()), dtype=float)
+        values = np.array(list(code_map.values()), dtype=dtype)
+        self.missing = missing
+        self.dtype = dtype
+
+        integer_keys = len(keys) > 0 and np.all(keys == np.floor(keys))
+        if integer_keys and keys.max() - keys.min() < MAX_LOOKUP_SPAN:
+            self.low = int(keys.min())
+            self.table = np.full(int(keys.max()) - self.low + 1, missing, dtype=dtype)
+            self.table[keys.astype(int) - self.low] = values
+            self.keys = None
+        else:
+            order = np.argsort(keys)
+            self.keys, self.values = keys[order], values[order]
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=float)
+        out = np.full(x.shape, self.missing, dtype=self.dtype)
+        if self.keys is None:
+            idx = x - self.low
+            valid = (idx >= 0) & (idx < len(self.table)) & (idx == np.floor(idx))
+            out[valid] = self.table[idx[valid].astype(int)]
+        else:
+            pos = np.searchsorted(self.keys, x).clip(0, len(self.keys) - 1)
+            valid = self.keys[pos] == x
+            out[valid] = self.values[pos[valid]]
+        return out
+
+
+def _ordered_labels(labels):
+    """ Categories (in first-seen order) and {code: category index} of a label map. """
+    categories = list(dict.fromkeys(labels.values()))
+    index = {label: i for i, label in enumerate(categories)}
+    return categories, {code: index[label] for code, label in labels.items()}
+
+
+class RecodePlan:
+    """ A compiled recode table; call it on a raw frame to get the recoded frame. """
+
+    def __init__(self, spec):
+        self.spec = list(spec)
+        self.steps = [self._compile(recode) for recode in self.spec]
+
+        targets = [recode.target for recode in self.spec]
+        duplicated = {t for t in targets if targets.count(t) > 1}
+        if duplicated:
+            raise ValueError(f"Recode targets defined more than once: {sorted(duplicated)}")
+
+    @property
+    def sources(self):
+        """ Raw columns the plan reads, in first-use order. """
+        cols = []
+        for recode in self.spec:
+            if recode.source is None:
+                continue
+            cols.extend([recode.source] if isinstance(recode.source, str) else recode.source)
+        return list(dict.fromkeys(cols))
+
+    def _compile(self, recode):
+        if recode.derive is not None or recode.coalesce is not None:
+            return None
+        if recode.labels is not None and recode.bins is None:
+            categories, codes = _ordered_labels(recode.labels)
+            return categories, CodeLookup(codes, missing=-1, dtype=np.int16)
+        if recode.code_map is not None:
+            return CodeLookup(recode.code_map)
+        return None
+
+    def __call__(self, raw):
+        columns = {}
+        for recode, step in zip(self.spec, self.steps):
+            columns[recode.target] = self._apply(recode, step, raw, columns)
+        return pd.DataFrame(columns, index=raw.index)
+
+    def _apply(self, recode, step, raw, columns):
+        if recode.derive is not None:
+            return recode.derive(columns, raw, **(recode.args or {}))
+
+        if recode.coalesce is not None:
+            out = np.array(columns[recode.coalesce[0]], dtype=float)
+            for target in recode.coalesce[1:]:
+                out = np.where(np.isnan(out), columns[target], out)
+            return out
+
+        values = raw[recode.source].to_numpy()
+        transformed = (recode.reverse is not None or recode.offset != 0 or len(recode.na_codes)
+                       or step is not None or recode.bins is not None)
+        if not transformed:
+            return values # straight copy keeps the source dtype
+
+        x = values.astype(float)
+        if len(recode.na_codes):
+            x = np.where(np.isin(x, recode.na_codes), np.nan, x)
+
+        if recode.bins is not None:
+            # right-closed bins, as pd.cut(right=True): (b0, b1], (b1, b2], ...
+            bins = np.asarray(recode.bins, dtype=float)
+            codes = np.searchsorted(bins, x, side="left") - 1
+            codes[~((x > bins[0]) & (x <= bins[-1]))] = -1
+            return pd.Categorical.from_codes(codes, categories=list(recode.labels), ordered=True)
+
+        if isinstance(step, tuple):
+            categories, lookup = step
+            return pd.Categorical.from_codes(lookup(x), categories=categories, ordered=True)
+
+        if step is not None:
+            x = step(x)
+        if recode.reverse is not None:
+            x = recode.reverse - x
+        return x + recode.offset
+
+
+def compile_recodes(spec):
+    return RecodePlan(spec)
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+GSS reliability engine
+Cronbach's alpha for any item subset, per year (or any grouping), from cached
+pairwise-covariance sufficient statistics.
+
+One grouped pass over the respondent rows stores, for every group and every item
+pair (i, j), over the rows where both items are present:
+    N[i, j]    number of rows
+    Sx[i, j]   sum of item i
+    Sxx[i, j]  sum of item i squared
+    Sxy[i, j]  sum of item i * item j
+plus the group's total row count. Pairwise-complete covariances (as
+DataFrame.cov, which pingouin.cronbach_alpha uses) follow from these:
+    cov[i, j] = (Sxy[i, j] - Sx[i, j] * Sx[j, i] / N[i, j]) / (N[i, j] - 1)
+The statistics are additive, so pooled or multi-year values are sums over groups.
+Alpha, alpha-if-item-deleted and the F-based confidence intervals (as pingouin)
+are then computed for any items/groups without touching respondent rows again.
+
+subset_search() scores every item subset of a battery (alpha, mean inter-item
+correlation, per-year alpha stability) from the same matrices and flags the
+Pareto-best subsets.
+"""
+
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import f
+
+
+def alpha_from_matrix(cov, n, ci=0.95):
+    """ Cronbach's alpha and its F-based CI from a (k x k) covariance matrix.
+
+    n is the number of respondent rows, as pingouin.cronbach_alpha. Passing a
+    correlation matrix gives standardized alpha.
+    """
+    cov = np.asarray(cov, dtype=float)
+    k = cov.shape[0]
+    if k < 2:
+        raise ValueError("Cronbach's alpha needs at least two items")
+    alpha = (k / (k - 1)) * (1 - np.trace(cov) / cov.sum())
+
+    level = 1 - ci
+    df1 = n - 1
+    df2 = df1 * (k - 1)
+    lower = 1 - (1 - alpha) * f.isf(level / 2, df1, df2)
+    upper = 1 - (1 - alpha) * f.isf(1 - level / 2, df1, df2)
+    return alpha, np.round([lower, upper], 3)
+
+
+def alpha_if_deleted(cov):
+    """ Alpha of the remaining items when each item is dropped in turn. """
+    cov = np.asarray(cov, dtype=float)
+    k = cov.shape[0]
+    if k < 3:
+        raise ValueError("alpha-if-item-deleted needs at least three items")
+    diag = np.diag(cov)
+    totals = cov.sum() - 2 * cov.sum(axis=1) + diag
+    traces = np.trace(cov) - diag
+    return ((k - 1) / (k - 2)) * (1 - traces / totals)
+
+
+class CovarianceCache:
+    """ Pairwise-complete covariance sufficient statistics of `items`, per group. """
+
+    def __init__(self, items, groups, n_rows, N, Sx, Sxx, Sxy, shift, by=None):
+        self.items = list(items)
+        self.groups = list(groups)
+        self.by = by
+        self.n_rows = np.asarray(n_rows, dtype=float) # (groups,)
+        self.N = np.asarray(N, dtype=float)           # (groups, k, k)
+        self.Sx = np.asarray(Sx, dtype=float)         # (groups, k, k)
+        self.Sxx = np.asarray(Sxx, dtype=float)       # (groups, k, k)
+        self.Sxy = np.asarray(Sxy, dtype=float)       # (groups, k, k)
+        self.shift = np.asarray(shift, dtype=float)   # (k,) values are stored minus this
+        self._position = {item: i for i, item in enumerate(self.items)}
+        self._group_position = {group: g for g, group in enumerate(self.groups)}
+
+    @classmethod
+    def from_frame(cls, frame, items, by="YEAR", shift=None):
+        """ One grouped pass over `frame` (by=None: a single pooled group).
+
+        shift: centering of the stored sums (default: the item means); extend()
+        passes the cache's own so the new groups add to the old ones.
+        """
+        items = list(items)
+        x = np.column_stack([np.asarray(frame[item], dtype=float) for item in items])
+        if shift is None:
+            shift = np.nanmean(x, axis=0) # centering keeps the sums numerically stable
+            shift = np.where(np.isnan(shift), 0.0, shift)
+
+        if by is None:
+            codes, groups = np.zeros(len(frame), dtype=int), [None]
+        else:
+            grouped = frame.groupby(by, sort=True, observed=True)
+            codes = grouped.ngroup().to_numpy()
+            groups = list(grouped.groups.keys())
+
+        # sort rows by group once; each group is then a contiguous slice
+        valid = codes >= 0
+        order = np.argsort(codes[valid], kind="stable")
+        x, codes = x[valid][order], codes[valid][order]
+        bounds = np.searchsorted(codes, np.arange(len(groups) + 1))
+
+        k, n_groups = len(items), len(groups)
+        n_rows = np.diff(bounds)
+        N, Sx, Sxx, Sxy = (np.zeros((n_groups, k, k)) for _ in range(4))
+        for g in range(n_groups):
+            block = x[bounds[g]:bounds[g + 1]]
+            present = ~np.isnan(block)
+            filled = np.where(present, block - shift, 0.0)
+            mask = present.astype(float)
+            N[g] = mask.T @ mask
+            Sx[g] = filled.T @ mask
+            Sxx[g] = (filled ** 2).T @ mask
+            Sxy[g] = filled.T @ filled
+        return cls(items, groups, n_rows, N, Sx, Sxx, Sxy, shift, by)
+
+    ##########################################################################
+    ## Matrices
+
+    def _select(self, items, groups):
+        idx = np.arange(len(self.items)) if items is None else \
+            np.array([self._position[item] for item in items])
+        if groups is None:
+            g = np.arange(len(self.groups))
+        else:
+            groups = groups if isinstance(groups, (list, tuple, np.ndarray)) else [groups]
+            g = np.array([self._group_position[group] for group in groups])
+        return idx, g
+
+    def stats(self, items=None, groups=None):
+        """ Summed (n_rows, N, Sx, Sxx, Sxy) over `groups` (default: all, i.e. pooled). """
+        idx, g = self._select(items, groups)
+        sub = np.ix_(idx, idx)
+        return (self.n_rows[g].sum(),
+                self.N[g].sum(axis=0)[sub],
+                self.Sx[g].sum(axis=0)[sub],
+                self.Sxx[g].sum(axis=0)[sub],
+                self.Sxy[g].sum(axis=0)[sub])
+
+    def n(self, groups=None):
+        """ Respondent rows in `groups` (the n of the alpha confidence interval). """
+        _, g = self._select(None, groups)
+        return self.n_rows[g].sum()
+
+    def cov(self, items=None, groups=None):
+        """ Pairwise-complete covariance matrix (NaN where a pair has < 2 rows). """
+        _, N, Sx, _, Sxy = self.stats(items, groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cov = (Sxy - Sx * Sx.T / N) / (N - 1)
+        cov[N < 2] = np.nan
+        names = self.items if items is None else list(items)
+        return pd.DataFrame(cov, index=names, columns=names)
+
+    def corr(self, items=None, groups=None):
+        """ Pairwise-complete Pearson correlations (as DataFrame.corr). """
+        _, N, Sx, Sxx, Sxy = self.stats(items, groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cross = Sxy - Sx * Sx.T / N
+            ss = Sxx - Sx ** 2 / N # item i's sum of squares on the rows shared with j
+            corr = cross / np.sqrt(ss * ss.T)
+        corr[N < 2] = np.nan
+        names = self.items if items is None else list(items)
+        return pd.DataFrame(corr, index=names, columns=names)
+
+    ##########################################################################
+    ## Reliability
+
+    def alpha(self, items=None, groups=None, ci=0.95):
+        """ (alpha, [ci_low, ci_high]) for `items` over `groups`, as pingouin.cronbach_alpha. """
+        return alpha_from_matrix(self.cov(items, groups).to_numpy(), self.n(groups), ci)
+
+    def alpha_if_deleted(self, items=None, groups=None):
+        names = self.items if items is None else list(items)
+        values = alpha_if_deleted(self.cov(items, groups).to_numpy())
+        return pd.Series(values, index=names, name="alpha_if_deleted")
+
+    def alpha_table(self, items=None, ci=0.95):
+        """ Alpha and CI for every cached group (e.g. every year). """
+        rows = []
+        for group in self.groups:
+            alpha, (lower, upper) = self.alpha(items, group, ci)
+            rows.append([group, self.n(group), alpha, lower, upper])
+        table = pd.DataFrame(rows, columns=[self.by or "group", "n", "alpha", "ci_low", "ci_high"])
+        return table.set_index(self.by or "group")
+
+    ##########################################################################
+    ## Persistence
+
+    def save(self, path):
+        """ Save the statistics (.npz) so later runs skip the respondent pass. """
+        meta = {"items": self.items, "groups": self.groups, "by": self.by}
+        np.savez_compressed(path, n_rows=self.n_rows, N=self.N, Sx=self.Sx, Sxx=self.Sxx,
+                            Sxy=self.Sxy, shift=self.shift, meta=json.dumps(meta))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        meta = json.loads(str(data["meta"]))
+        groups = [tuple(g) if isinstance(g, list) else g for g in meta["groups"]]
+        return cls(meta["items"], groups, data["n_rows"], data["N"], data["Sx"],
+                   data["Sxx"], data["Sxy"], data["shift"], meta["by"])
+
+    def extend(self, frame):
+        """ Cache with the groups of `frame` (e.g. a new wave) added.
+
+        Only the new rows are read; groups already cached are replaced.
+        """
+        if self.by is None:
+            raise ValueError("a pooled cache cannot be extended by group")
+        new = CovarianceCache.from_frame(frame, self.items, self.by, shift=self.shift)
+        keep = [g for g, group in enumerate(self.groups) if group not in set(new.groups)]
+        return CovarianceCache(self.items, [self.groups[g] for g in keep] + new.groups,
+                               np.concatenate([self.n_rows[keep], new.n_rows]),
+                               *(np.concatenate([old[keep], add]) for old, add in
+                                 [(self.N, new.N), (self.Sx, new.Sx), (self.Sxx, new.Sxx),
+                                  (self.Sxy, new.Sxy)]),
+                               self.shift, self.by)
+
+
+##############################################################################
+## Item-subset search
+##############################################################################
+
+SUBSET_OBJECTIVES = {"alpha": "max", "mean_r": "max", "year_alpha_sd": "min"}
+
+
+def _gray_subset(i, k):
+    """ Boolean membership of the i-th subset in Gray-code order. """
+    g = i ^ (i >> 1)
+    return np.array([(g >> j) & 1 for j in range(k)], dtype=bool)
+
+
+def _score_gray_range(cov, corr, missing, year_cov, year_missing, min_size, start, stop):
+    """ Score the subsets start .. stop-1 of the Gray-code sequence.
+
+    Consecutive Gray codes differ by one item, so the covariance and correlation
+    row sums of the current subset (pooled and per year) are updated by adding
+    or removing one column per step; each subset's total variance, trace and
+    inter-item correlation sum then follow in O(k) per year. Pairs never
+    observed together enter the sums as 0 and are counted in `missing`, so a
+    subset is NaN only while it contains one.
+    """
+    k = cov.shape[0]
+    member = _gray_subset(start, k)
+    diag, diag_year = np.diag(cov), np.diagonal(year_cov, axis1=1, axis2=2)
+    row_cov = cov[:, member].sum(axis=1)
+    row_corr = corr[:, member].sum(axis=1)
+    row_pair_missing = missing[:, member].sum(axis=1)
+    row_year = year_cov[:, :, member].sum(axis=2)          # (years, k)
+    row_missing = year_missing[:, :, member].sum(axis=2)   # (years, k)
+
+    codes, rows = [], []
+    for i in range(start, stop):
+        if i > start:
+            j = (i & -i).bit_length() - 1 # the item that flips between codes i-1 and i
+            sign = -1.0 if member[j] else 1.0
+            member[j] = not member[j]
+            row_cov += sign * cov[:, j]
+            row_corr += sign * corr[:, j]
+            row_pair_missing += sign * missing[:, j]
+            row_year += sign * year_cov[:, :, j]
+            row_missing += sign * year_missing[:, :, j]
+
+        size = member.sum()
+        if size < min_size:
+            continue
+        if row_pair_missing[member].sum() == 0:
+            alpha = (size / (size - 1)) * (1 - diag[member].sum() / row_cov[member].sum())
+            mean_r = (row_corr[member].sum() - size) / (size * (size - 1))
+        else: # a pair of the subset was never asked together
+            alpha = mean_r = np.nan
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            year_alpha = (size / (size - 1)) * \
+                (1 - diag_year[:, member].sum(axis=1) / row_year[:, member].sum(axis=1))
+        year_alpha = year_alpha[row_missing[:, member].sum(axis=1) == 0] # years asking every item
+
+        codes.append(i ^ (i >> 1))
+        if len(year_alpha):
+            rows.append([size, alpha, mean_r, len(year_alpha), year_alpha.mean(),
+                         year_alpha.min(), year_alpha.std(ddof=1) if len(year_alpha) > 1 else np.nan])
+        else:
+            rows.append([size, alpha, mean_r, 0, np.nan, np.nan, np.nan])
+    return codes, rows
+
+
+def subset_search(cache, items=None, min_size=2, processes=1):
+    """ Score every subset of `items` with at least `min_size` items.
+
+    All scores come from the cached matrices: pooled alpha, mean inter-item
+    correlation, and alpha in each cached group (year) that asked every item of
+    the subset, summarised as its mean, minimum and standard deviation. The
+    2^k Gray-code sequence is split into contiguous ranges scored in a process
+    pool (processes=1, the default, scores in this process; None: one per core).
+    Run it with processes > 1 only from behind an `if __name__ == "__main__":`
+    guard, as spawned workers re-import the calling script.
+
+    Returns a DataFrame, one row per subset, with a `pareto` column flagging the
+    subsets not dominated on SUBSET_OBJECTIVES.
+    """
+    items = cache.items if items is None else list(items)
+    k = len(items)
+    if min_size < 2:
+        raise ValueError("subsets need at least two items for alpha")
+
+    cov = cache.cov(items).to_numpy()
+    corr = cache.corr(items).to_numpy()
+    missing = (np.isnan(cov) | np.isnan(corr)).astype(float) # pairs never asked together
+    cov, corr = np.nan_to_num(cov), np.nan_to_num(corr)
+    year_cov = np.stack([cache.cov(items, group).to_numpy() for group in cache.groups])
+    year_missing = np.isnan(year_cov).astype(float)
+    year_cov = np.nan_to_num(year_cov)
+
+    n_subsets = 2 ** k
+    processes = processes or os.cpu_count() or 1
+    n_ranges = processes if n_subsets >= 4096 else 1
+    bounds = np.linspace(0, n_subsets, n_ranges + 1).astype(int)
+    args = [(cov, corr, missing, year_cov, year_missing, min_size, lo, hi)
+            for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    if n_ranges == 1 or processes == 1:
+        results = [_score_gray_range(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_score_gray_range, *zip(*args)))
+
+    codes = [code for part_codes, _ in results for code in part_codes]
+    rows = [row for _, part_rows in results for row in part_rows]
+    table = pd.DataFrame(rows, columns=["size", "alpha", "mean_r", "n_years", "year_alpha_mean",
+                                        "year_alpha_min", "year_alpha_sd"])
+    table.insert(0, "items", [tuple(item for j, item in enumerate(items) if (code >> j) & 1)
+                              for code in codes])
+    table["pareto"] = pareto_front(table)
+    return table.sort_values(["pareto", "alpha"], ascending=False, ignore_index=True)
+
+
+def pareto_front(table, objectives=None):
+    """ Boolean mask of the rows of `table` not dominated on `objectives`.
+
+    objectives: {column: "max" | "min"}. Rows with a missing objective are never
+    on the front.
+    """
+    objectives = objectives or SUBSET_OBJECTIVES
+    scores = np.column_stack([table[col].to_numpy(dtype=float) * (1 if sense == "max" else -1)
+                              for col, sense in objectives.items()])
+    valid = ~np.isnan(scores).any(axis=1)
+    front = np.zeros(len(table), dtype=bool)
+
+    # walk rows best-first on the first objective; a row is on the front unless a
+    # row already on it is at least as good everywhere and better somewhere
+    kept = np.empty((0, scores.shape[1]))
+    for i in np.lexsort(-scores[:, ::-1].T):
+        if not valid[i]:
+            continue
+        row = scores[i]
+        dominated = ((kept >= row).all(axis=1) & (kept > row).any(axis=1)).any()
+        if not dominated:
+            front[i] = True
+            kept = np.vstack([kept, row])
+    return front
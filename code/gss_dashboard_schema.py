@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+GSS compact schema
+Smallest dtypes that hold each stage table, and how much memory they save.
+
+The recodes leave every Likert item a float64 (NaN for missing) although it only
+takes a handful of small integer codes, and the long cube / weighted tables
+repeat a few measure and dimension names as strings on every row. Compacting:
+    integer-valued floats      -> smallest nullable int (Int8 for the items: one
+                                  byte per code plus one for the missing mask),
+                                  or the smallest int when nothing is missing
+    integers                   -> smallest int (e.g. YEAR int16)
+    low-cardinality strings    -> Categorical (int8 codes + one copy of each label)
+    other floats (z-scores...) -> float32, only for the columns allowed to round
+Categoricals are kept as they are (pandas already stores their codes as int8).
+The NaN-based numpy kernels (indexes, imputation, cube) do not take nullable
+ints, so stage inputs are handed out through float_view(): each nullable int
+column becomes float32 with NaN for missing, only for the duration of the stage.
+
+What this buys is uneven. The item tables (gss_rawdata, recodes) shrink about
+3.5x from float64, the cube 4.5-7x and the weighted trends about 2.4x. The
+respondent-level z-score and trend tables are mostly non-integer floats, so
+exact compacting saves about 1.1x on them, and float32 rounding (--compact
+float32) at most 2x. There is no 5-10x saving on those. The memory report
+(--memory-report) lists the ratio for every stage.
+"""
+
+import numpy as np
+import pandas as pd
+
+FLOAT32_EXACT = 2 ** 24 # every integer below this is exact in float32
+MAX_CATEGORY_SHARE = 0.5 # strings become categorical when unique values <= this share of rows
+
+
+def _integral(values):
+    finite = values[~np.isnan(values)]
+    return len(finite) == 0 or (np.all(finite == np.floor(finite)) and np.abs(finite).max() < FLOAT32_EXACT)
+
+
+def _nullable_int(values):
+    """ Smallest pandas nullable integer dtype holding the integral `values` (NaN: missing). """
+    finite = values[~np.isnan(values)]
+    low, high = (finite.min(), finite.max()) if len(finite) else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return pd.api.types.pandas_dtype(np.dtype(dtype).name.capitalize())
+    return pd.Int64Dtype()
+
+
+def compact_dtype(series, lossy=False):
+    """ Smallest dtype that holds `series` (exactly, unless `lossy` floats may round to float32). """
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(dtype):
+        return dtype
+    if pd.api.types.is_integer_dtype(dtype):
+        return pd.to_numeric(series, downcast="integer").dtype if len(series) else dtype
+    if pd.api.types.is_float_dtype(dtype):
+        values = series.to_numpy(dtype=float)
+        if _integral(values):
+            if not np.isnan(values).any() and len(values):
+                return pd.to_numeric(series, downcast="integer").dtype
+            return _nullable_int(values)
+        return np.dtype(np.float32) if lossy else dtype
+    if pd.api.types.is_string_dtype(dtype) or dtype == object:
+        n_unique = series.nunique(dropna=True)
+        if len(series) and n_unique <= MAX_CATEGORY_SHARE * len(series):
+            return pd.CategoricalDtype(pd.unique(series.dropna()))
+    return dtype
+
+
+def compact_frame(frame, lossy=()):
+    """ Copy of `frame` with every column in its compact dtype.
+
+    lossy: columns whose non-integer floats may be rounded to float32 (True: all,
+           False: none).
+    """
+    lossy = set(frame.columns) if lossy is True else set(lossy or ())
+    out = {}
+    for col in frame.columns:
+        dtype = compact_dtype(frame[col], col in lossy)
+        out[col] = frame[col] if dtype == frame[col].dtype else frame[col].astype(dtype)
+    return pd.DataFrame(out, index=frame.index)
+
+
+def float_view(frame):
+    """ Copy of `frame` with its nullable int columns as float32 (NaN for missing), for numpy kernels. """
+    out = frame.copy()
+    for col in frame.columns:
+        dtype = frame[col].dtype
+        if isinstance(dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(dtype):
+            out[col] = frame[col].to_numpy(dtype=np.float32, na_value=np.nan)
+    return out
+
+
+def frame_bytes(frame):
+    """ Memory of a frame in bytes, strings included. """
+    return int(frame.memory_usage(index=False, deep=True).sum())
+
+
+def memory_report(frames, lossy=False):
+    """ Memory per table as stored and as compacted: one row per {name: frame}.
+
+    Columns: stage, rows, columns, mb, compact_mb, ratio (stored / compact).
+    """
+    rows = []
+    for name, frame in frames.items():
+        stored = frame_bytes(frame)
+        compact = frame_bytes(compact_frame(frame, lossy))
+        rows.append((name, len(frame), frame.shape[1], stored / 1e6, compact / 1e6,
+                     stored / compact if compact else np.nan))
+    return pd.DataFrame(rows, columns=["stage", "rows", "columns", "mb", "compact_mb", "ratio"])
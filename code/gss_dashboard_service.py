@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+GSS query service
+A small localhost HTTP service answering dashboard queries from the aggregates.
+
+The cube, the yearly trend table and the distribution table are read once from
+the stage cache (with the waves added by --append) and indexed in memory; a query is then a dictionary lookup plus
+a filter on a few dozen rows. Responses are JSON (default) or an Arrow IPC
+stream (format=arrow). Answers are kept in an LRU cache keyed by the normalized
+query, and each carries an ETag (the data version plus the query), so a client
+that sends If-None-Match gets an empty 304.
+
+Endpoints (GET):
+    /trend?measure=religiosity_z&dimension=degree&level=Bachelors
+        yearly count / mean / sd of a z measure from the cube; dimension_2 and
+        level_2 for the 2-way pairs (in either order); no dimension: all respondents
+    /yearly?columns=religiosity_trend,qol_trend    rows of the yearly trend table
+    /distribution?dimension=party                  yearly level counts and shares
+    /meta                                          measures, dimensions and levels
+
+Runs on asyncio alone (no web framework):
+    python gss_dashboard_service.py --project-dir "C:/Data Projects/GSS/dashboard project"
+"""
+
+import os
+import io
+import json
+import asyncio
+import hashlib
+import argparse
+from functools import lru_cache
+from urllib.parse import urlsplit, parse_qsl
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from gss_dashboard_cache import APPENDED_DIR, load_with_appended, stage_path
+from gss_dashboard_cube import ALL
+
+STAGES = {"cube": "dashboard_cube", "yearly": "dashboard_yearly_trends",
+          "distribution": "dashboard_distributions"}
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+STATUS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+          405: "Method Not Allowed"}
+
+
+class QueryError(Exception):
+    """ A query the service cannot answer; carries the HTTP status. """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class TrendStore:
+    """ The dashboard aggregates, indexed for lookups. """
+
+    def __init__(self, cube, yearly, distribution=None, version=""):
+        if cube is None:
+            raise ValueError(f"the service needs the cube (stage '{STAGES['cube']}')")
+        self.version = version
+        self.yearly = yearly
+        self.distribution = distribution
+        cube = cube.copy()
+        cube["dimension_2"] = cube["dimension_2"].astype(object).fillna("") # "": one-way rows
+        cube["mean"] = cube["sum"] / cube["count"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cube["sd"] = np.sqrt((cube["sumsq"] - cube["sum"] ** 2 / cube["count"]) / (cube["count"] - 1))
+        columns = ["YEAR", "level", "level_2", "count", "mean", "sd"]
+        # (measure, dimension, dimension_2) -> its rows
+        self.slices = {key: rows[columns].reset_index(drop=True)
+                       for key, rows in cube.groupby(["measure", "dimension", "dimension_2"],
+                                                     observed=True, sort=False)}
+        self.measures = sorted(cube["measure"].unique())
+        self.levels = {dim: sorted(map(str, rows["level"].unique()))
+                       for dim, rows in cube[cube["dimension_2"] == ""].groupby("dimension", observed=True)}
+
+    @classmethod
+    def from_cache(cls, cache_dir):
+        """ Load the aggregates (and appended waves) from a stage cache.
+
+        The version is the save times of the artifacts and of their appended rows.
+        """
+        frames = {name: load_with_appended(stage, cache_dir=cache_dir, memory_map=False)
+                  if os.path.exists(stage_path(stage, cache_dir)) else None
+                  for name, stage in STAGES.items()}
+        if frames["cube"] is None:
+            raise FileNotFoundError(f"Stage '{STAGES['cube']}' has not been built yet: "
+                                    f"{stage_path(STAGES['cube'], cache_dir)}")
+        paths = [stage_path(stage, directory) for stage in STAGES.values()
+                 for directory in (cache_dir, os.path.join(cache_dir, APPENDED_DIR))]
+        stamps = [os.stat(path).st_mtime_ns for path in paths if os.path.exists(path)]
+        version = hashlib.blake2b(json.dumps(stamps).encode(), digest_size=8).hexdigest()
+        return cls(frames["cube"], frames["yearly"], frames["distribution"], version)
+
+    def trend(self, measure, dimension=ALL, level=None, dimension_2=None, level_2=None):
+        """ Rows of one view; a 2-way pair may be asked in either dimension order. """
+        key = (measure, dimension, dimension_2 or "")
+        swapped = (measure, dimension_2, dimension)
+        if key not in self.slices and dimension_2 and swapped in self.slices:
+            rows = self.slices[swapped]
+            rows = rows.rename(columns={"level": "level_2", "level_2": "level"})[rows.columns]
+        elif key in self.slices:
+            rows = self.slices[key]
+        else:
+            raise QueryError(404, f"no cube rows for measure={measure} dimension={dimension}"
+                                  + (f" dimension_2={dimension_2}" if dimension_2 else ""))
+        if level is not None:
+            rows = rows[rows["level"] == level]
+        if level_2 is not None:
+            rows = rows[rows["level_2"] == level_2]
+        if rows.empty:
+            raise QueryError(404, f"no rows for level={level}"
+                                  + (f" level_2={level_2}" if level_2 else "")
+                                  + f"; levels: {self.levels.get(dimension, [])}")
+        drop = ["level_2"] if dimension_2 is None else []
+        return rows.drop(columns=drop + (["level"] if dimension == ALL else []))
+
+    def yearly_columns(self, columns=None):
+        if self.yearly is None:
+            raise QueryError(404, "the yearly trend table has not been built")
+        if columns is None:
+            return self.yearly
+        missing = [col for col in columns if col not in self.yearly.columns]
+        if missing:
+            raise QueryError(404, f"unknown yearly columns: {missing}")
+        return self.yearly[["YEAR"] + [col for col in columns if col != "YEAR"]]
+
+    def distributions(self, dimension):
+        if self.distribution is None:
+            raise QueryError(404, "the distribution table has not been built")
+        rows = self.distribution[self.distribution["dimension"] == dimension]
+        if rows.empty:
+            raise QueryError(404, f"unknown dimension '{dimension}'")
+        return rows.drop(columns="dimension")
+
+
+def _encode(frame, fmt):
+    if fmt == "arrow":
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue(), ARROW_TYPE
+    return frame.to_json(orient="records").encode("utf-8"), "application/json"
+
+
+class QueryService:
+    """ Query answering with an LRU cache of encoded responses and ETags. """
+
+    def __init__(self, store, cache_size=1024):
+        self.store = store
+        self.answer = lru_cache(maxsize=cache_size)(self._answer)
+        # raw request targets -> answers, so a repeated URL skips parsing too
+        self.targets = lru_cache(maxsize=cache_size)(self.lookup)
+
+    def _answer(self, path, query):
+        """ (body, content type, etag) of a normalized query (a sorted tuple of pairs). """
+        params = dict(query)
+        fmt = params.pop("format", "json")
+        if fmt not in ("json", "arrow"):
+            raise QueryError(400, f"unknown format '{fmt}' (json or arrow)")
+
+        if path == "/trend":
+            if "measure" not in params:
+                raise QueryError(400, "trend queries need a measure")
+            frame = self.store.trend(params["measure"], params.get("dimension", ALL), params.get("level"),
+                                     params.get("dimension_2"), params.get("level_2"))
+        elif path == "/yearly":
+            columns = params["columns"].split(",") if "columns" in params else None
+            frame = self.store.yearly_columns(columns)
+        elif path == "/distribution":
+            if "dimension" not in params:
+                raise QueryError(400, "distribution queries need a dimension")
+            frame = self.store.distributions(params["dimension"])
+        elif path == "/meta":
+            body = json.dumps({"measures": self.store.measures, "levels": self.store.levels}).encode("utf-8")
+            return body, "application/json", self._etag(path, query)
+        else:
+            raise QueryError(404, f"unknown endpoint '{path}'")
+        body, content_type = _encode(frame, fmt)
+        return body, content_type, self._etag(path, query)
+
+    def _etag(self, path, query):
+        digest = hashlib.blake2b(repr((self.store.version, path, query)).encode(), digest_size=12)
+        return '"' + digest.hexdigest() + '"'
+
+    def lookup(self, target):
+        """ Answer of a raw request target, normalized (parameter order does not matter). """
+        url = urlsplit(target)
+        return self.answer(url.path, tuple(sorted(parse_qsl(url.query))))
+
+    def respond(self, method, target, headers):
+        """ (status, headers, body) of one request. """
+        if method != "GET":
+            return 405, {"Allow": "GET"}, b""
+        try:
+            body, content_type, etag = self.targets(target)
+        except QueryError as error:
+            return error.status, {"Content-Type": "application/json"}, \
+                json.dumps({"error": str(error)}).encode("utf-8")
+        if headers.get("if-none-match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"Content-Type": content_type, "ETag": etag, "Cache-Control": "no-cache"}, body
+
+    ##########################################################################
+    ## asyncio HTTP/1.1 server (GET only, keep-alive)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                request_line, *lines = request.decode("latin-1").split("\r\n")
+                method, target, version = request_line.split()
+                headers = {}
+                for line in lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                status, out_headers, body = self.respond(method, target, headers)
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                out_headers.update({"Content-Length": str(len(body)),
+                                    "Connection": "keep-alive" if keep_alive else "close"})
+                head = f"HTTP/1.1 {status} {STATUS[status]}\r\n" + \
+                    "".join(f"{name}: {value}\r\n" for name, value in out_headers.items()) + "\r\n"
+                writer.write(head.encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        print(f"serving the GSS dashboard aggregates on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the GSS dashboard aggregates on localhost.")
+    parser.add_argument("--project-dir", default=".", help="directory holding stage_cache")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-size", type=int, default=1024, help="responses kept in the LRU cache")
+    args = parser.parse_args(argv)
+
+    store = TrendStore.from_cache(os.path.join(args.project_dir, "stage_cache"))
+    asyncio.run(QueryService(store, args.cache_size).serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
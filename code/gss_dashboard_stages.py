@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+GSS stage runner
+Runs the codesheet parts as a dependency graph of cached, content-hashed stages.
+
+Each stage is keyed by a hash of:
+    - its name and the source code of its function, and of the helpers and
+      project modules it delegates to (Stage code=)
+    - its parameters (recode maps, thresholds, ...)
+    - the content of the columns it reads from its upstream stages
+so a key changes whenever anything upstream of the stage changes. A stage whose
+key matches the one saved next to its artifact in the stage cache is loaded
+instead of recomputed, and is only loaded at all if a stale stage downstream
+needs it. Changing one index definition therefore only recomputes that index
+and the stages that read it. A compacting pipeline stores every output in its
+smallest dtypes (gss_dashboard_schema) before it is saved or read downstream.
+
+Every artifact is saved with a content hash per column (name.columns.json), and
+a stage reading (name, [columns]) is keyed on the hashes of just those columns.
+A recomputed stage whose columns come out unchanged therefore stops the rebuild
+there (early cutoff): a new release that only revises HAPCOHAB recomputes the
+recodes, but not a downstream stage that does not read the happiness columns.
+"""
+
+import os
+import json
+import hashlib
+import inspect
+import importlib
+
+import pandas as pd
+
+from gss_dashboard_cache import CACHE_DIR, save_stage, load_stage, stage_exists
+from gss_dashboard_schema import compact_frame, float_view
+
+COMPACT_MODES = (None, "exact", "float32")
+
+
+def _json_default(value):
+    # functions inside parameters (e.g. derived recodes) are keyed by their source
+    if callable(value):
+        return function_source(value)
+    return str(value)
+
+
+def hash_value(value):
+    """ Stable hex digest of a JSON-serializable value (dict keys are sorted). """
+    text = json.dumps(value, sort_keys=True, default=_json_default)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def column_hash(series):
+    """ Content hash of one column (values and dtype, not the index). """
+    values = pd.util.hash_pandas_object(series, index=False).to_numpy()
+    digest = hashlib.blake2b(values.tobytes(), digest_size=16)
+    digest.update(str(series.dtype).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def column_hashes(frame, columns=None):
+    """ {column: content hash} of a frame's columns (default: all). """
+    return {col: column_hash(frame[col]) for col in (frame.columns if columns is None else columns)}
+
+
+def file_fingerprint(path):
+    """ Cheap identity of a source file: path, size and modification time.
+
+    Hashing the multi-GB SAS file itself would cost as much as reading it, so
+    the ingest stage is keyed on this instead.
+    """
+    if not os.path.exists(path):
+        return {"path": path}
+    info = os.stat(path)
+    return {"path": path, "size": info.st_size, "mtime_ns": info.st_mtime_ns}
+
+
+def function_source(func):
+    """ Source of a function, class or module (a module may be given by name). """
+    if isinstance(func, str):
+        func = importlib.import_module(func)
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return getattr(func, "__module__", "") + "." + getattr(func, "__qualname__", func.__name__)
+
+
+class Stage:
+    """ One step of the pipeline.
+
+    name:    artifact name in the stage cache
+    func:    called as func(*input_frames, **params, **options); returns a DataFrame
+    inputs:  upstream stage names, or (name, [columns]) to read only some columns
+    params:  settings that change the output; part of the stage key
+    options: settings that do not change the output (chunk sizes, process
+             counts); passed to func but not hashed
+    compact: whether a compacting pipeline may shrink the output's dtypes
+             (False for small parameter tables that must keep full precision)
+    code:    helpers func delegates to (functions, classes, or modules by name,
+             e.g. "gss_dashboard_indexes"); their source is part of the key, so
+             editing them recomputes the stage
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, options=None, compact=True, code=()):
+        self.name = name
+        self.func = func
+        self.inputs = [(inp, None) if isinstance(inp, str) else (inp[0], list(inp[1]))
+                       for inp in inputs]
+        self.params = params or {}
+        self.options = options or {}
+        self.compact = compact
+        self.code = list(code)
+
+
+class Pipeline:
+    """ A set of stages run against one stage cache directory.
+
+    compact: None keeps every output as its stage returns it; "exact" stores
+    outputs in their smallest lossless dtypes and "float32" also rounds their
+    other floats to float32 (c.f., gss_dashboard_schema).
+    """
+
+    def __init__(self, stages, cache_dir=CACHE_DIR, compact=None):
+        if compact not in COMPACT_MODES:
+            raise ValueError(f"unknown compact mode '{compact}' (use one of {COMPACT_MODES})")
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.compact = compact
+        self._keys = {}
+        self._frames = {}
+        self._hashes = {}
+        self.computed = []
+
+    def key(self, name):
+        """ Content hash of a stage: its code, params and the content of its inputs.
+
+        Inputs that are not up to date are brought up to date first, since their
+        content is only known once they have run.
+        """
+        if name not in self._keys:
+            self._keys[name] = self._stage_key(name, self.content_key)
+        return self._keys[name]
+
+    def _stage_key(self, name, input_key):
+        stage = self.stages[name]
+        return hash_value({
+            "name": name,
+            "source": [function_source(code) for code in [stage.func] + stage.code],
+            "params": stage.params,
+            "compact": self.compact if stage.compact else None,
+            "inputs": [(inp, cols, input_key(inp, cols)) for inp, cols in stage.inputs],
+        })
+
+    def content_key(self, name, columns=None):
+        """ Hash of the content of a stage's output columns (default: all). """
+        if not self.is_fresh(name):
+            self.get(name)
+        return self._hash_columns(self.column_hashes(name), columns)
+
+    @staticmethod
+    def _hash_columns(hashes, columns):
+        return hash_value(hashes if columns is None else [(col, hashes.get(col)) for col in columns])
+
+    def _key_path(self, name):
+        return os.path.join(self.cache_dir, name + ".key")
+
+    def _hash_path(self, name):
+        return os.path.join(self.cache_dir, name + ".columns.json")
+
+    def saved_key(self, name):
+        if not stage_exists(name, self.cache_dir) or not os.path.exists(self._key_path(name)):
+            return None
+        with open(self._key_path(name)) as f:
+            return f.read().strip()
+
+    def column_hashes(self, name):
+        """ {column: content hash} of a stage's saved output (hashed once if missing). """
+        if name not in self._hashes:
+            if os.path.exists(self._hash_path(name)):
+                with open(self._hash_path(name)) as f:
+                    self._hashes[name] = json.load(f)
+            else:
+                self._save_hashes(name, self.get(name))
+        return self._hashes[name]
+
+    def _save_hashes(self, name, frame):
+        self._hashes[name] = column_hashes(frame)
+        with open(self._hash_path(name), "w") as f:
+            json.dump(self._hashes[name], f, indent=1)
+
+    def is_fresh(self, name):
+        return self.saved_key(name) == self.key(name)
+
+    def stale(self, targets=None):
+        """ Stages that a run of `targets` would recompute, in run order.
+
+        Nothing is run: a stage is listed if its key no longer matches, or if an
+        input is listed (whether its columns will come out unchanged is only known
+        by running it, so this is an upper bound on what run() recomputes).
+        """
+        stale = []
+        for name in self.order(targets):
+            inputs = [inp for inp, _ in self.stages[name].inputs]
+            if any(inp in stale for inp in inputs) or \
+                    self.saved_key(name) != self._stage_key(name, self._saved_content_key):
+                stale.append(name)
+        return stale
+
+    def _saved_content_key(self, name, columns=None):
+        if not os.path.exists(self._hash_path(name)) and name not in self._hashes:
+            return None
+        return self._hash_columns(self.column_hashes(name), columns)
+
+    def order(self, targets=None):
+        """ Stages needed for `targets` (default: all), upstream first. """
+        targets = list(self.stages) if targets is None else list(targets)
+        ordered, seen = [], set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for inp, _ in self.stages[name].inputs:
+                visit(inp)
+            ordered.append(name)
+
+        for name in targets:
+            visit(name)
+        return ordered
+
+    def get(self, name, columns=None):
+        """ Output of a stage, loaded from the cache or (re)computed.
+
+        Computed frames are kept for the stages downstream; each caller gets its
+        own copy, so a stage that edits its input in place cannot change what a
+        sibling reads (or what was hashed and saved). Compact Int8 items are
+        handed out as float32 (float_view).
+        """
+        if name not in self._frames:
+            if self.is_fresh(name):
+                return float_view(load_stage(name, columns, self.cache_dir))
+            self._frames[name] = self._compute(name)
+        frame = self._frames[name]
+        return float_view(frame if columns is None else frame[columns])
+
+    def _compute(self, name):
+        stage = self.stages[name]
+        inputs = [self.get(inp, cols) for inp, cols in stage.inputs]
+        print(f"[stage] computing {name}")
+        frame = stage.func(*inputs, **stage.params, **stage.options)
+        if self.compact and stage.compact:
+            frame = compact_frame(frame, lossy=self.compact == "float32")
+
+        save_stage(frame, name, self.cache_dir)
+        self._save_hashes(name, frame)
+        with open(self._key_path(name), "w") as f:
+            f.write(self.key(name))
+        self.computed.append(name)
+        return frame
+
+    def run(self, targets=None, force=()):
+        """ Bring `targets` (default: every stage) up to date.
+
+        force: stage names to recompute even if their key is unchanged.
+        Returns the names of the stages that were recomputed.
+        """
+        for name in force:
+            if os.path.exists(self._key_path(name)):
+                os.remove(self._key_path(name))
+        targets = list(self.stages) if targets is None else list(targets)
+        for name in targets:
+            if not self.is_fresh(name):
+                self.get(name)
+        return list(self.computed)
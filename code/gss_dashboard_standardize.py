@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+GSS standardization registry
+Mean and sd of every standardized variable, fitted once and kept with the stage
+artifacts, so z-scores are an affine map of the raw column rather than a refit.
+
+Each variable keeps streaming (Welford) moments: the count n, the mean and
+M2 = sum (x - mean)^2 of its non-missing values. A chunk b of new rows is merged
+into the running moments a with Chan et al.'s update
+    delta = mean_b - mean_a
+    n     = n_a + n_b
+    mean  = mean_a + delta * n_b / n
+    M2    = M2_a + M2_b + delta^2 * n_a * n_b / n
+so the parameters can be fitted in row chunks, merged across partial fits, or
+updated with a new wave without revisiting the history. sd = sqrt(M2 / (n - ddof)):
+ddof=1 is the sample sd (pandas .std()), ddof=0 the population sd (StandardScaler).
+
+The registry round-trips through a small table (variable, count, mean, m2), which
+is how it is saved as a stage artifact. z-scores are only computed when a column
+is asked for: zscore() for one series, view() for a lazy {column: z} mapping over
+a frame, e.g. a new wave scored against the reference parameters:
+    registry = StandardizationRegistry.from_frame(load_stage("z_params"))
+    registry.view(new_wave)["conf_raw"]
+"""
+
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+PARAM_COLUMNS = ["variable", "count", "mean", "m2"]
+
+
+def chunk_moments(values):
+    """ Per-column count, mean and M2 of a (rows x columns) array with NaN missing. """
+    present = ~np.isnan(values)
+    count = present.sum(axis=0).astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(present, values, 0.0).sum(axis=0) / count
+    mean = np.where(count > 0, mean, 0.0)
+    m2 = (np.where(present, values - mean, 0.0) ** 2).sum(axis=0)
+    return count, mean, m2
+
+
+def merge_moments(a, b):
+    """ Combine two (count, mean, M2) triples of the same columns. """
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = np.where(n > 0, n_b / n, 0.0)
+    return n, mean_a + delta * share, m2_a + m2_b + delta ** 2 * n_a * share
+
+
+class StandardizationRegistry:
+    """ Fitted mean / sd of named variables. """
+
+    def __init__(self):
+        self.moments = {} # variable -> (count, mean, m2)
+
+    def __contains__(self, variable):
+        return variable in self.moments
+
+    @property
+    def variables(self):
+        return list(self.moments)
+
+    def update(self, frame, columns=None, chunk=65536):
+        """ Merge the non-missing values of `columns` (default: all) into the moments.
+
+        Rows are read in chunks of `chunk`; variables not seen before start empty.
+        Returns self, so StandardizationRegistry().update(frame, columns) fits.
+        """
+        columns = list(frame.columns if columns is None else columns)
+        if not columns:
+            return self
+        start = [self.moments.get(col, (0.0, 0.0, 0.0)) for col in columns]
+        total = tuple(np.array(stat, dtype=float) for stat in zip(*start))
+        for lo in range(0, len(frame), chunk):
+            values = frame[columns].iloc[lo:lo + chunk].to_numpy(dtype=float)
+            total = merge_moments(total, chunk_moments(values))
+        for col, n, mean, m2 in zip(columns, *total):
+            self.moments[col] = (float(n), float(mean), float(m2))
+        return self
+
+    fit = update
+
+    def merge(self, other):
+        """ Registry of the pooled data of self and other (e.g. two partial fits). """
+        out = StandardizationRegistry()
+        for var in dict.fromkeys(self.variables + other.variables):
+            a = self.moments.get(var, (0.0, 0.0, 0.0))
+            b = other.moments.get(var, (0.0, 0.0, 0.0))
+            out.moments[var] = tuple(float(x) for x in merge_moments(np.array(a), np.array(b)))
+        return out
+
+    def params(self, variable, ddof=1):
+        """ (mean, sd) of a variable; a zero sd is returned as 1 (as StandardScaler). """
+        if variable not in self.moments:
+            raise KeyError(f"'{variable}' has not been fitted in the standardization registry")
+        n, mean, m2 = self.moments[variable]
+        sd = np.sqrt(m2 / (n - ddof)) if n > ddof else np.nan
+        return mean, sd if sd != 0 else 1.0
+
+    def zscore(self, series, variable=None, ddof=1):
+        """ z-scores of a series with the fitted parameters of `variable` (default: its name). """
+        mean, sd = self.params(series.name if variable is None else variable, ddof)
+        return (series.astype(float) - mean) / sd # float64 even for compact (float32) columns
+
+    def view(self, frame, ddof=1):
+        """ Lazy {column: z-score series} mapping over the fitted columns of `frame`. """
+        return ZScoreView(self, frame, ddof)
+
+    def to_frame(self):
+        """ Parameter table: variable, count, mean, m2 (one row per variable). """
+        rows = [(var, *stats) for var, stats in self.moments.items()]
+        return pd.DataFrame(rows, columns=PARAM_COLUMNS)
+
+    @classmethod
+    def from_frame(cls, table):
+        registry = cls()
+        for var, n, mean, m2 in table[PARAM_COLUMNS].itertuples(index=False):
+            registry.moments[var] = (float(n), float(mean), float(m2))
+        return registry
+
+
+class ZScoreView(Mapping):
+    """ z-scores of a frame's columns, computed (once) when a column is requested. """
+
+    def __init__(self, registry, frame, ddof=1):
+        self.registry = registry
+        self.frame = frame
+        self.ddof = ddof
+        self._done = {}
+
+    def __getitem__(self, column):
+        if column not in self._done:
+            self._done[column] = self.registry.zscore(self.frame[column], ddof=self.ddof)
+        return self._done[column]
+
+    def __iter__(self):
+        return (col for col in self.frame.columns if col in self.registry)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_frame(self, columns=None, suffix="_z"):
+        """ DataFrame of the z-scores of `columns` (default: every fitted column). """
+        columns = list(self if columns is None else columns)
+        return pd.DataFrame({col + suffix: self[col] for col in columns}, index=self.frame.index)
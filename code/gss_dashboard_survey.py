@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+GSS survey-weighted estimates
+Weighted means and Taylor-linearized standard errors for every measure x year x
+dimension cell, using the GSS weights and variance strata / PSUs.
+
+For a cell (domain) d and measure y, the weighted mean is the ratio
+    ybar_d = sum_i w_i y_i / sum_i w_i     (rows of d with y present)
+and its linearized score is z_i = w_i (y_i - ybar_d) / sum w for those rows
+(0 elsewhere). With-replacement PSU variance:
+    var(ybar_d) = sum_h n_h / (n_h - 1) * sum_j (z_hj - zbar_h)^2
+where z_hj is the total of z in PSU j of stratum h and n_h the stratum's PSU
+count. Strata with a single PSU contribute nothing.
+
+Every sum above is a product with a sparse one-hot matrix (rows x cells,
+rows x cell-PSUs, cell-PSUs x cell-strata, cell-strata x cells) applied to all
+measures at once, so no cell, stratum or measure is looped over in Python.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import norm
+
+from gss_dashboard_cube import ALL, encode_dimensions
+
+
+def design_keys(years, strata, psus):
+    """ Integer stratum and PSU ids, nested in year.
+
+    Rows without design variables (e.g. early waves) become their own PSU in one
+    stratum per year, i.e. simple random sampling with replacement.
+    """
+    years = np.asarray(years, dtype=float)
+    strata = np.asarray(strata, dtype=float)
+    psus = np.asarray(psus, dtype=float)
+    missing = np.isnan(strata) | np.isnan(psus)
+    row_ids = np.arange(len(years), dtype=float)
+    strata = np.where(missing, -1.0, strata)
+    psus = np.where(missing, row_ids, psus)
+    stratum = pd.MultiIndex.from_arrays([years, strata]).factorize()[0]
+    psu = pd.MultiIndex.from_arrays([stratum, np.where(missing, -1.0, 0.0), psus]).factorize()[0]
+    return stratum, psu
+
+
+def _onehot(keys, n_keys):
+    """ Sparse (rows x keys) indicator; rows with a negative key are empty. """
+    keep = np.flatnonzero(keys >= 0)
+    return sparse.csr_matrix((np.ones(len(keep)), (keep, keys[keep])), shape=(len(keys), n_keys))
+
+
+def domain_estimates(values, weights, cells, n_cells, stratum, psu):
+    """ Weighted means, Taylor SEs, unweighted n and weight totals per (cell, measure).
+
+    values:  (rows x measures) with NaN missing
+    weights: (rows,) survey weights; rows with a missing or zero weight are skipped
+    cells:   (rows,) cell code per row (-1: in no cell)
+    stratum, psu: integer design ids (design_keys)
+    Returns four (cells x measures) arrays.
+    """
+    weights = np.nan_to_num(np.asarray(weights, dtype=float))
+    present = ~np.isnan(values) & (weights > 0)[:, None] & (cells >= 0)[:, None]
+    w = np.where(present, weights[:, None], 0.0)
+    wy = np.where(present, values * weights[:, None], 0.0)
+
+    in_cell = _onehot(cells, n_cells).T.tocsr()                   # cells x rows
+    total_w = in_cell @ w
+    n = in_cell @ present.astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (in_cell @ wy) / total_w
+
+        # linearized scores of every row for its own cell
+        row_cell = np.where(cells >= 0, cells, 0)
+        z = np.where(present, w * (values - mean[row_cell]) / total_w[row_cell], 0.0)
+
+    # PSU totals of z within each cell
+    n_psu = psu.max() + 1
+    cell_psu, cell_psu_key = pd.factorize(np.where(cells >= 0, cells * n_psu + psu, -1))
+    psu_totals = _onehot(np.asarray(cell_psu), len(cell_psu_key)).T.tocsr() @ z   # cell-PSUs x measures
+    cp_cell = cell_psu_key // n_psu
+    cp_psu = cell_psu_key % n_psu
+
+    # stratum sums over each cell's PSUs; n_h counts every PSU of the stratum
+    psu_stratum = np.zeros(n_psu, dtype=np.int64)
+    psu_stratum[psu] = stratum
+    psus_per_stratum = np.bincount(psu_stratum, minlength=stratum.max() + 1)
+    n_strata = stratum.max() + 1
+    cell_stratum, cs_key = pd.factorize(cp_cell * n_strata + psu_stratum[cp_psu])
+    to_cs = _onehot(np.asarray(cell_stratum), len(cs_key)).T.tocsr()
+    s1 = to_cs @ psu_totals
+    s2 = to_cs @ psu_totals ** 2
+    n_h = psus_per_stratum[cs_key % n_strata].astype(float)[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        contribution = np.where(n_h > 1, n_h / (n_h - 1) * (s2 - s1 ** 2 / n_h), 0.0)
+    variance = _onehot(cs_key // n_strata, n_cells).T.tocsr() @ contribution
+    variance[n == 0] = np.nan
+    return mean, np.sqrt(np.maximum(variance, 0)), n, total_w
+
+
+def weighted_estimates(frame, measures, weight, stratum, psu, dimensions=(), year="YEAR", level=0.95):
+    """ Long table of weighted yearly means with SEs and CIs, overall and by dimension.
+
+    frame:      respondent rows with the measures, the year, the dimensions and
+                the design columns
+    weight:     weight column
+    stratum, psu: design id columns (integer, see design_keys)
+    Returns one row per (year, dimension level, measure) with n > 0.
+    """
+    measures = list(measures)
+    values = frame[measures].to_numpy(dtype=float)
+    weights = frame[weight].to_numpy(dtype=float)
+    strata, psus = frame[stratum].to_numpy(), frame[psu].to_numpy()
+    year_codes, years = pd.factorize(frame[year], sort=True)
+    years = np.asarray(years)
+    encoded = encode_dimensions(frame, dimensions)
+    z_crit = norm.ppf(0.5 + level / 2)
+
+    blocks = []
+    for dim in [None] + list(dimensions):
+        if dim is None:
+            cells, labels = year_codes, [ALL]
+        else:
+            codes, labels = encoded[dim]
+            cells = np.where(codes >= 0, year_codes * len(labels) + codes, -1)
+        n_cells = len(years) * len(labels)
+        mean, se, n, total_w = domain_estimates(values, weights, cells, n_cells, strata, psus)
+
+        cell, measure = np.nonzero(n)
+        blocks.append(pd.DataFrame({
+            year: years[cell // len(labels)],
+            "dimension": ALL if dim is None else dim,
+            "level": np.asarray(labels, dtype=object)[cell % len(labels)],
+            "measure": np.asarray(measures, dtype=object)[measure],
+            "n": n[cell, measure],
+            "weight_total": total_w[cell, measure],
+            "mean": mean[cell, measure],
+            "se": se[cell, measure],
+            "ci_low": mean[cell, measure] - z_crit * se[cell, measure],
+            "ci_high": mean[cell, measure] + z_crit * se[cell, measure],
+        }))
+    return pd.concat(blocks, ignore_index=True)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+GSS static tiles
+Every dashboard view pre-rendered as a small compressed JSON file, for embeds
+that cannot run the query service.
+
+One tile per measure x dimension (or dimension pair) holds the whole view: the
+years, and per level the yearly count, mean and sd,
+    tiles/religiosity_z/degree.json.gz
+    {"measure":"religiosity_z","dimension":"degree","years":[1972,...],
+     "levels":{"Bachelors":{"n":[...],"mean":[...],"sd":[...]},...}}
+plus tiles/yearly.json.gz with the yearly trend table. Values are rounded to
+`digits` decimals and written without whitespace; each tile is stored gzipped
+(and brotli-compressed too when the brotli package is installed), so a static
+host can serve the precompressed file as is.
+
+manifest.json lists every tile with the blake2b hash of its JSON. A rerun
+compares the hashes with the previous manifest and only compresses and writes
+the tiles whose content changed; tiles of views that no longer exist are
+removed. Compression is spread over a process pool.
+"""
+
+import os
+import gzip
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError: # optional: gzip tiles only
+    brotli = None
+
+from gss_dashboard_service import TrendStore
+
+MANIFEST = "manifest.json"
+
+
+def _values(array, digits):
+    """ JSON-ready list: rounded floats (ints for digits=0), None for NaN / inf (e.g. sd of n=1). """
+    cast = int if digits == 0 else (lambda x: round(x, digits))
+    return [cast(float(x)) if np.isfinite(x) else None for x in np.asarray(array, dtype=float)]
+
+
+def view_tile(rows, measure, dimension, dimension_2, digits=4):
+    """ Tile payload of one cube slice (rows: YEAR, level, level_2, count, mean, sd). """
+    years = sorted(rows["YEAR"].unique())
+    position = {year: i for i, year in enumerate(years)}
+    levels = {}
+    keys = ["level"] + (["level_2"] if dimension_2 else [])
+    for key, group in rows.groupby(keys, observed=True, sort=True):
+        name = "|".join(map(str, key if isinstance(key, tuple) else (key,))) # pairs: "level|level_2"
+        slot = np.array([position[year] for year in group["YEAR"]])
+        series = {}
+        for field, column in [("n", "count"), ("mean", "mean"), ("sd", "sd")]:
+            full = np.full(len(years), np.nan)
+            full[slot] = group[column].to_numpy(dtype=float)
+            series[field] = _values(full, 0 if field == "n" else digits)
+        levels[name] = series
+    tile = {"measure": measure, "dimension": dimension, "years": [int(year) for year in years],
+            "levels": levels}
+    if dimension_2:
+        tile["dimension_2"] = dimension_2
+    return tile
+
+
+def tile_name(measure, dimension, dimension_2=""):
+    return f"{measure}/{dimension}" + (f"__{dimension_2}" if dimension_2 else "")
+
+
+def build_tiles(cube, yearly, digits=4):
+    """ {tile name: JSON bytes} of every view in the cube, plus the yearly table. """
+    store = TrendStore(cube, yearly)
+    tiles = {}
+    for (measure, dimension, dimension_2), rows in store.slices.items():
+        tile = view_tile(rows, measure, dimension, dimension_2, digits)
+        tiles[tile_name(measure, dimension, dimension_2)] = _dump(tile)
+    columns = [col for col in yearly.columns if col != "YEAR"]
+    tiles["yearly"] = _dump({"years": [int(year) for year in yearly["YEAR"]],
+                             "columns": {col: _values(yearly[col], digits) for col in columns}})
+    return tiles
+
+
+def _dump(payload):
+    return json.dumps(payload, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+
+def _write_tiles(root, items, use_brotli):
+    """ Compress and write (name, JSON bytes) tiles; returns their compressed sizes. """
+    sizes = {}
+    for name, data in items:
+        path = os.path.join(root, name + ".json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        packed = gzip.compress(data, compresslevel=9, mtime=0) # mtime=0: same bytes for the same tile
+        _replace(path + ".gz", packed)
+        sizes[name] = {"gzip": len(packed)}
+        if use_brotli:
+            packed = brotli.compress(data, quality=11)
+            _replace(path + ".br", packed)
+            sizes[name]["br"] = len(packed)
+    return sizes
+
+
+def _replace(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def write_bundle(cube, yearly, root, digits=4, processes=None, chunk=64):
+    """ Write the tile bundle under `root`, rewriting only changed tiles.
+
+    processes: worker processes for compression (None: cpu count, 1: inline).
+    Returns the manifest (also written to root/manifest.json).
+    """
+    tiles = build_tiles(cube, yearly, digits)
+    hashes = {name: hashlib.blake2b(data, digest_size=16).hexdigest() for name, data in tiles.items()}
+
+    manifest_path = os.path.join(root, MANIFEST)
+    old = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            old = json.load(f)["tiles"]
+    use_brotli = brotli is not None
+    extensions = [".gz"] + ([".br"] if use_brotli else [])
+
+    def written(name):
+        return all(os.path.exists(os.path.join(root, name + ".json" + ext)) for ext in extensions)
+
+    changed = [name for name in tiles
+               if old.get(name, {}).get("hash") != hashes[name] or not written(name)]
+    chunks = [[(name, tiles[name]) for name in changed[lo:lo + chunk]] for lo in range(0, len(changed), chunk)]
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(chunks) <= 1:
+        parts = [_write_tiles(root, items, use_brotli) for items in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(_write_tiles, [root] * len(chunks), chunks, [use_brotli] * len(chunks)))
+    sizes = {name: size for part in parts for name, size in part.items()}
+
+    for name in set(old) - set(tiles): # views that no longer exist
+        for ext in (".gz", ".br"):
+            path = os.path.join(root, name + ".json" + ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+    manifest = {"digits": digits, "encodings": ["gzip"] + (["br"] if use_brotli else []),
+                "changed": len(changed),
+                "tiles": {name: {"hash": hashes[name], "bytes": len(tiles[name]),
+                                 **(sizes[name] if name in sizes else
+                                    {k: v for k, v in old[name].items() if k in ("gzip", "br")})}
+                          for name in sorted(tiles)}}
+    os.makedirs(root, exist_ok=True)
+    _replace(manifest_path, json.dumps(manifest, indent=1).encode("utf-8"))
+    return manifest